@@ -8,6 +8,9 @@ from typing import Dict, Any, Optional, List
 import uuid
 from langgraph.types import interrupt, Command
 from langgraph.prebuilt import create_react_agent
+from langgraph.prebuilt.chat_agent_executor import AgentState
+from langchain_core.messages import BaseMessage, SystemMessage, RemoveMessage
+from typing_extensions import NotRequired
 from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 import uvicorn
 from contextlib import asynccontextmanager
@@ -282,6 +285,33 @@ async def parse_messages(messages: List[Any]) -> None:
         print(f"消息 ID: {msg_id}")
         print("-" * 50)
 
+# 智能体状态 系统提示词作为单独字段保存，每轮覆盖而不是追加到消息列表中
+class ChatAgentState(AgentState):
+    system_prompt: NotRequired[str]
+
+# 动态组装大模型输入 在调用大模型时注入系统提示词，不写入会话状态
+def build_prompt(state: ChatAgentState) -> List[BaseMessage]:
+    # 过滤旧版本写入会话状态的系统消息，只保留一条系统消息
+    messages = [message for message in state["messages"] if not isinstance(message, SystemMessage)]
+    system_prompt = state.get("system_prompt")
+    if system_prompt:
+        return [SystemMessage(content=system_prompt)] + messages
+    return messages
+
+# 清理单个会话中旧版本每轮写入的系统消息 返回删除的消息数，存在待恢复的中断时跳过并返回None
+async def migrate_thread_system_messages(session_id: str) -> Optional[int]:
+    config = {"configurable": {"thread_id": session_id}}
+    state = await app.state.agent.aget_state(config)
+    # 中断中的会话修改状态会影响恢复，待会话完成后再迁移
+    if state.next:
+        return None
+    system_messages = [message for message in state.values.get("messages", []) if isinstance(message, SystemMessage)]
+    if not system_messages:
+        return 0
+    await app.state.agent.aupdate_state(config, {"messages": [RemoveMessage(id=message.id) for message in system_messages]})
+    logger.info(f"会话 {session_id} 删除了 {len(system_messages)} 条系统消息")
+    return len(system_messages)
+
 # 处理智能体返回结果 可能是中断，也可能是最终结果
 async def process_agent_result(
         session_id: str,
@@ -380,6 +410,8 @@ async def lifespan(app: FastAPI):
             app.state.agent = create_react_agent(
                 model=llm_chat,
                 tools=tools,
+                prompt=build_prompt,
+                state_schema=ChatAgentState,
                 checkpointer=checkpointer
             )
             logger.info("Agent初始化成功")
@@ -435,15 +467,14 @@ async def invoke_agent(request: AgentRequest):
     last_updated = time.time()
     await app.state.session_manager.update_session(user_id, status, last_query, last_response, last_updated)
 
-    # 构造智能体输入消息体
+    # 构造智能体输入消息体 系统提示词不写入消息列表，在调用大模型时注入
     messages = [
-        {"role": "system", "content": request.system_message},
         {"role": "user", "content": request.query}
     ]
 
     try:
         # 先调用智能体
-        result = await app.state.agent.ainvoke({"messages": messages}, config={"configurable": {"thread_id": session_id}})
+        result = await app.state.agent.ainvoke({"messages": messages, "system_prompt": request.system_message}, config={"configurable": {"thread_id": session_id}})
         # 将返回的messages进行格式化输出 方便查看调试
         await parse_messages(result['messages'])
 
@@ -580,6 +611,30 @@ async def get_system_info():
     logger.info(f"返回当前系统状态信息:{response}")
     return response
 
+# API接口:清理会话状态中旧版本每轮写入的系统消息 不指定user_id时迁移全部用户的会话
+@app.post("/system/migrate/system-messages")
+async def migrate_system_messages(user_id: Optional[str] = None):
+    logger.info(f"调用/system/migrate/system-messages接口，清理会话状态中重复的系统消息，用户:{user_id}")
+    # 一个用户只有一个会话 从用户的会话数据中读取会话ID
+    user_ids = [user_id] if user_id else await app.state.session_manager.get_all_user_ids()
+    session_ids = []
+    for item in user_ids:
+        session = await app.state.session_manager.get_session(item)
+        if session and session.get("session_id"):
+            session_ids.append(session["session_id"])
+
+    migrated, skipped, removed = [], [], 0
+    for session_id in session_ids:
+        count = await migrate_thread_system_messages(session_id)
+        if count is None:
+            skipped.append(session_id)
+        elif count > 0:
+            migrated.append(session_id)
+            removed += count
+    response = {"migrated_sessions": migrated, "skipped_sessions": skipped, "removed_messages": removed}
+    logger.info(f"返回系统消息清理结果:{response}")
+    return response
+
 # API接口:删除用户会话
 @app.delete("/agent/session/{user_id}")
 async def delete_agent_session(user_id: str):
@@ -2,27 +2,37 @@ import logging
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 from pydantic import BaseModel, Field
 import time
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Header, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from pydantic import BaseModel
-from typing import Dict, Any, Optional, List, AsyncGenerator
+from typing import Dict, Any, Optional, List, AsyncGenerator, Callable, Awaitable
+import os
 import uuid
+import hashlib
+import argparse
 from langgraph.types import interrupt, Command
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
-from langgraph.store.postgres import AsyncPostgresStore
-from langchain_core.messages.utils import count_tokens_approximately, trim_messages
-from langchain_core.messages import BaseMessage, AIMessage, ToolMessage
-import uvicorn
-from contextlib import asynccontextmanager
+from langgraph.prebuilt.chat_agent_executor import AgentState
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.messages import BaseMessage, AIMessage, AIMessageChunk, HumanMessage, ToolMessage, SystemMessage, RemoveMessage
+from typing_extensions import NotRequired
+from contextlib import asynccontextmanager, aclosing
 import redis.asyncio as redis
-import json
+import asyncio
 from datetime import timedelta, datetime
-from psycopg_pool import AsyncConnectionPool
-from psycopg.rows import dict_row
 from utils.config import Config
-from utils.llms import get_llm
-from utils.tools import get_tools
+from utils.tool_cache import init_tool_result_cache, get_tool_cache_metrics
+from utils.approval_policy import init_approval_policy, get_approval_metrics
+from utils.speculation import get_speculative_runner, get_speculation_metrics
+from utils.prompt_cache import get_prompt_cache_metrics
+from utils.sse import SSEEncoder
+from utils.idempotency import IdempotencyKeyReused, IdempotencyInProgress, request_fingerprint, init_idempotency_store, get_idempotency_store, get_idempotency_metrics
+from utils.run_control import CANCEL_SAFE_NODES, AgentRun, watch_disconnect, get_run_registry, get_run_cancellation_stats, get_run_cancellation_metrics
+from utils.session_codec import get_session_codec, SessionRecord, HASH_META_FIELDS, HASH_RESPONSE_FIELD
+from utils.redis_conn import create_redis_client, create_pubsub_client, session_key, user_sessions_key, parse_user_sessions_key, run_heartbeat_key, get_redis_connection_info
+from utils.session_near_cache import SessionNearCache, init_session_near_cache, get_session_near_cache_metrics, close_session_near_cache
+from utils.startup import get_startup_tracker, worker_pool_sizes
+from utils.http_client import warmup_http_connections, keep_http_connections_warm, get_http_pool_metrics, close_http_clients
 
 
 
@@ -74,7 +84,7 @@ class LongMemRequest(BaseModel):
 class AgentResponse(BaseModel):
     # 会话唯一标识
     session_id: str
-    # 三个状态：interrupted, completed, error
+    # 四个状态：interrupted, completed, error, cancelled
     status: str
     # 时间戳
     timestamp: float = Field(default_factory=lambda: time.time())
@@ -85,6 +95,15 @@ class AgentResponse(BaseModel):
     # interrupted时的中断消息
     interrupt_data: Optional[Dict[str, Any]] = None
 
+# 定义数据模型 客户端批量查询会话状态的请求数据
+class BatchStatusRequest(BaseModel):
+    # 用户唯一标识
+    user_id: str
+    # 需要查询的会话ID列表
+    session_ids: List[str] = Field(..., max_length=200)
+    # 返回的字段，默认不返回last_response
+    fields: Optional[List[str]] = None
+
 # 定义数据模型 客户端发起的恢复智能体运行的中断反馈请求数据
 class InterruptResponse(BaseModel):
     # 用户唯一标识
@@ -92,9 +111,34 @@ class InterruptResponse(BaseModel):
     # 会话唯一标识
     session_id: str
     # 响应类型：accept(允许调用), edit(调整工具参数，此时args中携带修改后的调用参数), response(直接反馈信息，此时args中携带修改后的调用参数)，reject(不允许调用)
-    response_type: str
+    # 存在多个待审查的工具调用且未提供responses时，该响应应用于全部工具调用
+    response_type: Optional[str] = None
     # 如果是edit, response类型，可能需要额外的参数
     args: Optional[Dict[str, Any]] = None
+    # 批量审查：interrupt_id -> {"type": 响应类型, "args": 额外参数}，一次性逐个处理全部待审查的工具调用
+    responses: Optional[Dict[str, Dict[str, Any]]] = None
+
+# 定义数据模型 客户端发起的取消智能体运行的请求数据
+class CancelRequest(BaseModel):
+    # 用户唯一标识
+    user_id: str
+    # 会话唯一标识
+    session_id: str
+    # 取消原因
+    reason: Optional[str] = None
+
+# 定义数据模型 取消智能体运行的响应数据
+class CancelResponse(BaseModel):
+    # 用户唯一标识
+    user_id: str
+    # 会话唯一标识
+    session_id: str
+    # 状态：cancelling(已通知正在运行的进程), cancelled(已取消), not_running(会话没有可取消的运行)
+    status: str
+    # 收到取消请求的后端进程数
+    delivered: int = 0
+    # 提示消息
+    message: Optional[str] = None
 
 # 定义数据模型 系统内的会话状态响应数据
 class SystemInfoResponse(BaseModel):
@@ -119,7 +163,7 @@ class SessionStatusResponse(BaseModel):
     user_id: str
     # 会话唯一标识
     session_id: Optional[str] = None
-    # 状态：not_found, idle, running, interrupted, completed, error
+    # 状态：not_found, idle, running, interrupted, completed, error, cancelled, stale(运行所在进程已退出)
     status: str
     # error时的提示消息
     message: Optional[str] = None
@@ -148,18 +192,83 @@ class StreamChunk(BaseModel):
     error_message: Optional[str] = None
 
 
+# 整体写入会话记录并设置过期时间 使用单键脚本保证原子性，集群模式下同样适用
+WRITE_SESSION_SCRIPT = """
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# 只写入变化的字段并续期 不读取和重写last_response
+# 返回1表示更新成功，0表示会话不存在，-1表示旧版本的字符串格式记录
+UPDATE_SESSION_SCRIPT = """
+local key_type = redis.call('TYPE', KEYS[1])['ok']
+if key_type == 'none' then return 0 end
+if key_type ~= 'hash' then return -1 end
+if #ARGV > 1 then redis.call('HSET', KEYS[1], unpack(ARGV, 2)) end
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+# 原子地将会话切换为running状态 会话不存在时直接创建，已有进行中的运行时不修改
+# 会话为running状态时，只有心跳键不存在且状态更新已超过心跳过期时间（运行所在进程已退出）才允许接管
+# 返回1表示切换成功，2表示接管了已失去心跳的运行，3表示新建了会话，0表示已有进行中的运行，-1表示旧版本的字符串格式记录
+CLAIM_SESSION_SCRIPT = """
+local key_type = redis.call('TYPE', KEYS[1])['ok']
+if key_type == 'none' then
+    redis.call('HSET', KEYS[1], 'version', 1, unpack(ARGV, 4))
+    redis.call('EXPIRE', KEYS[1], ARGV[1])
+    return 3
+end
+if key_type ~= 'hash' then return -1 end
+local result = 1
+if redis.call('HGET', KEYS[1], 'status') == '"running"' then
+    local last_updated = tonumber(redis.call('HGET', KEYS[1], 'last_updated') or '')
+    if redis.call('EXISTS', KEYS[2]) == 1 or last_updated == nil
+            or tonumber(ARGV[2]) - last_updated <= tonumber(ARGV[3]) then
+        return 0
+    end
+    result = 2
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return result
+"""
+
+# 原子地将中断的会话切换为running状态 检查状态与写入在同一个脚本中完成，并发的恢复请求只有一个成功
+# 返回1表示切换成功，0表示会话不存在或不是中断状态，-1表示旧版本的字符串格式记录
+RESUME_SESSION_SCRIPT = """
+local key_type = redis.call('TYPE', KEYS[1])['ok']
+if key_type == 'none' then return 0 end
+if key_type ~= 'hash' then return -1 end
+if redis.call('HGET', KEYS[1], 'status') ~= '"interrupted"' then return 0 end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
 # 实现redis相关方法 支持多用户多会话
 class RedisSessionManager:
     # 初始化 RedisSessionManager 实例
-    # 配置 Redis 连接参数和默认会话超时时间
-    def __init__(self, redis_host: str, redis_port: int, redis_db: int, session_timeout: int):
+    # 按Config.REDIS_MODE连接单节点、哨兵或集群，配置默认会话超时时间
+    def __init__(self, session_timeout: int):
         # 创建 Redis 客户端连接
-        self.redis_client = redis.Redis(
-            host=redis_host,
-            port=redis_port,
-            db=redis_db,
-            decode_responses=True
-        )
+        self.redis_client = create_redis_client(decode_responses=True)
+        # 会话记录为二进制格式，使用不解码响应的客户端读写
+        self.raw_client = create_redis_client(decode_responses=False)
+        # 会话记录编解码器
+        self.codec = get_session_codec()
+        # 注册写入和更新会话的Lua脚本 之后通过EVALSHA调用
+        self.write_script = self.raw_client.register_script(WRITE_SESSION_SCRIPT)
+        self.update_script = self.raw_client.register_script(UPDATE_SESSION_SCRIPT)
+        self.claim_script = self.raw_client.register_script(CLAIM_SESSION_SCRIPT)
+        self.resume_script = self.raw_client.register_script(RESUME_SESSION_SCRIPT)
+        # 会话记录的进程内近端缓存 在服务启动时设置，为None时所有读取直接访问Redis
+        self.near_cache: Optional[SessionNearCache] = None
         # 设置默认会话过期时间（秒）
         self.session_timeout = session_timeout
 
@@ -167,14 +276,16 @@ class RedisSessionManager:
     async def close(self):
         # 异步关闭 Redis 客户端连接
         await self.redis_client.aclose()
+        await self.raw_client.aclose()
 
     # 创建指定用户的新会话
-    # 存储结构：session:{user_id}:{session_id} = {
+    # 存储结构：session:{{user_id}}:{session_id} 为哈希（用户ID为hash tag），每个字段单独读写 {
     #   "session_id": session_id,
-    #   "status": "idle|running|interrupted|completed|error",
+    #   "status": "idle|running|interrupted|completed|error|cancelled",
     #   "last_response": AgentResponse,
     #   "last_query": str,
-    #   "last_updated": timestamp
+    #   "last_updated": timestamp,
+    #   "version": int
     # }
     async def create_session(self, user_id: str, session_id: Optional[str] = None, status: str = "active",
                             last_query: Optional[str] = None, last_response: Optional['AgentResponse'] = None,
@@ -188,71 +299,177 @@ class RedisSessionManager:
         # 使用提供的 TTL 或默认的 session_timeout
         effective_ttl = ttl if ttl is not None else self.session_timeout
 
-        # 构造会话数据结构
+        # 构造会话数据结构 last_response与其他字段分开序列化
         session_data = {
             "session_id": session_id,
             "status": status,
-            "last_response": last_response.model_dump() if isinstance(last_response, BaseModel) else last_response,
             "last_query": last_query,
-            "last_updated": last_updated
+            "last_updated": last_updated,
+            # 会话版本号 每次更新加1，用于状态查询的ETag
+            "version": 1
         }
 
-        # 将会话数据存储到 Redis，使用 JSON 序列化，并设置过期时间
-        await self.redis_client.set(
-            f"session:{user_id}:{session_id}",
-            json.dumps(session_data, default=lambda o: o.__dict__ if not hasattr(o, 'model_dump') else o.model_dump()),
-            ex=effective_ttl
-        )
+        # 将会话数据存储到 Redis，使用配置的会话编解码器序列化，并设置过期时间
+        await self._write_session_hash(session_key(user_id, session_id), session_data, last_response, effective_ttl)
         # 将 session_id 添加到用户的会话列表中
-        await self.redis_client.sadd(f"user_sessions:{user_id}", session_id)
+        await self.redis_client.sadd(user_sessions_key(user_id), session_id)
         # 返回新创建的 session_id
         return session_id
 
-    # 更新指定用户的特定会话数据
+    # 整体写入哈希格式的会话记录 覆盖同名的旧记录
+    async def _write_session_hash(self, key: str, meta: Dict[str, Any], last_response: Any, ttl: int) -> None:
+        args: List[Any] = [ttl]
+        for field, value in self.codec.encode_hash(meta, last_response).items():
+            args.extend((field, value))
+        await self.write_script(keys=[key], args=args)
+        self._invalidate_cached(key)
+
+    # 本进程写入或删除会话后立即删除近端缓存 其他进程通过失效通知删除
+    def _invalidate_cached(self, key: str) -> None:
+        if self.near_cache is not None:
+            self.near_cache.invalidate(key)
+
+    # 判断会话键是否存在 近端缓存中有记录时不访问Redis
+    async def _session_key_exists(self, key: str) -> bool:
+        if self.near_cache is not None and self.near_cache.contains(key):
+            return True
+        return (await self.redis_client.exists(key)) > 0
+
+    # 只写入变化的字段并续期 last_response为None时不读写该字段
+    async def _write_session_fields(self, user_id: str, session_id: str, fields: Dict[str, Any],
+                                    last_response: Optional['AgentResponse'], ttl: int) -> bool:
+        key = session_key(user_id, session_id)
+        args: List[Any] = [ttl]
+        for field, value in self.codec.encode_fields(fields).items():
+            args.extend((field, value))
+        if last_response is not None:
+            args.extend((HASH_RESPONSE_FIELD, self.codec.encode_response_field(last_response)))
+        result = await self.update_script(keys=[key], args=args)
+        self._invalidate_cached(key)
+        if result != -1:
+            return result == 1
+        # 旧版本的字符串格式记录 合并更新后整体改写为哈希格式
+        session_data = await self.raw_client.get(key)
+        if not session_data:
+            return False
+        record = self.codec.decode(session_data)
+        record.meta.update(fields)
+        record.meta["version"] = record.meta.get("version", 0) + 1
+        response = last_response if last_response is not None else record.response
+        await self._write_session_hash(key, record.meta, response, ttl)
+        logger.info(f"会话 {key} 已从字符串格式迁移为哈希格式")
+        return True
+
+    # 更新指定用户的特定会话数据 只写入提供的字段，未提供last_response时不重写该字段
     async def update_session(self, user_id: str, session_id: str, status: Optional[str] = None,
                             last_query: Optional[str] = None, last_response: Optional['AgentResponse'] = None,
                             last_updated: Optional[float] = None, ttl: Optional[int] = None) -> bool:
-        # 检查会话是否存在
-        if await self.redis_client.exists(f"session:{user_id}:{session_id}"):
-            # 获取当前会话数据
-            current_data = await self.get_session(user_id, session_id)
-            if not current_data:
-                return False
-            # 更新提供的字段
-            if status is not None:
-                current_data["status"] = status
-            if last_response is not None:
-                if isinstance(last_response, BaseModel):
-                    current_data["last_response"] = last_response.model_dump()
-                else:
-                    current_data["last_response"] = last_response
-            if last_query is not None:
-                current_data["last_query"] = last_query
-            if last_updated is not None:
-                current_data["last_updated"] = last_updated
-            # 使用提供的 TTL 或默认的 session_timeout
-            effective_ttl = ttl if ttl is not None else self.session_timeout
-            # 将更新后的数据重新存储到 Redis，并设置新的过期时间
-            await self.redis_client.set(
-                f"session:{user_id}:{session_id}",
-                json.dumps(current_data,
-                           default=lambda o: o.__dict__ if not hasattr(o, 'model_dump') else o.model_dump()),
-                ex=effective_ttl
-            )
-            # 更新成功返回 True
-            return True
+        # 收集提供的字段
+        fields = {
+            field: value for field, value in
+            (("status", status), ("last_query", last_query), ("last_updated", last_updated))
+            if value is not None
+        }
+        # 使用提供的 TTL 或默认的 session_timeout
+        effective_ttl = ttl if ttl is not None else self.session_timeout
         # 会话不存在返回 False
-        return False
+        return await self._write_session_fields(user_id, session_id, fields, last_response, effective_ttl)
+
+    # 轻量续期指定用户的会话 只修改status/last_updated并延长过期时间，用于运行心跳和恢复运行时的状态变化
+    async def touch_session(self, user_id: str, session_id: str, status: Optional[str] = None,
+                            last_updated: Optional[float] = None, ttl: Optional[int] = None) -> bool:
+        """
+        轻量续期指定用户的会话
+
+        Args:
+            user_id: 用户的唯一标识
+            session_id: 会话的唯一标识
+            status: 新的会话状态，为None时不修改
+            last_updated: 新的最后更新时间，为None时不修改
+            ttl: 新的过期时间（秒），为None时使用默认的session_timeout
+
+        Returns:
+            bool: 会话存在并续期成功返回True，否则返回False
+        """
+        effective_ttl = ttl if ttl is not None else self.session_timeout
+        # 只续期不修改字段时一条EXPIRE即可，版本号不变，状态查询的ETag也不变
+        if status is None and last_updated is None:
+            return bool(await self.raw_client.expire(session_key(user_id, session_id), effective_ttl))
+        fields = {"status": status, "last_updated": last_updated}
+        return await self._write_session_fields(
+            user_id, session_id, {field: value for field, value in fields.items() if value is not None}, None, effective_ttl
+        )
+
+    # 原子地为新的运行占用会话 会话不存在时创建，返回claimed、taken_over或busy
+    async def claim_session(self, user_id: str, session_id: str, last_query: Optional[str],
+                            last_updated: float, ttl: Optional[int] = None) -> str:
+        """
+        原子地将会话切换为running状态，检查与写入在同一个Lua脚本中完成，并发请求中只有一个能开始运行
+
+        Args:
+            user_id: 用户的唯一标识
+            session_id: 会话的唯一标识
+            last_query: 本次运行的用户问题
+            last_updated: 最后更新时间
+            ttl: 新的过期时间（秒），为None时使用默认的session_timeout
+
+        Returns:
+            str: claimed表示切换成功或新建了会话，taken_over表示接管了已失去心跳的运行，busy表示已有进行中的运行
+        """
+        key = session_key(user_id, session_id)
+        effective_ttl = ttl if ttl is not None else self.session_timeout
+        args: List[Any] = [effective_ttl, time.time(), Config.RUN_HEARTBEAT_TTL]
+        fields = {"session_id": session_id, "status": "running", "last_query": last_query, "last_updated": last_updated}
+        for field, value in self.codec.encode_fields(fields).items():
+            args.extend((field, value))
+        result = await self.claim_script(keys=[key, run_heartbeat_key(user_id, session_id)], args=args)
+        if result == -1:
+            # 旧版本的字符串格式记录 先改写为哈希格式再占用
+            await self._write_session_fields(user_id, session_id, {}, None, effective_ttl)
+            result = await self.claim_script(keys=[key, run_heartbeat_key(user_id, session_id)], args=args)
+        self._invalidate_cached(key)
+        if result == 3:
+            # 新建的会话加入用户的会话列表
+            await self.redis_client.sadd(user_sessions_key(user_id), session_id)
+            return "claimed"
+        return {1: "claimed", 2: "taken_over"}.get(result, "busy")
+
+    # 原子地将中断的会话切换为running状态 只修改status和last_updated，返回是否切换成功
+    async def resume_session(self, user_id: str, session_id: str, last_updated: float, ttl: Optional[int] = None) -> bool:
+        """
+        原子地将interrupted状态的会话切换为running状态，并发的恢复请求中只有一个能开始运行
+
+        Args:
+            user_id: 用户的唯一标识
+            session_id: 会话的唯一标识
+            last_updated: 最后更新时间
+            ttl: 新的过期时间（秒），为None时使用默认的session_timeout
+
+        Returns:
+            bool: 切换成功返回True，会话不存在或已不是中断状态返回False
+        """
+        key = session_key(user_id, session_id)
+        effective_ttl = ttl if ttl is not None else self.session_timeout
+        args: List[Any] = [effective_ttl]
+        for field, value in self.codec.encode_fields({"status": "running", "last_updated": last_updated}).items():
+            args.extend((field, value))
+        result = await self.resume_script(keys=[key], args=args)
+        if result == -1:
+            # 旧版本的字符串格式记录 先改写为哈希格式再切换
+            await self._write_session_fields(user_id, session_id, {}, None, effective_ttl)
+            result = await self.resume_script(keys=[key], args=args)
+        self._invalidate_cached(key)
+        return result == 1
 
     # 获取指定用户当前会话ID的状态数据
-    async def get_session(self, user_id: str, session_id: str) -> Optional[dict]:
-        # 从 Redis 获取会话数据
-        session_data = await self.redis_client.get(f"session:{user_id}:{session_id}")
+    async def get_session(self, user_id: str, session_id: str, include_response: bool = True) -> Optional[dict]:
+        # 从 Redis 获取会话数据 只需要状态时不读取 last_response
+        record = await self.get_session_record(user_id, session_id, include_response)
         # 如果会话不存在，返回 None
-        if not session_data:
+        if record is None:
             return None
-        # 解析 JSON 数据
-        session = json.loads(session_data)
+        # 只需要状态时不解析 last_response
+        session = record.to_dict(include_response)
         # 处理 last_response 字段，尝试转换为 AgentResponse 对象
         if session and "last_response" in session:
             if session["last_response"] is not None:
@@ -265,13 +482,47 @@ class RedisSessionManager:
         # 返回会话数据
         return session
 
+    # 获取指定用户会话的原始记录 include_response为False时只读取元数据字段，last_response在访问时才解析
+    async def get_session_record(self, user_id: str, session_id: str, include_response: bool = True) -> Optional[SessionRecord]:
+        key = session_key(user_id, session_id)
+        # 优先读取近端缓存 同一请求内的多次读取只访问一次Redis
+        if self.near_cache is not None:
+            record = self.near_cache.get(key, include_response)
+            if record is not None:
+                return record
+            generation = self.near_cache.begin(key)
+        try:
+            try:
+                if include_response:
+                    mapping = await self.raw_client.hgetall(key)
+                else:
+                    mapping = dict(zip(HASH_META_FIELDS, await self.raw_client.hmget(key, HASH_META_FIELDS)))
+                record = self._decode_mapping(mapping)
+            except redis.ResponseError:
+                # 旧版本的字符串格式记录 下次更新时改写为哈希格式
+                session_data = await self.raw_client.get(key)
+                record = self.codec.decode(session_data) if session_data else None
+                include_response = True
+            if record is not None and self.near_cache is not None:
+                self.near_cache.put(key, record, include_response, generation)
+        finally:
+            if self.near_cache is not None:
+                self.near_cache.end(key)
+        return record
+
+    # 解码HGETALL/HMGET的结果 会话不存在时返回None
+    def _decode_mapping(self, mapping: Dict[Any, Optional[bytes]]) -> Optional[SessionRecord]:
+        if not mapping or all(value is None for value in mapping.values()):
+            return None
+        return self.codec.decode_hash(mapping)
+
     # 获取指定用户下的当前激活的会话ID
     async def get_user_active_session_id(self, user_id: str) -> str | None:
         # 在查询前清理指定用户的无效会话
         await self.cleanup_user_sessions(user_id)
 
         # 获取用户的所有 session_id
-        session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
+        session_ids = await self.redis_client.smembers(user_sessions_key(user_id))
 
         # 初始化最新会话信息
         latest_session_id = None
@@ -279,7 +530,7 @@ class RedisSessionManager:
 
         # 遍历每个 session_id，获取会话数据
         for session_id in session_ids:
-            session = await self.get_session(user_id, session_id)
+            session = await self.get_session(user_id, session_id, include_response=False)
             if session:
                 last_updated = session.get('last_updated')
                 # 过滤掉 last_updated 为 "0:00:00" 的记录
@@ -298,7 +549,7 @@ class RedisSessionManager:
         # 在查询前清理指定用户的无效会话，确保返回的 session_id 都是有效的
         await self.cleanup_user_sessions(user_id)
         # 从 Redis 获取用户的所有 session_id
-        session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
+        session_ids = await self.redis_client.smembers(user_sessions_key(user_id))
         # 将集合转换为列表并返回
         return list(session_ids)
 
@@ -311,42 +562,125 @@ class RedisSessionManager:
         # 遍历所有 user_sessions:* 键
         async for key in self.redis_client.scan_iter("user_sessions:*"):
             # 提取用户 ID
-            user_id = key.split(":", 1)[1]
+            user_id = parse_user_sessions_key(key)
             # 获取该用户的所有 session_id
-            session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
+            session_ids = await self.redis_client.smembers(user_sessions_key(user_id))
             # 如果集合非空，将用户 ID 和 session_id 列表存入结果字典
             if session_ids:
                 result[user_id] = list(session_ids)
         # 返回所有用户及其 session_id
         return result
 
+    # 找出运行所在进程已退出的会话 running状态且心跳键已过期；状态更新后的RUN_HEARTBEAT_TTL秒内视为刚启动的运行
+    async def find_stale_sessions(self, user_id: str, sessions: Dict[str, Optional[dict]]) -> set[str]:
+        """
+        找出running状态但已失去心跳的会话
+
+        Args:
+            user_id: 用户的唯一标识
+            sessions: 会话ID到会话元数据的映射，值为None的会话忽略
+
+        Returns:
+            set[str]: 已失去心跳的会话ID
+        """
+        now = time.time()
+        candidates = [
+            session_id for session_id, session in sessions.items()
+            if session is not None and session.get("status") == "running"
+            and isinstance(session.get("last_updated"), (int, float))
+            and now - session["last_updated"] > Config.RUN_HEARTBEAT_TTL
+        ]
+        if not candidates:
+            return set()
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for session_id in candidates:
+                pipe.exists(run_heartbeat_key(user_id, session_id))
+            results = await pipe.execute()
+        return {session_id for session_id, alive in zip(candidates, results) if not alive}
+
+    # 一次流水线批量获取指定用户多个会话的数据 近端缓存命中的会话不访问Redis，不存在的会话值为None
+    async def get_sessions_bulk(self, user_id: str, session_ids: List[str], include_response: bool = False) -> Dict[str, Optional[dict]]:
+        if not session_ids:
+            return {}
+        records: Dict[str, Optional[SessionRecord]] = {}
+        missing: List[tuple[str, str]] = []
+        for session_id in session_ids:
+            key = session_key(user_id, session_id)
+            record = self.near_cache.get(key, include_response) if self.near_cache is not None else None
+            if record is not None:
+                records[session_id] = record
+            else:
+                missing.append((session_id, key))
+        if missing:
+            generations = {key: self.near_cache.begin(key) for _, key in missing} if self.near_cache is not None else {}
+            try:
+                async with self.raw_client.pipeline(transaction=False) as pipe:
+                    for _, key in missing:
+                        if include_response:
+                            pipe.hgetall(key)
+                        else:
+                            pipe.hmget(key, HASH_META_FIELDS)
+                    results = await pipe.execute(raise_on_error=False)
+                for (session_id, key), result in zip(missing, results):
+                    if isinstance(result, redis.ResponseError):
+                        # 旧版本的字符串格式记录 单独读取
+                        session_data = await self.raw_client.get(key)
+                        record = self.codec.decode(session_data) if session_data else None
+                    else:
+                        record = self._decode_mapping(result if include_response else dict(zip(HASH_META_FIELDS, result)))
+                    if record is not None and self.near_cache is not None:
+                        self.near_cache.put(key, record, include_response or isinstance(result, redis.ResponseError), generations[key])
+                    records[session_id] = record
+            finally:
+                if self.near_cache is not None:
+                    for _, key in missing:
+                        self.near_cache.end(key)
+        # 保持传入的会话顺序
+        sessions = {
+            session_id: records[session_id].to_dict(include_response) if records[session_id] else None
+            for session_id in session_ids
+        }
+        # 已失去心跳的运行报告为stale
+        for session_id in await self.find_stale_sessions(user_id, sessions):
+            sessions[session_id]["status"] = "stale"
+        return sessions
+
+    # 分页获取指定用户的会话列表 按last_updated排序，顺带清理已过期的会话ID
+    async def list_user_sessions(self, user_id: str, offset: int = 0, limit: int = 20, order: str = "desc",
+                                 include_response: bool = False) -> tuple[int, List[dict]]:
+        session_ids = list(await self.redis_client.smembers(user_sessions_key(user_id)))
+        sessions = await self.get_sessions_bulk(user_id, session_ids, include_response)
+        expired = [session_id for session_id, session in sessions.items() if session is None]
+        if expired:
+            await self.redis_client.srem(user_sessions_key(user_id), *expired)
+        # 新建且未更新过的会话last_updated为"0:00:00"，排在最后
+        valid = [session for session in sessions.values() if session is not None]
+        valid.sort(key=lambda session: session["last_updated"] if isinstance(session.get("last_updated"), (int, float)) else 0,
+                   reverse=(order == "desc"))
+        return len(valid), valid[offset:offset + limit]
+
     # 获取指定用户ID的所有会话状态详情数据
     async def get_all_user_sessions(self, user_id: str) -> List[dict]:
-        # 初始化会话列表
-        sessions = []
         # 获取用户的所有 session_id
-        session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
-        # 遍历每个 session_id，获取会话数据
-        for session_id in session_ids:
-            session = await self.get_session(user_id, session_id)
-            if session:
-                sessions.append(session)
+        session_ids = list(await self.redis_client.smembers(user_sessions_key(user_id)))
+        # 一次流水线读取全部会话的哈希（每个会话一条HGETALL）
+        sessions = await self.get_sessions_bulk(user_id, session_ids, include_response=True)
         # 返回所有会话数据
-        return sessions
+        return [session for session in sessions.values() if session is not None]
 
     # 检查指定用户ID是否在 Redis 中
     async def user_id_exists(self, user_id: str) -> bool:
         # 在查询前清理指定用户的无效会话
         await self.cleanup_user_sessions(user_id)
-        # 检查是否存在 user_sessions:{user_id} 键
-        return (await self.redis_client.exists(f"user_sessions:{user_id}")) > 0
+        # 检查是否存在 user_sessions:{{user_id}} 键
+        return (await self.redis_client.exists(user_sessions_key(user_id))) > 0
 
     # 检查指定用户ID的特定 session_id 是否存在
     async def session_id_exists(self, user_id: str, session_id: str) -> bool:
         # 在查询前清理指定用户的无效会话
         await self.cleanup_user_sessions(user_id)
         # 检查指定用户的特定会话是否存在
-        return (await self.redis_client.exists(f"session:{user_id}:{session_id}")) > 0
+        return await self._session_key_exists(session_key(user_id, session_id))
 
     # 获取所有会话数量
     async def get_session_count(self) -> int:
@@ -363,16 +697,16 @@ class RedisSessionManager:
     # 清理指定用户的无效会话
     async def cleanup_user_sessions(self, user_id: str) -> None:
         # 获取用户会话集合中的所有 session_id
-        session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
+        session_ids = await self.redis_client.smembers(user_sessions_key(user_id))
         # 遍历每个 session_id，检查对应的会话键是否存在
         for session_id in session_ids:
-            if not await self.redis_client.exists(f"session:{user_id}:{session_id}"):
+            if not await self._session_key_exists(session_key(user_id, session_id)):
                 # 如果会话键已过期或不存在，从集合中移除 session_id
-                await self.redis_client.srem(f"user_sessions:{user_id}", session_id)
+                await self.redis_client.srem(user_sessions_key(user_id), session_id)
                 logger.info(f"Removed expired session_id {session_id} for user {user_id}")
         # 如果集合为空，删除集合
-        if not await self.redis_client.scard(f"user_sessions:{user_id}"):
-            await self.redis_client.delete(f"user_sessions:{user_id}")
+        if not await self.redis_client.scard(user_sessions_key(user_id)):
+            await self.redis_client.delete(user_sessions_key(user_id))
             logger.info(f"Deleted empty user_sessions collection for user {user_id}")
 
     # 清理所有用户的无效会话
@@ -380,26 +714,28 @@ class RedisSessionManager:
         # 遍历所有 user_sessions:* 键
         async for key in self.redis_client.scan_iter("user_sessions:*"):
             # 提取用户 ID
-            user_id = key.split(":", 1)[1]
+            user_id = parse_user_sessions_key(key)
             # 获取用户会话集合中的所有 session_id
-            session_ids = await self.redis_client.smembers(f"user_sessions:{user_id}")
+            session_ids = await self.redis_client.smembers(user_sessions_key(user_id))
             # 遍历每个 session_id，检查对应的会话键是否存在
             for session_id in session_ids:
-                if not await self.redis_client.exists(f"session:{user_id}:{session_id}"):
+                if not await self._session_key_exists(session_key(user_id, session_id)):
                     # 如果会话键已过期或不存在，从集合中移除 session_id
-                    await self.redis_client.srem(f"user_sessions:{user_id}", session_id)
+                    await self.redis_client.srem(user_sessions_key(user_id), session_id)
                     logger.info(f"Removed expired session_id {session_id} for user {user_id}")
             # 如果集合为空，删除集合
-            if not await self.redis_client.scard(f"user_sessions:{user_id}"):
-                await self.redis_client.delete(f"user_sessions:{user_id}")
+            if not await self.redis_client.scard(user_sessions_key(user_id)):
+                await self.redis_client.delete(user_sessions_key(user_id))
                 logger.info(f"Deleted empty user_sessions collection for user {user_id}")
 
     # 删除指定用户的特定会话
     async def delete_session(self, user_id: str, session_id: str) -> bool:
         # 从用户会话列表中移除 session_id
-        await self.redis_client.srem(f"user_sessions:{user_id}", session_id)
+        await self.redis_client.srem(user_sessions_key(user_id), session_id)
         # 删除会话数据并返回是否成功
-        return (await self.redis_client.delete(f"session:{user_id}:{session_id}")) > 0
+        deleted = await self.redis_client.delete(session_key(user_id, session_id))
+        self._invalidate_cached(session_key(user_id, session_id))
+        return deleted > 0
 
 # 解析state消息列表进行格式化展示
 async def parse_messages(messages: List[Any]) -> None:
@@ -459,6 +795,86 @@ async def parse_messages(messages: List[Any]) -> None:
         print(f"消息 ID: {msg_id}")
         print("-" * 50)
 
+# 获取中断的唯一标识 兼容不同版本langgraph的Interrupt对象
+def get_interrupt_id(item: Any) -> Optional[str]:
+    return getattr(item, "id", None) or getattr(item, "interrupt_id", None)
+
+# 合并同一轮中全部工具调用的中断 生成一个批量中断
+def build_interrupt_data(interrupts: List[Any]) -> Dict[str, Any]:
+    """
+    将同一轮中多个工具调用触发的中断合并为一个批量中断
+
+    Args:
+        interrupts: 智能体结果中的__interrupt__列表
+
+    Returns:
+        Dict[str, Any]: 中断数据，顶层字段与第一个中断保持一致，interrupts中包含全部待审查的工具调用
+    """
+    pending = []
+    for item in interrupts:
+        value = dict(item.value)
+        # 确保中断数据有类型信息
+        value.setdefault("interrupt_type", "unknown")
+        value["interrupt_id"] = get_interrupt_id(item)
+        pending.append(value)
+
+    interrupt_data = dict(pending[0])
+    interrupt_data["interrupts"] = pending
+    if len(pending) > 1:
+        lines = [f"{index}. {item['action_request']['action']} 参数为: {item['action_request']['args']}"
+                 for index, item in enumerate(pending, 1)]
+        interrupt_data["description"] = f"准备同时调用 {len(pending)} 个工具：\n" + "\n".join(lines) + \
+            "\n\n请逐个审查，审查通过的工具将并发执行"
+    return interrupt_data
+
+# 根据中断反馈构造恢复命令 支持一次性处理多个待审查的工具调用
+async def build_resume_command(session_id: str, response: InterruptResponse) -> Command:
+    # 从checkpoint中读取当前待审查的中断
+    state = await app.state.agent.aget_state({"configurable": {"thread_id": session_id}})
+    pending_ids = [get_interrupt_id(item) for task in state.tasks for item in task.interrupts]
+
+    # 逐个处理的批量反馈
+    if response.responses:
+        missing = [interrupt_id for interrupt_id in pending_ids if interrupt_id not in response.responses]
+        if missing:
+            logger.error(f"status_code=400,以下工具调用缺少审查结果: {missing}")
+            raise HTTPException(status_code=400, detail=f"以下工具调用缺少审查结果: {missing}")
+        return Command(resume={interrupt_id: response.responses[interrupt_id] for interrupt_id in pending_ids})
+
+    if not response.response_type:
+        logger.error("status_code=400,response_type和responses至少需要提供一个")
+        raise HTTPException(status_code=400, detail="response_type和responses至少需要提供一个")
+    # 构造响应数据
+    command_data = {
+        "type": response.response_type
+    }
+    # 如果提供了参数，添加到响应数据中
+    if response.args:
+        command_data["args"] = response.args
+    # 只有一个中断时保持原有的恢复方式
+    if len(pending_ids) <= 1:
+        return Command(resume=command_data)
+    # 多个中断时同一个响应应用于全部工具调用
+    return Command(resume={interrupt_id: command_data for interrupt_id in pending_ids})
+
+# 裁剪智能体返回结果 只保留本轮新增的消息和最终回答，完整历史通过/agent/history接口按需读取
+def project_agent_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    messages = result.get("messages", [])
+    if Config.RESULT_PROJECTION == "full":
+        return result
+    # 每轮以用户消息开始，恢复中断时本轮消息同样从触发工具调用的用户消息开始
+    start = 0
+    for index in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[index], HumanMessage):
+            start = index
+            break
+    final_message = messages[-1] if messages else None
+    return {
+        "messages": messages[start:],
+        "final_answer": final_message.content if isinstance(final_message, AIMessage) else None,
+        "total_messages": len(messages),
+    }
+
 # 处理智能体返回结果 可能是中断，也可能是最终结果
 async def process_agent_result(
         session_id: str,
@@ -481,10 +897,7 @@ async def process_agent_result(
     try:
         # 检查是否有中断
         if "__interrupt__" in result:
-            interrupt_data = result["__interrupt__"][0].value
-            # 确保中断数据有类型信息
-            if "interrupt_type" not in interrupt_data:
-                interrupt_data["interrupt_type"] = "unknown"
+            interrupt_data = build_interrupt_data(result["__interrupt__"])
             # 返回中断信息
             response = AgentResponse(
                 session_id=session_id,
@@ -497,7 +910,7 @@ async def process_agent_result(
             response = AgentResponse(
                 session_id=session_id,
                 status="completed",
-                result=result
+                result=project_agent_result(result)
             )
             logger.info(f"最终智能体回复结果:{response}")
 
@@ -521,120 +934,320 @@ async def process_agent_result(
 
     return response
 
+# 智能体状态 系统提示词和长期记忆作为单独字段保存，每轮覆盖而不是追加到消息列表中
+class ChatAgentState(AgentState):
+    system_prompt: NotRequired[str]
+    memory: NotRequired[str]
+
+# 动态组装大模型输入 在调用大模型时注入系统提示词和长期记忆，不写入会话状态
+def build_prompt(state: ChatAgentState) -> List[BaseMessage]:
+    """
+    按提示词缓存友好的顺序组装大模型输入
+
+    模型服务端按请求前缀缓存提示词，工具描述和系统提示词是每次请求都相同的静态部分，放在最前面，
+    长期记忆等每轮可能变化的内容拼接到最后一条用户消息中，不改变之前的消息前缀
+
+    Args:
+        state: 智能体状态，messages为裁剪后的历史消息
+
+    Returns:
+        List[BaseMessage]: 发送给大模型的消息列表
+    """
+    # 过滤旧版本写入会话状态的系统消息，未迁移的会话也只保留一条系统消息
+    messages = [message for message in state["messages"] if not isinstance(message, SystemMessage)]
+    memory = state.get("memory")
+    if memory:
+        for index in range(len(messages) - 1, -1, -1):
+            message = messages[index]
+            if isinstance(message, HumanMessage) and isinstance(message.content, str):
+                messages[index] = HumanMessage(content=f"我的附加信息有:{memory}\n\n{message.content}", id=message.id)
+                break
+    system_prompt = state.get("system_prompt")
+    if system_prompt:
+        return [SystemMessage(content=system_prompt)] + messages
+    return messages
+
+# 清理单个会话中旧版本每轮写入的系统消息 返回删除的消息数，存在待恢复的中断时跳过并返回None
+async def migrate_thread_system_messages(session_id: str) -> Optional[int]:
+    config = {"configurable": {"thread_id": session_id}}
+    state = await app.state.agent.aget_state(config)
+    # 中断中的会话修改状态会影响恢复，待会话完成后再迁移
+    if state.next:
+        return None
+    system_messages = [message for message in state.values.get("messages", []) if isinstance(message, SystemMessage)]
+    if not system_messages:
+        return 0
+    await app.state.agent.aupdate_state(config, {"messages": [RemoveMessage(id=message.id) for message in system_messages]})
+    logger.info(f"会话 {session_id} 删除了 {len(system_messages)} 条系统消息")
+    return len(system_messages)
+
 # 修剪聊天历史以满足 token 数量或消息数量的限制
 def trimmed_messages_hook(state):
-    trimmed_messages = trim_messages(
-        messages=state["messages"],
-        max_tokens=20,
-        strategy="last",
-        token_counter=len,
-        start_on="human",
-        # include_system=True,
-        allow_partial=False
+    messages = [message for message in state["messages"] if not isinstance(message, SystemMessage)]
+    start = 0
+    overflow = len(messages) - Config.PROMPT_MAX_MESSAGES
+    if overflow > 0:
+        # 按块裁剪 裁剪起点只在跨过块边界时移动，块内的多次调用保持相同的提示词前缀
+        start = -(-overflow // Config.PROMPT_TRIM_BLOCK) * Config.PROMPT_TRIM_BLOCK
+        # 从用户消息开始，避免工具调用与工具结果被拆开
+        human_indexes = [index for index, message in enumerate(messages) if isinstance(message, HumanMessage)]
+        later = [index for index in human_indexes if index >= start]
+        start = later[0] if later else (human_indexes[-1] if human_indexes else 0)
+    return {"llm_input_messages": messages[start:]}
+
+# 补全取消后没有对应结果的工具调用 保证会话可以继续对话或恢复运行
+async def patch_dangling_tool_calls(session_id: str) -> int:
+    """
+    为最后一条AI消息中没有结果的工具调用补充ToolMessage
+
+    运行在工具执行期间被取消时，checkpoint停留在发起工具调用的AI消息之后，直接发送新消息会因工具调用缺少结果被模型服务拒绝。
+    同一超步中已执行完成的工具结果保存在pending writes中，直接沿用；其余工具调用补充"已取消"的结果
+
+    Args:
+        session_id: 会话ID，即thread_id
+
+    Returns:
+        int: 补充的ToolMessage数量
+    """
+    config = {"configurable": {"thread_id": session_id}}
+    state = await app.state.agent.aget_state(config)
+    messages = state.values.get("messages", []) if state.values else []
+    if not messages or not isinstance(messages[-1], AIMessage) or not messages[-1].tool_calls:
+        return 0
+    # 已执行完成但所在超步未提交的工具结果
+    finished = {}
+    for task in state.tasks:
+        result = getattr(task, "result", None)
+        if isinstance(result, dict):
+            for message in result.get("messages", []):
+                if isinstance(message, ToolMessage):
+                    finished[message.tool_call_id] = message
+    tool_messages = [
+        finished.get(tool_call["id"]) or ToolMessage(
+            content="工具调用已取消", tool_call_id=tool_call["id"], name=tool_call["name"], status="error"
+        )
+        for tool_call in messages[-1].tool_calls
+    ]
+    # 以tools节点的身份写入 下一步为调用大模型，可以直接恢复运行或发送新消息
+    await app.state.agent.aupdate_state(config, {"messages": tool_messages}, as_node="tools")
+    logger.info(f"会话 {session_id} 补充了 {len(tool_messages)} 条工具调用结果，其中已完成 {len(finished)} 条")
+    return len(tool_messages)
+
+# 运行被取消后整理checkpoint并更新会话状态
+async def finalize_cancelled_run(user_id: Optional[str], session_id: str, reason: Optional[str]) -> AgentResponse:
+    response = AgentResponse(
+        session_id=session_id,
+        status="cancelled",
+        message=reason or "智能体运行已取消"
+    )
+    try:
+        await patch_dangling_tool_calls(session_id)
+    except Exception as e:
+        logger.error(f"会话 {session_id} 补全工具调用结果失败: {e}")
+    if user_id:
+        await app.state.session_manager.update_session(
+            user_id, session_id, "cancelled", None, response, time.time(), Config.TTL
+        )
+    return response
+
+# 为新的运行占用会话 不存在时创建；仍有进行中的运行时返回409，运行所在进程已退出（心跳过期）时由新请求接管
+async def claim_session_run(user_id: str, session_id: str, query: str) -> None:
+    result = await app.state.session_manager.claim_session(user_id, session_id, query, time.time(), Config.TTL)
+    if result == "busy":
+        logger.error(f"status_code=409,用户会话 {user_id}:{session_id} 正在运行中")
+        raise HTTPException(status_code=409, detail=f"用户会话 {user_id}:{session_id} 正在运行中，请等待运行结束或先取消")
+    if result == "taken_over":
+        logger.warning(f"用户会话 {user_id}:{session_id} 的运行已失去心跳，由新请求接管")
+        # 进程在工具执行期间退出时，补全没有结果的工具调用后才能发送新消息
+        await patch_dangling_tool_calls(session_id)
+
+# 运行智能体直到完成或中断 运行期间可以通过/agent/cancel取消
+async def invoke_agent_cancellable(user_id: str, session_id: str, agent_input: Any) -> AgentResponse:
+    """
+    在可取消的任务中运行智能体并处理结果
+
+    Args:
+        user_id: 用户ID
+        session_id: 会话ID
+        agent_input: 智能体输入或恢复命令
+
+    Returns:
+        AgentResponse: 完成、中断或已取消的响应对象
+    """
+    run = get_run_registry().register(user_id, session_id)
+    run.task = asyncio.create_task(
+        app.state.agent.ainvoke(agent_input, config={"configurable": {"thread_id": session_id, "user_id": user_id}})
     )
-    return {"llm_input_messages": trimmed_messages}
+    try:
+        result = await run.task
+    except asyncio.CancelledError:
+        # 通过/agent/cancel取消 其他原因（如客户端断开、服务关闭）的取消继续向上抛出
+        if not run.cancel_requested or not run.task.cancelled():
+            raise
+        logger.info(f"会话 {session_id} 的智能体运行已取消，原因: {run.cancel_reason}")
+        return await finalize_cancelled_run(user_id, session_id, run.cancel_reason)
+    finally:
+        get_run_registry().unregister(run)
+    # 将返回的messages进行格式化输出 方便查看调试
+    await parse_messages(result['messages'])
+    # 再处理结果并更新会话状态
+    return await process_agent_result(session_id, result, user_id)
 
 # 流式处理智能体的核心函数
 async def stream_agent_response(
     session_id: str, 
-    messages: List[Dict[str, str]], 
-    user_id: Optional[str] = None
-) -> AsyncGenerator[str, None]:
+    agent_input: Dict[str, Any], 
+    user_id: Optional[str] = None,
+    http_request: Optional[Request] = None
+) -> AsyncGenerator[bytes, None]:
     """
     流式处理智能体响应
     
+    智能体在后台任务中运行，SSE帧经队列转发给客户端；客户端断开连接时通知后台任务在下一个安全点停止，
+    不再继续消耗大模型token和工具调用，会话标记为cancelled
+    
     Args:
         session_id: 会话ID
-        messages: 消息列表
+        agent_input: 智能体输入，包含消息列表、系统提示词和长期记忆
         user_id: 用户ID
+        http_request: 当前HTTP请求，用于检测客户端是否断开连接
         
     Yields:
-        StreamChunk的JSON字符串
+        StreamChunk格式的SSE帧，相邻的文本块会合并输出
     """
+    queue: asyncio.Queue[Optional[bytes]] = asyncio.Queue()
+    # 登记本次运行 /agent/cancel可以从任一后端进程取消
+    run = get_run_registry().register(user_id, session_id)
+    run.task = asyncio.create_task(run_agent_stream(session_id, agent_input, user_id, queue, run))
+    # 保留后台任务的引用 客户端断开后任务仍需运行到安全点
+    background_runs.add(run.task)
+    run.task.add_done_callback(background_runs.discard)
+    run.task.add_done_callback(lambda _: get_run_registry().unregister(run))
+    watcher = asyncio.create_task(watch_disconnect(http_request, run)) if http_request is not None else None
+    try:
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            yield frame
+    finally:
+        # 客户端断开时生成器被关闭或取消 通知后台任务停止，不等待其结束
+        if not run.task.done():
+            run.cancel("客户端断开连接，智能体运行已取消")
+        if watcher is not None:
+            watcher.cancel()
+
+# 后台运行的流式智能体任务
+background_runs: set = set()
+
+# 判断当前流式块是否处于可以安全停止的位置
+def is_cancel_safe_point(mode: str, chunk: Any) -> bool:
+    # 大模型节点输出的消息块 此时停止不会留下执行了一半的工具调用
+    if mode == "messages":
+        return chunk[1].get("langgraph_node") in CANCEL_SAFE_NODES
+    # 一个超步结束 最后一条消息没有待执行的工具调用
+    if mode == "values":
+        messages = chunk.get("messages") or []
+        return not (messages and isinstance(messages[-1], AIMessage) and messages[-1].tool_calls)
+    return False
+
+# 运行智能体并将SSE帧写入队列 队列中的None表示输出结束
+async def run_agent_stream(
+    session_id: str,
+    agent_input: Dict[str, Any],
+    user_id: Optional[str],
+    queue: asyncio.Queue,
+    run: AgentRun
+) -> None:
+    # 合并文本块的SSE编码器 事件帧会立即输出，文本最多延迟一个合并时间窗口后由定时器写入队列
+    encoder = SSEEncoder(session_id, sink=queue.put_nowait)
+    # 本次运行消耗的token数 来自模型服务返回的用量
+    tokens_used = 0
+    cancelled = False
     try:
-        # 使用messages模式获取真正的LLM token级别流式输出
         tool_calls_sent = set()
-        streaming_started = False
+        final_result: Optional[Dict[str, Any]] = None
+        # 并行的工具调用各自中断时，每个任务的中断在单独的updates块中返回，需要全部收集
+        interrupts: List[Any] = []
         
-        # 使用messages模式来获取LLM的真实token流
-        async for chunk in app.state.agent.astream(
-            {"messages": messages}, 
-            config={"configurable": {"thread_id": session_id}},
-            stream_mode="messages"
-        ):
-            # chunk是(message, metadata)元组
-            if isinstance(chunk, tuple) and len(chunk) == 2:
-                message_chunk, metadata = chunk
+        # messages模式获取LLM的真实token流，values模式获取每个超步后的完整状态，updates模式获取中断
+        # 流结束时的状态即为最终结果，不需要再次调用智能体；提前退出时显式关闭流，立即停止图的执行
+        stream = app.state.agent.astream(
+            agent_input, 
+            config={"configurable": {"thread_id": session_id, "user_id": user_id}},
+            stream_mode=["messages", "values", "updates"]
+        )
+        try:
+            async with aclosing(stream):
+                async for mode, chunk in stream:
+                    if mode == "messages":
+                        # chunk是(message, metadata)元组
+                        message_chunk, metadata = chunk
                 
-                # 检查是否是AIMessageChunk（流式消息块）
-                if hasattr(message_chunk, '__class__') and message_chunk.__class__.__name__ == 'AIMessageChunk':
-                    # 处理流式文本内容
-                    if message_chunk.content:
-                        streaming_started = True
-                        stream_chunk = StreamChunk(
-                            type="text_chunk",
-                            session_id=session_id,
-                            content=message_chunk.content
-                        )
-                        yield f"data: {stream_chunk.model_dump_json()}\n\n"
+                        # 检查是否是AIMessageChunk（流式消息块）
+                        if isinstance(message_chunk, AIMessageChunk):
+                            if message_chunk.usage_metadata:
+                                tokens_used += message_chunk.usage_metadata.get("total_tokens", 0)
+                            # 处理流式文本内容
+                            if message_chunk.content:
+                                frame = encoder.text(message_chunk.content)
+                                if frame:
+                                    queue.put_nowait(frame)
                     
-                    # 处理工具调用（非流式，但实时通知）
-                    if hasattr(message_chunk, 'tool_calls') and message_chunk.tool_calls:
-                        for tool_call in message_chunk.tool_calls:
-                            tool_call_id = tool_call.get('id', '')
-                            if tool_call_id not in tool_calls_sent:
-                                tool_calls_sent.add(tool_call_id)
-                                stream_chunk = StreamChunk(
-                                    type="tool_call",
-                                    session_id=session_id,
-                                    data={
-                                        "tool_calls": [{
-                                            "name": tool_call.get("name", ""),
-                                            "args": tool_call.get("args", {})
-                                        }]
-                                    }
-                                )
-                                yield f"data: {stream_chunk.model_dump_json()}\n\n"
-        
-        # 如果没有流式输出，获取最终执行结果
-        if not streaming_started:
-            final_result = await app.state.agent.ainvoke(
-                {"messages": messages}, 
-                config={"configurable": {"thread_id": session_id}}
-            )
-        else:
-            # 流式已经完成，只需要获取最终结果用于保存状态
-            final_result = await app.state.agent.ainvoke(
-                {"messages": messages}, 
-                config={"configurable": {"thread_id": session_id}}
-            )
-        
-        # 处理最终结果
+                            # 处理工具调用（非流式，但实时通知）
+                            if message_chunk.tool_calls:
+                                for tool_call in message_chunk.tool_calls:
+                                    tool_call_id = tool_call.get('id', '')
+                                    if tool_call_id not in tool_calls_sent:
+                                        tool_calls_sent.add(tool_call_id)
+                                        queue.put_nowait(encoder.event(
+                                            "tool_call",
+                                            data={
+                                                "tool_calls": [{
+                                                    "name": tool_call.get("name", ""),
+                                                    "args": tool_call.get("args", {})
+                                                }]
+                                            }
+                                        ))
+                    elif mode == "values":
+                        final_result = chunk
+                    elif mode == "updates" and "__interrupt__" in chunk:
+                        interrupts.extend(chunk["__interrupt__"])
+
+                    # 客户端已断开 在安全点停止运行，关闭流时LangGraph会取消正在进行的大模型调用
+                    if run.cancel_event.is_set() and is_cancel_safe_point(mode, chunk):
+                        cancelled = True
+                        break
+        except asyncio.CancelledError:
+            # 通过/agent/cancel取消时任务被立即取消 其他原因（如服务关闭）的取消继续向上抛出
+            if not run.cancel_requested:
+                raise
+            cancelled = True
+
+        if cancelled:
+            saved = get_run_cancellation_stats().record_cancelled(tokens_used)
+            logger.info(f"会话 {session_id} 的智能体运行已取消，原因: {run.cancel_reason}，已消耗token: {tokens_used}，估计节省token: {saved}")
+            cancelled_response = await finalize_cancelled_run(user_id, session_id, run.cancel_reason)
+            # 主动取消时客户端仍在连接 通知其运行已取消
+            queue.put_nowait(encoder.event("cancelled", data=cancelled_response.model_dump()))
+            return
+
+        # 处理最终结果 与ainvoke的返回结构保持一致
+        final_result = dict(final_result or {})
+        if interrupts:
+            final_result["__interrupt__"] = interrupts
+        get_run_cancellation_stats().record_completed(tokens_used)
         agent_response = await process_agent_result(session_id, final_result, user_id)
         
         if agent_response.status == "interrupted":
-            stream_chunk = StreamChunk(
-                type="interrupt",
-                session_id=session_id,
-                interrupt_data=agent_response.interrupt_data
-            )
-            yield f"data: {stream_chunk.model_dump_json()}\n\n"
+            queue.put_nowait(encoder.event("interrupt", interrupt_data=agent_response.interrupt_data))
         else:
-            stream_chunk = StreamChunk(
-                type="completed",
-                session_id=session_id,
-                data=agent_response.model_dump()
-            )
-            yield f"data: {stream_chunk.model_dump_json()}\n\n"
+            queue.put_nowait(encoder.event("completed", data=agent_response.model_dump()))
+        logger.info(f"会话 {session_id} 流式输出合并情况:{encoder.metrics()}")
             
     except Exception as e:
         logger.error(f"流式处理错误: {str(e)}")
-        error_chunk = StreamChunk(
-            type="error",
-            session_id=session_id,
-            error_message=f"处理请求时出错: {str(e)}"
-        )
-        yield f"data: {error_chunk.model_dump_json()}\n\n"
+        queue.put_nowait(encoder.event("error", error_message=f"处理请求时出错: {str(e)}"))
         
         # 更新会话状态为错误
         if user_id:
@@ -646,6 +1259,10 @@ async def stream_agent_response(
             await app.state.session_manager.update_session(
                 user_id, session_id, "error", None, error_response, time.time(), Config.TTL
             )
+    finally:
+        # 输出结束后不再定时写入文本帧
+        encoder.close()
+        queue.put_nowait(None)
 
 # 读取指定用户长期记忆中的内容
 async def read_long_term_info(user_id :str):
@@ -739,50 +1356,103 @@ async def write_long_term_info(user_id :str, memory_info :str):
 # 生命周期函数 app应用初始化函数
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # 模型客户端、MCP、PostgreSQL相关的依赖只在服务启动时导入 导入本模块的工具脚本和多进程部署的主进程不加载这些依赖
+    from psycopg_pool import AsyncConnectionPool
+    from psycopg.rows import dict_row
+    from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+    from langgraph.store.postgres import AsyncPostgresStore
+    from utils.llms import get_llm, get_llm_base_urls
+    from utils.tools import get_tools
+    from utils.mcp_cache import stop_mcp_tools_refresh
+    from utils.mcp_pool import close_mcp_pool_manager
+    from utils.startup import setup_if_outdated
+
+    # 记录各组件的初始化耗时 通过/health/ready查看
+    startup = get_startup_tracker()
     try:
-        # 实例化异步Redis会话管理器 并存储为单实例
-        app.state.session_manager = RedisSessionManager(
-            Config.REDIS_HOST,
-            Config.REDIS_PORT,
-            Config.REDIS_DB,
-            Config.SESSION_TIMEOUT
+        # 实例化异步Redis会话管理器 并存储为单实例 客户端在首次执行命令时才建立连接
+        app.state.session_manager = RedisSessionManager(Config.SESSION_TIMEOUT)
+        logger.info(f"Redis初始化成功: {get_redis_connection_info()}")
+        # 会话记录的进程内近端缓存 后台连接失效通知，连接成功前读取直接访问Redis
+        app.state.session_manager.near_cache = init_session_near_cache()
+
+        # 工具结果缓存与会话共用Redis
+        init_tool_result_cache(app.state.session_manager.redis_client)
+        # 工具审批策略的频率计数与会话共用Redis
+        init_approval_policy(app.state.session_manager.redis_client)
+        # 幂等请求记录与会话共用Redis
+        init_idempotency_store(app.state.session_manager.redis_client)
+        # 订阅取消请求 任一后端进程收到/agent/cancel请求后，执行该运行的进程负责停止
+        # 进行中的运行定期刷新心跳键 进程退出后状态查询报告stale；同时按Config.TTL为会话续期，只执行EXPIRE
+        get_run_registry().start(
+            create_pubsub_client(), app.state.session_manager.redis_client,
+            lambda user_id, session_id: app.state.session_manager.touch_session(user_id, session_id, ttl=Config.TTL)
         )
-        logger.info("Redis初始化成功")
 
-        # 创建Chat模型
+        # 创建Chat模型 只构造客户端，不访问网络
+        started = time.monotonic()
         llm_chat, llm_embedding = get_llm(Config.LLM_TYPE)
+        startup.record("llm", started)
         logger.info("Chat模型初始化成功")
 
-        # 创建数据库连接池 动态连接池根据负载调整连接池大小
+        # 创建数据库连接池 动态连接池根据负载调整连接池大小，连接在后台建立
+        # 多进程部署时每个进程的连接池按进程数均分全局连接数预算
+        min_size, max_size = worker_pool_sizes()
+        logger.info(f"工作进程 {os.getpid()} 的数据库连接池大小: {min_size}~{max_size}，后端进程数: {Config.WORKERS}")
         async with AsyncConnectionPool(
                 conninfo=Config.DB_URI,
-                min_size=Config.MIN_SIZE,
-                max_size=Config.MAX_SIZE,
+                min_size=min_size,
+                max_size=max_size,
                 kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row}
         ) as pool:
-            # 短期记忆 初始化checkpointer，并初始化表结构
+            # 短期记忆checkpointer和长期记忆store 表结构已是最新版本时跳过DDL迁移
             app.state.checkpointer = AsyncPostgresSaver(pool)
-            await app.state.checkpointer.setup()
-            logger.info("短期记忆Checkpointer初始化成功")
-
-            # 长期记忆 初始化store，并初始化表结构
             app.state.store = AsyncPostgresStore(pool)
-            await app.state.store.setup()
-            logger.info("长期记忆store初始化成功")
 
-            # 获取工具列表
-            tools = await get_tools()
+            # 创建ReAct Agent
+            def build_agent(tools):
+                return create_react_agent(
+                    model=llm_chat,
+                    # 工具按名称排序，工具描述在每次请求中保持相同顺序
+                    tools=sorted(tools, key=lambda tool: tool.name),
+                    prompt=build_prompt,
+                    state_schema=ChatAgentState,
+                    pre_model_hook=trimmed_messages_hook,
+                    checkpointer=app.state.checkpointer,
+                    store=app.state.store,
+                    # v2模式下每个工具调用作为独立任务分发，多个工具调用的中断合并在同一轮返回，恢复后并发执行
+                    version="v2"
+                )
+
+            # 启动时MCP Server不可达 后台发现工具后重建Agent，之后的请求使用新的工具列表
+            async def rebuild_agent(tools):
+                app.state.agent = build_agent(tools)
+                logger.info(f"MCP工具已在后台加载，Agent已按 {len(tools)} 个工具重建")
+
+            # 互不依赖的初始化并发执行 启动耗时接近最慢的一项而不是各项之和
+            warmup_urls = get_llm_base_urls(Config.LLM_TYPE)
+            _, checkpointer_migration, store_migration, tools = await asyncio.gather(
+                # 确认Redis可用
+                startup.track("redis", app.state.session_manager.redis_client.ping()),
+                # 短期记忆和长期记忆的表结构互不相关 多进程同时启动时由咨询锁保证只迁移一次
+                startup.track("checkpointer", setup_if_outdated(pool, app.state.checkpointer, "checkpoint_migrations")),
+                startup.track("store", setup_if_outdated(pool, app.state.store, "store_migrations")),
+                # 获取工具列表 MCP工具优先从磁盘缓存加载，首次调用时才连接MCP Server
+                startup.track("tools", get_tools(rebuild_agent)),
+                # 预热模型服务的HTTP连接 避免首个请求承担TLS握手耗时
+                startup.track("http_warmup", warmup_http_connections(warmup_urls)),
+            )
+            startup.annotate("checkpointer", f"migrations {checkpointer_migration}")
+            startup.annotate("store", f"migrations {store_migration}")
+            logger.info(f"短期记忆Checkpointer初始化成功，迁移: {checkpointer_migration}；长期记忆store初始化成功，迁移: {store_migration}")
+            # 周期性预热 避免空闲后连接过期
+            app.state.http_warmup_task = asyncio.create_task(keep_http_connections_warm(warmup_urls))
 
             # 创建ReAct Agent 并存储为单实例
-            app.state.agent = create_react_agent(
-                model=llm_chat,
-                tools=tools,
-                pre_model_hook=trimmed_messages_hook,
-                checkpointer=app.state.checkpointer,
-                store=app.state.store
-            )
+            app.state.agent = build_agent(tools)
             logger.info("Agent初始化成功")
 
+            startup.mark_ready()
             logger.info("服务完成初始化并启动服务")
             yield
 
@@ -792,6 +1462,23 @@ async def lifespan(app: FastAPI):
 
     # 清理资源
     finally:
+        # 开始关闭 就绪检查返回503，负载均衡不再转发新请求
+        startup.mark_stopping()
+        # 停止周期性预热并关闭共享HTTP客户端
+        warmup_task = getattr(app.state, "http_warmup_task", None)
+        if warmup_task:
+            warmup_task.cancel()
+        await close_http_clients()
+        # 停止MCP工具缓存的后台刷新
+        stop_mcp_tools_refresh()
+        # 取消未被审查的工具预执行任务
+        get_speculative_runner().close()
+        # 关闭MCP常驻会话
+        await close_mcp_pool_manager()
+        # 停止取消请求的订阅
+        await get_run_registry().close()
+        # 停止会话近端缓存的失效通知监听
+        await close_session_near_cache()
         # 关闭Redis连接
         await app.state.session_manager.close()
         # 关闭PostgreSQL连接池
@@ -805,66 +1492,75 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# 按请求头Idempotency-Key运行 重复请求等待已有运行完成或直接返回保存的响应
+async def run_idempotent(user_id: str, scope: str, idempotency_key: Optional[str], request: BaseModel,
+                         handler: Callable[[], Awaitable[AgentResponse]]) -> Any:
+    """
+    按幂等键运行智能体
+
+    Args:
+        user_id: 用户ID
+        scope: 接口标识，如invoke、resume
+        idempotency_key: 请求头中的Idempotency-Key，为None时直接运行
+        request: 请求数据，用于计算请求指纹
+        handler: 实际运行智能体的函数
+
+    Returns:
+        未携带Idempotency-Key时返回AgentResponse，否则返回带Idempotent-Replayed响应头的JSONResponse
+    """
+    store = get_idempotency_store()
+    if not idempotency_key or store is None:
+        return await handler()
+
+    async def run() -> Dict[str, Any]:
+        return (await handler()).model_dump(mode="json")
+
+    try:
+        response, replayed = await store.run(user_id, scope, idempotency_key, request_fingerprint(request.model_dump_json()), run)
+    except IdempotencyKeyReused as e:
+        logger.error(f"status_code=422,{e}")
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        logger.error(f"status_code=409,{e}")
+        raise HTTPException(status_code=409, detail=str(e))
+    return JSONResponse(content=response, headers={"Idempotent-Replayed": "true" if replayed else "false"})
+
 # API接口:运行智能体并返回大模型结果或中断数据
+# 请求头Idempotency-Key相同的重试请求不会再次运行智能体，而是等待已有运行完成或返回保存的响应
 @app.post("/agent/invoke", response_model=AgentResponse)
-async def invoke_agent(request: AgentRequest):
-    logger.info(f"调用/agent/invoke接口，运行智能体并返回大模型结果或中断数据，接受到前端用户请求:{request}")
+async def invoke_agent(request: AgentRequest, idempotency_key: Optional[str] = Header(default=None)):
+    logger.info(f"调用/agent/invoke接口，运行智能体并返回大模型结果或中断数据，接受到前端用户请求:{request}，Idempotency-Key:{idempotency_key}")
+    return await run_idempotent(request.user_id, "invoke", idempotency_key, request, lambda: run_invoke_agent(request))
+
+# 运行智能体并返回大模型结果或中断数据
+async def run_invoke_agent(request: AgentRequest) -> AgentResponse:
     # 获取用户请求中的user_id和session_id
     user_id = request.user_id
     session_id = request.session_id
 
     # 调用函数获取长期记忆
     result = await read_long_term_info(user_id)
+    # 长期记忆不再拼接到系统提示词中，系统提示词保持不变，以命中模型服务端的提示词缓存
+    system_message = request.system_message
     # 检查返回结果是否成功
-    if result.get("success", False):
-        long_term_info = result.get("long_term_info")
-        # 若获取到的内容不为空 则将记忆内容拼接到系统提示词中
-        if long_term_info:
-            system_message = f"{request.system_message}我的附加信息有:{long_term_info}"
-            logger.info(f"获取用户偏好配置数据，system_message的信息为:{system_message}")
-        # 若获取到的内容为空，则直接使用系统提示词
-        else:
-            system_message = request.system_message
-            logger.info(f"未获取到用户偏好配置数据，system_message的信息为:{system_message}")
+    long_term_info = result.get("long_term_info") if result.get("success", False) else None
+    if long_term_info:
+        logger.info(f"获取用户偏好配置数据，long_term_info的信息为:{long_term_info}")
     else:
-        system_message = request.system_message
+        long_term_info = ""
         logger.info(f"未获取到用户偏好配置数据，system_message的信息为:{system_message}")
 
-    # 判断当前用户会话是否存在
-    exists = await app.state.session_manager.session_id_exists(user_id, session_id)
-
-    # 若用户会话不存在 则创建新会话
-    if not exists:
-        status = "idle"
-        last_query = None
-        last_response = None
-        last_updated = time.time()
-        ttl = Config.TTL
-        # 创建会话并存储到redis中
-        await app.state.session_manager.create_session(user_id, session_id, status, last_query, last_response, last_updated, ttl)
-
-    # 新请求统一更新会话信息
-    status = "running"
-    last_query = request.query
-    last_response = None
-    last_updated = time.time()
-    ttl = Config.TTL
-    await app.state.session_manager.update_session(user_id, session_id, status, last_query, last_response, last_updated, ttl)
+    # 原子地将会话切换为running状态 会话不存在时创建；仍有进行中的运行时返回409，运行已失去心跳时由本次请求接管
+    await claim_session_run(user_id, session_id, request.query)
 
-    # 构造智能体输入消息体
+    # 构造智能体输入消息体 系统提示词不写入消息列表，在调用大模型时注入
     messages = [
-        {"role": "system", "content": system_message},
         {"role": "user", "content": request.query}
     ]
 
     try:
-        # 先调用智能体
-        result = await app.state.agent.ainvoke({"messages": messages}, config={"configurable": {"thread_id": session_id}})
-        # 将返回的messages进行格式化输出 方便查看调试
-        await parse_messages(result['messages'])
-
-        # 再处理结果并更新会话状态
-        return await process_agent_result(session_id, result, user_id)
+        # 调用智能体并处理结果 运行期间可以通过/agent/cancel取消
+        return await invoke_agent_cancellable(user_id, session_id, {"messages": messages, "system_prompt": system_message, "memory": long_term_info})
 
     except Exception as e:
         # 异常处理
@@ -887,12 +1583,13 @@ async def invoke_agent(request: AgentRequest):
 
 # API接口:流式运行智能体并返回流式响应
 @app.post("/agent/invoke/stream")
-async def invoke_agent_stream(request: AgentRequest):
+async def invoke_agent_stream(request: AgentRequest, http_request: Request):
     """
     流式调用智能体API接口
     
     Args:
         request: 智能体请求数据
+        http_request: 当前HTTP请求，用于检测客户端断开连接
         
     Returns:
         StreamingResponse: 流式响应
@@ -905,51 +1602,27 @@ async def invoke_agent_stream(request: AgentRequest):
 
     # 调用函数获取长期记忆
     result = await read_long_term_info(user_id)
+    # 长期记忆不再拼接到系统提示词中，系统提示词保持不变，以命中模型服务端的提示词缓存
+    system_message = request.system_message
     # 检查返回结果是否成功
-    if result.get("success", False):
-        long_term_info = result.get("long_term_info")
-        # 若获取到的内容不为空 则将记忆内容拼接到系统提示词中
-        if long_term_info:
-            system_message = f"{request.system_message}我的附加信息有:{long_term_info}"
-            logger.info(f"获取用户偏好配置数据，system_message的信息为:{system_message}")
-        # 若获取到的内容为空，则直接使用系统提示词
-        else:
-            system_message = request.system_message
-            logger.info(f"未获取到用户偏好配置数据，system_message的信息为:{system_message}")
+    long_term_info = result.get("long_term_info") if result.get("success", False) else None
+    if long_term_info:
+        logger.info(f"获取用户偏好配置数据，long_term_info的信息为:{long_term_info}")
     else:
-        system_message = request.system_message
+        long_term_info = ""
         logger.info(f"未获取到用户偏好配置数据，system_message的信息为:{system_message}")
 
-    # 判断当前用户会话是否存在
-    exists = await app.state.session_manager.session_id_exists(user_id, session_id)
-
-    # 若用户会话不存在 则创建新会话
-    if not exists:
-        status = "idle"
-        last_query = None
-        last_response = None
-        last_updated = time.time()
-        ttl = Config.TTL
-        # 创建会话并存储到redis中
-        await app.state.session_manager.create_session(user_id, session_id, status, last_query, last_response, last_updated, ttl)
-
-    # 新请求统一更新会话信息
-    status = "running"
-    last_query = request.query
-    last_response = None
-    last_updated = time.time()
-    ttl = Config.TTL
-    await app.state.session_manager.update_session(user_id, session_id, status, last_query, last_response, last_updated, ttl)
+    # 原子地将会话切换为running状态 会话不存在时创建；仍有进行中的运行时返回409，运行已失去心跳时由本次请求接管
+    await claim_session_run(user_id, session_id, request.query)
 
-    # 构造智能体输入消息体
+    # 构造智能体输入消息体 系统提示词不写入消息列表，在调用大模型时注入
     messages = [
-        {"role": "system", "content": system_message},
         {"role": "user", "content": request.query}
     ]
 
     # 返回流式响应
     return StreamingResponse(
-        stream_agent_response(session_id, messages, user_id),
+        stream_agent_response(session_id, {"messages": messages, "system_prompt": system_message, "memory": long_term_info}, user_id, http_request),
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -959,9 +1632,14 @@ async def invoke_agent_stream(request: AgentRequest):
     )
 
 # API接口:恢复被中断的智能体运行并等待运行完成或再次中断
+# 请求头Idempotency-Key相同的重试请求不会重复提交审查结果
 @app.post("/agent/resume", response_model=AgentResponse)
-async def resume_agent(response: InterruptResponse):
-    logger.info(f"调用/agent/resume接口，恢复被中断的智能体运行并等待运行完成或再次中断，接受到前端用户请求:{response}")
+async def resume_agent(response: InterruptResponse, idempotency_key: Optional[str] = Header(default=None)):
+    logger.info(f"调用/agent/resume接口，恢复被中断的智能体运行并等待运行完成或再次中断，接受到前端用户请求:{response}，Idempotency-Key:{idempotency_key}")
+    return await run_idempotent(response.user_id, "resume", idempotency_key, response, lambda: run_resume_agent(response))
+
+# 恢复被中断的智能体运行并等待运行完成或再次中断
+async def run_resume_agent(response: InterruptResponse) -> AgentResponse:
     # 获取用户请求中的user_id和session_id
     user_id = response.user_id
     session_id = response.session_id
@@ -974,35 +1652,26 @@ async def resume_agent(response: InterruptResponse):
         raise HTTPException(status_code=404, detail=f"用户会话 {user_id}:{session_id} 不存在")
 
     # 检查会话状态是否为中断 若不是中断则抛出异常
-    session = await app.state.session_manager.get_session(user_id, session_id)
+    session = await app.state.session_manager.get_session(user_id, session_id, include_response=False)
     status = session.get("status")
     if status != "interrupted":
         logger.error(f"status_code=400,会话当前状态为 {status}，无法恢复非中断状态的会话")
         raise HTTPException(status_code=400, detail=f"会话当前状态为 {status}，无法恢复非中断状态的会话")
 
-    # 更新会话状态
-    status = "running"
-    last_query = None
-    last_response = None
+    # 构造恢复命令 多个待审查的工具调用一次性处理，审查通过的工具并发执行
+    command = await build_resume_command(session_id, response)
+
+    # 原子地将会话从interrupted切换为running 只修改status和last_updated，不重写last_query和last_response
+    # 并发的恢复请求中只有一个能切换成功，其余返回409，同一组中断不会被恢复两次
     last_updated = time.time()
     ttl = Config.TTL
-    await app.state.session_manager.update_session(user_id, session_id, status, last_query, last_response, last_updated, ttl)
-
-    # 构造响应数据
-    command_data = {
-        "type": response.response_type
-    }
-    # 如果提供了参数，添加到响应数据中
-    if response.args:
-        command_data["args"] = response.args
+    if not await app.state.session_manager.resume_session(user_id, session_id, last_updated, ttl):
+        logger.error(f"status_code=409,用户会话 {user_id}:{session_id} 已被其他请求恢复")
+        raise HTTPException(status_code=409, detail=f"用户会话 {user_id}:{session_id} 已被其他请求恢复或状态已变化")
 
     try:
-        # 先恢复智能体执行
-        result = await app.state.agent.ainvoke(Command(resume=command_data), config={"configurable": {"thread_id": session_id}})
-        # 将返回的messages进行格式化输出 方便查看调试
-        await parse_messages(result['messages'])
-        # 再处理结果并更新会话状态
-        return await process_agent_result(session_id, result, user_id)
+        # 恢复智能体执行并处理结果 运行期间可以通过/agent/cancel取消
+        return await invoke_agent_cancellable(user_id, session_id, command)
 
     except Exception as e:
         # 异常处理
@@ -1023,16 +1692,90 @@ async def resume_agent(response: InterruptResponse):
 
         return error_response
 
-# API接口:获取指定用户当前会话的状态数据
-@app.get("/agent/status/{user_id}/{session_id}", response_model=SessionStatusResponse)
-async def get_agent_status(user_id: str, session_id: str):
-    logger.info(f"调用/agent/status/接口，获取指定用户当前会话的状态数据，接受到前端用户请求:{user_id}:{session_id}")
+# API接口:取消指定用户会话中正在进行的智能体运行
+# 取消请求通过Redis发布订阅送达所有后端进程，由实际执行该运行的进程停止任务
+@app.post("/agent/cancel", response_model=CancelResponse)
+async def cancel_agent(request: CancelRequest):
+    logger.info(f"调用/agent/cancel接口，取消正在进行的智能体运行，接受到前端用户请求:{request}")
+    user_id = request.user_id
+    session_id = request.session_id
+    reason = request.reason or "用户取消了智能体运行"
 
     # 判断当前用户会话是否存在
-    exists = await app.state.session_manager.session_id_exists(user_id, session_id)
+    session = await app.state.session_manager.get_session(user_id, session_id, include_response=False)
+    if session is None:
+        logger.error(f"status_code=404,用户会话 {user_id}:{session_id} 不存在")
+        raise HTTPException(status_code=404, detail=f"用户会话 {user_id}:{session_id} 不存在")
+
+    status = session.get("status")
+    if status == "running" and await app.state.session_manager.find_stale_sessions(user_id, {session_id: session}):
+        status = "stale"
+    # 运行中 通知执行该运行的进程立即停止，会话状态由该进程更新为cancelled
+    if status == "running":
+        delivered = await get_run_registry().request_cancel(user_id, session_id, reason)
+        response = CancelResponse(
+            user_id=user_id,
+            session_id=session_id,
+            status="cancelling",
+            delivered=delivered,
+            message="已发送取消请求" if delivered else "没有后端进程收到取消请求"
+        )
+    # 等待工具审查或运行所在进程已退出 没有进行中的任务，直接补全工具调用结果并更新会话状态
+    elif status in ("interrupted", "stale"):
+        cancelled = await finalize_cancelled_run(user_id, session_id, reason)
+        response = CancelResponse(
+            user_id=user_id,
+            session_id=session_id,
+            status="cancelled",
+            message=cancelled.message
+        )
+    else:
+        response = CancelResponse(
+            user_id=user_id,
+            session_id=session_id,
+            status="not_running",
+            message=f"会话当前状态为 {status}，没有可取消的运行"
+        )
+    logger.info(f"返回取消结果:{response}")
+    return response
+
+# 状态查询支持返回的字段 message取自last_response中的提示消息
+STATUS_FIELDS = {"status", "message", "last_query", "last_updated", "last_response"}
+# 需要读取last_response才能得到的字段
+RESPONSE_FIELDS = {"message", "last_response"}
+
+# 状态查询的ETag 会话版本号加返回字段集合的摘要，不同fields的响应不会共用同一个ETag
+def status_etag(version: int, selected: set, stale: bool) -> str:
+    fields_hash = hashlib.sha1(",".join(sorted(selected)).encode("utf-8")).hexdigest()[:8]
+    return f'"{version}-{fields_hash}{"-stale" if stale else ""}"'
+
+# 从last_response中取出提示消息
+def response_message(response: Any) -> Optional[str]:
+    return response.get("message") if isinstance(response, dict) else None
+
+# API接口:获取指定用户当前会话的状态数据
+# fields指定返回的字段（逗号分隔，user_id、session_id和status始终返回），请求头If-None-Match与会话版本一致时返回304
+@app.get("/agent/status/{user_id}/{session_id}", response_model=SessionStatusResponse)
+async def get_agent_status(user_id: str, session_id: str, fields: Optional[str] = None,
+                           if_none_match: Optional[str] = Header(default=None)):
+    logger.info(f"调用/agent/status/接口，获取指定用户当前会话的状态数据，接受到前端用户请求:{user_id}:{session_id}，fields:{fields}")
+
+    # 解析需要返回的字段
+    selected = STATUS_FIELDS
+    if fields:
+        selected = {field.strip() for field in fields.split(",") if field.strip()} - {"user_id", "session_id"}
+        unknown = selected - STATUS_FIELDS
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不支持的字段: {sorted(unknown)}，可选字段: {sorted(STATUS_FIELDS)}")
+        selected.add("status")
+
+    # 读取会话记录 未选择 last_response 和 message 时不读取last_response字段；
+    # 携带If-None-Match时先只读取元数据比较ETag，会话未变化时不从Redis传输last_response
+    include_response = bool(selected & RESPONSE_FIELDS)
+    record = await app.state.session_manager.get_session_record(user_id, session_id, include_response and not if_none_match)
 
     # 若会话不存在 构造SessionStatusResponse对象
-    if not exists:
+    if record is None:
         logger.error(f"用户 {user_id}:{session_id} 的会话不存在")
         return SessionStatusResponse(
             user_id=user_id,
@@ -1041,17 +1784,123 @@ async def get_agent_status(user_id: str, session_id: str):
             message=f"用户 {user_id}:{session_id} 的会话不存在"
         )
 
-    # 若会话存在 构造SessionStatusResponse对象
-    session = await app.state.session_manager.get_session(user_id, session_id)
+    # 运行已失去心跳时报告stale 会话记录本身没有变化，ETag中加入标记避免返回304
+    status = record.meta.get("status")
+    stale = await app.state.session_manager.find_stale_sessions(user_id, {session_id: record.meta})
+    if stale:
+        status = "stale"
+
+    # 会话未变化时返回304，不解析和传输会话数据
+    etag = status_etag(record.meta.get("version", 0), selected, stale)
+    if if_none_match and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        logger.info(f"用户 {user_id}:{session_id} 的会话未变化，返回304")
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # ETag不一致时再读取last_response 两次读取之间会话被更新时以新读取的记录为准
+    if include_response and if_none_match:
+        full_record = await app.state.session_manager.get_session_record(user_id, session_id, True)
+        if full_record is not None:
+            record = full_record
+            stale = stale and record.meta.get("status") == "running"
+            status = "stale" if stale else record.meta.get("status")
+            etag = status_etag(record.meta.get("version", 0), selected, stale)
+
+    # 若会话存在 只为选中的字段构造SessionStatusResponse对象
+    values = {
+        "status": status,
+        "last_query": record.meta.get("last_query"),
+        "last_updated": record.meta.get("last_updated"),
+    }
+    if include_response:
+        values["message"] = response_message(record.response)
+        values["last_response"] = record.response
     response = SessionStatusResponse(
         user_id=user_id,
         session_id=session_id,
-        status=session.get("status"),
-        last_query=session.get("last_query"),
-        last_updated=session.get("last_updated"),
-        last_response=session.get("last_response")
+        **{key: value for key, value in values.items() if key in selected}
     )
     logger.info(f"返回当前用户的会话状态:{response}")
+    return JSONResponse(content=response.model_dump(mode="json", exclude_unset=True), headers={"ETag": etag})
+
+# 批量查询时默认返回的字段
+BATCH_STATUS_FIELDS = ["status", "last_query", "last_updated"]
+
+# 按字段裁剪会话数据
+def project_session(session_id: str, session: Dict[str, Any], fields: List[str]) -> Dict[str, Any]:
+    item = {"session_id": session_id}
+    for field in fields:
+        item[field] = response_message(session.get("last_response")) if field == "message" else session.get(field)
+    return item
+
+# 校验批量查询的字段
+def resolve_status_fields(fields: Optional[List[str]]) -> List[str]:
+    if not fields:
+        return BATCH_STATUS_FIELDS
+    unknown = set(fields) - STATUS_FIELDS
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"不支持的字段: {sorted(unknown)}，可选字段: {sorted(STATUS_FIELDS)}")
+    return list(dict.fromkeys(["status", *fields]))
+
+# API接口:批量获取指定用户多个会话的状态数据 一次流水线完成查询（每个会话一条HMGET或HGETALL）
+@app.post("/agent/status/batch")
+async def get_agent_status_batch(request: BatchStatusRequest):
+    logger.info(f"调用/agent/status/batch接口，批量获取会话状态，接受到前端用户请求:{request.user_id}，会话数:{len(request.session_ids)}")
+    fields = resolve_status_fields(request.fields)
+    session_ids = list(dict.fromkeys(request.session_ids))
+    sessions = await app.state.session_manager.get_sessions_bulk(request.user_id, session_ids, bool(RESPONSE_FIELDS.intersection(fields)))
+    response = {
+        "user_id": request.user_id,
+        "sessions": [project_session(session_id, session, fields) for session_id, session in sessions.items() if session is not None],
+        "not_found": [session_id for session_id, session in sessions.items() if session is None],
+    }
+    logger.info(f"返回批量会话状态，找到 {len(response['sessions'])} 个，不存在 {len(response['not_found'])} 个")
+    return response
+
+# API接口:分页获取指定用户的会话列表及状态 按最近更新时间排序
+@app.get("/agent/sessions/{user_id}")
+async def list_agent_sessions(user_id: str, offset: int = 0, limit: int = 20, order: str = "desc", fields: Optional[str] = None):
+    logger.info(f"调用/agent/sessions/接口，分页获取指定用户的会话列表，接受到前端用户请求:{user_id}，offset:{offset}，limit:{limit}，order:{order}")
+    if offset < 0 or limit <= 0 or limit > 200:
+        raise HTTPException(status_code=400, detail="offset不能小于0，limit必须在1~200之间")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order只能为asc或desc")
+    selected = resolve_status_fields([field.strip() for field in fields.split(",") if field.strip()] if fields else None)
+    total, sessions = await app.state.session_manager.list_user_sessions(user_id, offset, limit, order, bool(RESPONSE_FIELDS.intersection(selected)))
+    response = {
+        "user_id": user_id,
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "order": order,
+        "sessions": [project_session(session["session_id"], session, selected) for session in sessions],
+    }
+    logger.info(f"返回用户 {user_id} 的会话列表，共 {total} 个，本页 {len(sessions)} 个")
+    return response
+
+# API接口:分页获取指定用户会话的完整消息历史 从checkpointer中按需读取
+@app.get("/agent/history/{user_id}/{session_id}")
+async def get_agent_history(user_id: str, session_id: str, offset: int = 0, limit: int = 50):
+    logger.info(f"调用/agent/history/接口，获取指定用户会话的消息历史，接受到前端用户请求:{user_id}:{session_id}，offset:{offset}，limit:{limit}")
+    # 判断当前用户会话是否存在
+    exists = await app.state.session_manager.session_id_exists(user_id, session_id)
+    if not exists:
+        logger.error(f"status_code=404,用户会话 {user_id}:{session_id} 不存在")
+        raise HTTPException(status_code=404, detail=f"用户会话 {user_id}:{session_id} 不存在")
+    if offset < 0 or limit <= 0:
+        raise HTTPException(status_code=400, detail="offset不能小于0，limit必须大于0")
+
+    state = await app.state.agent.aget_state({"configurable": {"thread_id": session_id}})
+    # 旧版本写入会话状态的系统消息不返回给前端
+    messages = [message for message in state.values.get("messages", []) if not isinstance(message, SystemMessage)]
+    response = {
+        "user_id": user_id,
+        "session_id": session_id,
+        "total": len(messages),
+        "offset": offset,
+        "limit": limit,
+        "messages": [message.model_dump() for message in messages[offset:offset + limit]],
+    }
+    logger.info(f"返回会话 {user_id}:{session_id} 的消息历史，共 {len(messages)} 条")
     return response
 
 # API接口:获取指定用户当前最近一次更新的会话ID
@@ -1100,6 +1949,12 @@ async def get_agent_sessionids(user_id: str):
     logger.info(f"返回当前用户的所有会话ID:{response}")
     return response
 
+# API接口:就绪检查 返回服务是否可以接收请求以及各组件的初始化耗时，未就绪或正在关闭时返回503
+@app.get("/health/ready")
+async def get_health_ready():
+    response = get_startup_tracker().report()
+    return JSONResponse(content=response, status_code=200 if response["ready"] else 503)
+
 # API接口:获取当前系统内全部的会话状态信息
 @app.get("/system/info", response_model=SystemInfoResponse)
 async def get_system_info():
@@ -1114,6 +1969,101 @@ async def get_system_info():
     logger.info(f"返回当前系统状态信息:{response}")
     return response
 
+# API接口:获取共享HTTP连接池的指标数据
+@app.get("/system/http/pool")
+async def get_http_pool_info():
+    logger.info(f"调用/system/http/pool接口，获取共享HTTP连接池的指标数据")
+    response = get_http_pool_metrics()
+    logger.info(f"返回共享HTTP连接池指标:{response}")
+    return response
+
+# API接口:获取MCP会话池的指标数据
+@app.get("/system/mcp/pool")
+async def get_mcp_pool_info():
+    logger.info(f"调用/system/mcp/pool接口，获取MCP会话池的指标数据")
+    from utils.mcp_pool import get_mcp_pool_metrics
+    response = get_mcp_pool_metrics()
+    logger.info(f"返回MCP会话池指标:{response}")
+    return response
+
+# API接口:获取工具结果缓存的指标数据
+@app.get("/system/tool/cache")
+async def get_tool_cache_info():
+    logger.info(f"调用/system/tool/cache接口，获取工具结果缓存的指标数据")
+    response = get_tool_cache_metrics()
+    logger.info(f"返回工具结果缓存指标:{response}")
+    return response
+
+# API接口:获取工具审批策略及审批结果统计
+@app.get("/system/approval/policy")
+async def get_approval_policy_info():
+    logger.info(f"调用/system/approval/policy接口，获取工具审批策略及审批结果统计")
+    response = get_approval_metrics()
+    logger.info(f"返回工具审批策略指标:{response}")
+    return response
+
+# API接口:获取人工审查期间工具预执行的指标数据
+@app.get("/system/tool/speculation")
+async def get_tool_speculation_info():
+    logger.info(f"调用/system/tool/speculation接口，获取工具预执行的指标数据")
+    response = get_speculation_metrics()
+    logger.info(f"返回工具预执行指标:{response}")
+    return response
+
+# API接口:获取模型服务端提示词缓存的命中情况
+@app.get("/system/prompt/cache")
+async def get_prompt_cache_info():
+    logger.info(f"调用/system/prompt/cache接口，获取模型服务端提示词缓存的命中情况")
+    response = get_prompt_cache_metrics()
+    logger.info(f"返回提示词缓存指标:{response}")
+    return response
+
+# API接口:获取客户端断开后取消智能体运行的统计
+@app.get("/system/stream/cancellation")
+async def get_stream_cancellation_info():
+    logger.info(f"调用/system/stream/cancellation接口，获取客户端断开后取消智能体运行的统计")
+    response = get_run_cancellation_metrics()
+    logger.info(f"返回智能体运行取消指标:{response}")
+    return response
+
+# API接口:获取会话记录近端缓存的命中情况
+@app.get("/system/session/near-cache")
+async def get_session_near_cache_info():
+    logger.info(f"调用/system/session/near-cache接口，获取会话记录近端缓存的命中情况")
+    response = get_session_near_cache_metrics()
+    logger.info(f"返回会话近端缓存指标:{response}")
+    return response
+
+# API接口:获取幂等请求的重放和等待情况
+@app.get("/system/idempotency")
+async def get_idempotency_info():
+    logger.info(f"调用/system/idempotency接口，获取幂等请求的重放和等待情况")
+    response = get_idempotency_metrics()
+    logger.info(f"返回幂等请求指标:{response}")
+    return response
+
+# API接口:清理会话状态中旧版本每轮写入的系统消息 不指定user_id时迁移全部用户的会话
+@app.post("/system/migrate/system-messages")
+async def migrate_system_messages(user_id: Optional[str] = None):
+    logger.info(f"调用/system/migrate/system-messages接口，清理会话状态中重复的系统消息，用户:{user_id}")
+    if user_id:
+        users_session_ids = {user_id: await app.state.session_manager.get_all_session_ids(user_id)}
+    else:
+        users_session_ids = await app.state.session_manager.get_all_users_session_ids()
+
+    migrated, skipped, removed = [], [], 0
+    for session_ids in users_session_ids.values():
+        for session_id in session_ids:
+            count = await migrate_thread_system_messages(session_id)
+            if count is None:
+                skipped.append(session_id)
+            elif count > 0:
+                migrated.append(session_id)
+                removed += count
+    response = {"migrated_sessions": migrated, "skipped_sessions": skipped, "removed_messages": removed}
+    logger.info(f"返回系统消息清理结果:{response}")
+    return response
+
 # API接口:删除指定用户当前会话
 @app.delete("/agent/session/{user_id}/{session_id}")
 async def delete_agent_session(user_id: str, session_id: str):
@@ -1171,4 +2121,17 @@ async def write_long_term(request: LongMemRequest):
 
 # 启动服务器
 if __name__ == "__main__":
-    uvicorn.run(app, host=Config.HOST, port=Config.PORT)
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Agent智能体后端API接口服务")
+    parser.add_argument("--workers", type=int, default=Config.WORKERS, help="后端进程数，大于1时以预派生多进程方式运行")
+    args = parser.parse_args()
+    # 启动工作进程前检查连接数预算 预算不足时直接退出，不启动注定初始化失败的工作进程
+    worker_pool_sizes(args.workers)
+    if args.workers > 1:
+        # 工作进程重新导入本模块 进程数通过环境变量传递，用于均分连接数预算
+        os.environ["WORKERS"] = str(args.workers)
+        module = os.path.splitext(os.path.basename(__file__))[0]
+        uvicorn.run(f"{module}:app", host=Config.HOST, port=Config.PORT, workers=args.workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host=Config.HOST, port=Config.PORT)
@@ -1,23 +1,42 @@
+import sys
 import uuid
-import requests
 import json
 import traceback
+import importlib.util
 from typing import Dict, Any, Optional
 import time
 from rich.console import Console
 from rich.prompt import Prompt
 from rich.panel import Panel
-from rich.markdown import Markdown
 from rich.theme import Theme
-from rich.progress import Progress
 import asyncio
-import aiohttp
 
 
 
 # Author:@南哥AGI研习社 (B站 or YouTube 搜索"南哥AGI研习社")
 
 
+# 延迟导入模块 首次访问模块属性时才执行模块代码，缩短CLI启动时间
+def lazy_import(name: str):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+# requests和aiohttp在第一次调用后端接口时才加载，只有流式模式用到aiohttp
+# rich.markdown、rich.progress、rich.table的导入较慢，在使用处导入
+requests = lazy_import("requests")
+aiohttp = lazy_import("aiohttp")
+
+
 # 创建自定义主题
 custom_theme = Theme({
     "info": "cyan bold",
@@ -35,6 +54,39 @@ console = Console(theme=custom_theme)
 # 后端API地址
 API_BASE_URL = "http://localhost:8001"
 
+# 运行智能体请求的重试次数和首次重试前的等待时间（秒），之后每次翻倍
+REQUEST_RETRIES = 3
+REQUEST_RETRY_BACKOFF = 1.0
+# 连接超时和读取超时（秒） 智能体运行可能较久，读取超时需要覆盖完整运行
+REQUEST_TIMEOUT = (5, 600)
+
+
+# 发送运行智能体的POST请求 网络异常时自动重试
+def post_with_retry(url: str, payload: Dict[str, Any]) -> "requests.Response":
+    """
+    发送POST请求，连接失败或超时时按指数退避重试
+
+    同一次调用的所有重试携带相同的Idempotency-Key，服务端不会重复运行智能体，
+    而是等待首次请求的运行完成或直接返回保存的响应
+
+    Args:
+        url: 请求地址
+        payload: 请求体
+
+    Returns:
+        服务端的响应
+    """
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+    for attempt in range(REQUEST_RETRIES + 1):
+        try:
+            return requests.post(url, json=payload, headers=headers, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == REQUEST_RETRIES:
+                raise
+            delay = REQUEST_RETRY_BACKOFF * 2 ** attempt
+            console.print(f"[warning]请求失败，{delay:.0f}秒后重试（{attempt + 1}/{REQUEST_RETRIES}）: {e}[/warning]")
+            time.sleep(delay)
+
 
 # 调用API接口运行智能体并返回大模型结果或中断数据
 def invoke_agent(user_id: str, session_id: str, query: str, system_message: str = "你会使用工具来帮助用户。如果工具使用被拒绝，请提示用户。"):
@@ -60,9 +112,10 @@ def invoke_agent(user_id: str, session_id: str, query: str, system_message: str
     
     console.print("[info]正在发送请求到智能体，请稍候...[/info]")
     
+    from rich.progress import Progress
     with Progress() as progress:
         task = progress.add_task("[cyan]处理中...", total=None)
-        response = requests.post(f"{API_BASE_URL}/agent/invoke", json=payload)
+        response = post_with_retry(f"{API_BASE_URL}/agent/invoke", payload)
         progress.update(task, completed=100)
     
     if response.status_code == 200:
@@ -147,6 +200,12 @@ async def invoke_agent_stream(user_id: str, session_id: str, query: str, system_
                                 final_response = chunk_data.get("data")
                                 break
                                 
+                            elif chunk_type == "cancelled":
+                                # 运行被取消
+                                console.print(f"\n[warning]⏹️  智能体运行已取消[/warning]")
+                                final_response = chunk_data.get("data")
+                                break
+
                             elif chunk_type == "error":
                                 # 处理错误
                                 error_msg = chunk_data.get("error_message", "未知错误")
@@ -171,7 +230,8 @@ async def invoke_agent_stream(user_id: str, session_id: str, query: str, system_
         raise
 
 # 调用API接口恢复被中断的智能体运行并等待运行完成或再次中断
-def resume_agent(user_id: str, session_id: str, response_type: str, args: Optional[Dict[str, Any]] = None):
+def resume_agent(user_id: str, session_id: str, response_type: Optional[str], args: Optional[Dict[str, Any]] = None,
+                 responses: Optional[Dict[str, Dict[str, Any]]] = None):
     """
     发送响应以恢复智能体执行
 
@@ -180,6 +240,7 @@ def resume_agent(user_id: str, session_id: str, response_type: str, args: Option
         session_id: 用户的会话唯一标识
         response_type: 响应类型：accept(允许调用), edit(调整工具参数，此时args中携带修改后的调用参数), response(直接反馈信息，此时args中携带修改后的调用参数)，reject(不允许调用)
         args: 如果是edit, response类型，可能需要额外的参数
+        responses: 批量审查时每个工具调用的响应，interrupt_id -> {"type": 响应类型, "args": 额外参数}
 
     Returns:
         服务端返回的结果
@@ -188,14 +249,16 @@ def resume_agent(user_id: str, session_id: str, response_type: str, args: Option
         "user_id": user_id,
         "session_id": session_id,
         "response_type": response_type,
-        "args": args
+        "args": args,
+        "responses": responses
     }
     
     console.print("[info]正在恢复智能体执行，请稍候...[/info]")
     
+    from rich.progress import Progress
     with Progress() as progress:
         task = progress.add_task("[cyan]恢复执行中...", total=None)
-        response = requests.post(f"{API_BASE_URL}/agent/resume", json=payload)
+        response = post_with_retry(f"{API_BASE_URL}/agent/resume", payload)
         progress.update(task, completed=100)
     
     if response.status_code == 200:
@@ -223,6 +286,7 @@ def write_long_term(user_id: str, memory_info: str):
 
     console.print("[info]正在发送请求写入指定用户长期记忆内容，请稍候...[/info]")
 
+    from rich.progress import Progress
     with Progress() as progress:
         task = progress.add_task("[cyan]写入长期记忆处理中...", total=None)
         response = requests.post(f"{API_BASE_URL}/agent/write/longterm", json=payload)
@@ -233,22 +297,37 @@ def write_long_term(user_id: str, memory_info: str):
     else:
         raise Exception(f"API调用失败: {response.status_code} - {response.text}")
 
+# 会话状态的本地缓存 (user_id, session_id, fields) -> (ETag, 状态数据)
+_status_cache: Dict[tuple, tuple] = {}
+
 # 调用API接口获取指定用户当前会话的状态数据
-def get_agent_status(user_id: str, session_id: str):
+def get_agent_status(user_id: str, session_id: str, fields: Optional[str] = None):
     """
     获取智能体状态
 
     Args:
         user_id: 用户唯一标识
         session_id：会话唯一标识
+        fields: 只返回指定的字段（逗号分隔），轮询状态时只需要status
 
     Returns:
         服务端返回的结果
     """
-    response = requests.get(f"{API_BASE_URL}/agent/status/{user_id}/{session_id}")
-    
+    cache_key = (user_id, session_id, fields)
+    cached = _status_cache.get(cache_key)
+    # 带上次的ETag发起条件请求，会话未变化时服务端返回304
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    params = {"fields": fields} if fields else None
+    response = requests.get(f"{API_BASE_URL}/agent/status/{user_id}/{session_id}", params=params, headers=headers)
+
+    if response.status_code == 304 and cached:
+        return cached[1]
     if response.status_code == 200:
-        return response.json()
+        result = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            _status_cache[cache_key] = (etag, result)
+        return result
     else:
         raise Exception(f"获取智能体状态失败: {response.status_code} - {response.text}")
 
@@ -288,6 +367,26 @@ def get_user_sessionids(user_id: str):
     else:
         raise Exception(f"获取系统信息失败: {response.status_code} - {response.text}")
 
+# 调用API接口分页获取指定用户的会话列表及状态
+def get_user_sessions(user_id: str, offset: int = 0, limit: int = 20):
+    """
+    分页获取指定用户的会话列表，按最近更新时间倒序
+
+    Args:
+        user_id: 用户唯一标识
+        offset: 分页偏移
+        limit: 每页数量
+
+    Returns:
+        服务端返回的结果
+    """
+    response = requests.get(f"{API_BASE_URL}/agent/sessions/{user_id}", params={"offset": offset, "limit": limit})
+
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"获取会话列表失败: {response.status_code} - {response.text}")
+
 # 调用API接口获取当前系统内全部的会话状态信息
 def get_system_info():
     """
@@ -326,6 +425,29 @@ def delete_agent_session(user_id: str, session_id: str):
     else:
         raise Exception(f"删除会话失败: {response.status_code} - {response.text}")
 
+# 调用API接口取消指定用户会话中正在进行的智能体运行
+def cancel_agent(user_id: str, session_id: str, reason: Optional[str] = None):
+    """
+    取消正在进行或等待工具审查的智能体运行
+
+    Args:
+        user_id: 用户唯一标识
+        session_id: 会话唯一标识
+        reason: 取消原因
+
+    Returns:
+        服务端返回的取消结果
+    """
+    response = requests.post(
+        f"{API_BASE_URL}/agent/cancel",
+        json={"user_id": user_id, "session_id": session_id, "reason": reason}
+    )
+
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"取消运行失败: {response.status_code} - {response.text}")
+
 
 # 显示会话的详细信息，包括会话状态、上次查询、响应数据等
 def display_session_info(status_response):
@@ -371,6 +493,12 @@ def display_session_info(status_response):
     elif status == "idle":
         border_style = "cyan"
         title = "[info]空闲会话[/info]"
+    elif status == "cancelled":
+        border_style = "yellow"
+        title = "[warning]已取消会话[/warning]"
+    elif status == "stale":
+        border_style = "red"
+        title = "[warning]运行已失去心跳的会话[/warning]"
     else:
         border_style = "white"
         title = "[info]未知状态会话[/info]"
@@ -391,6 +519,7 @@ def display_session_info(status_response):
             result = last_response["result"]
             if "messages" in result:
                 final_message = result["messages"][-1]
+                from rich.markdown import Markdown
                 console.print(Panel(
                     Markdown(final_message["content"]),
                     title="[success]上次智能体回答[/success]",
@@ -414,6 +543,13 @@ def display_session_info(status_response):
                 border_style="red"
             ))
 
+        elif status == "cancelled":
+            console.print(Panel(
+                last_response.get("message", "智能体运行已取消"),
+                title="[warning]取消原因[/warning]",
+                border_style="yellow"
+            ))
+
 # 检查用户会话状态并尝试恢复
 def check_and_restore_session(user_id: str, session_id: str):
     """
@@ -496,6 +632,7 @@ def check_and_restore_session(user_id: str, session_id: str):
                 if "messages" in last_result:
                     final_message = last_result["messages"][-1]
 
+                    from rich.markdown import Markdown
                     console.print(Panel(
                         Markdown(final_message["content"]),
                         title="[success]上次智能体回答[/success]",
@@ -525,7 +662,7 @@ def check_and_restore_session(user_id: str, session_id: str):
             console.print(Panel(
                 "会话正在运行中，这可能是因为:\n"
                 "1. 另一个客户端正在使用此会话\n"
-                "2. 上一次会话异常终止，状态未更新\n"
+                "2. 上一次运行所在的后端进程刚刚退出，心跳尚未过期\n"
                 "系统将自动等待会话状态变化。",
                 title="[warning]会话运行中[/warning]",
                 border_style="yellow"
@@ -533,6 +670,7 @@ def check_and_restore_session(user_id: str, session_id: str):
 
             # 自动等待会话状态变化
             console.print("[info]自动等待会话状态变化...[/info]")
+            from rich.progress import Progress
             with Progress() as progress:
                 task = progress.add_task("[cyan]等待会话完成...", total=None)
                 max_attempts = 30  # 最多等待30秒
@@ -541,7 +679,7 @@ def check_and_restore_session(user_id: str, session_id: str):
                 for i in range(max_attempts):
                     attempt_count = i
                     # 检查状态
-                    current_status = get_agent_status(user_id, session_id)
+                    current_status = get_agent_status(user_id, session_id, fields="status")
                     if current_status["status"] != "running":
                         progress.update(task, completed=100)
                         console.print(f"[success]会话状态已更新为: {current_status['status']}[/success]")
@@ -557,6 +695,17 @@ def check_and_restore_session(user_id: str, session_id: str):
                 # 获取最新状态（递归调用）
                 return check_and_restore_session(user_id, session_id)
 
+        elif status_response["status"] == "stale":
+            console.print(Panel(
+                "上一次运行所在的后端进程已退出，运行没有完成。\n"
+                "可以继续在当前会话中提问，新的运行会接管该会话。",
+                title="[warning]运行已中止[/warning]",
+                border_style="red"
+            ))
+
+            console.print("[info]基于当前会话开始继续...[/info]")
+            return False, None
+
         elif status_response["status"] == "idle":
             console.print(Panel(
                 "会话处于空闲状态，准备接收新查询。\n"
@@ -609,6 +758,17 @@ def handle_tool_interrupt(interrupt_data, user_id, session_id):
         border_style="yellow"
     ))
 
+    # 多个工具调用同时待审查时 逐个审查后一次性提交
+    pending = interrupt_data.get("interrupts") or []
+    if len(pending) > 1:
+        try:
+            responses = collect_batch_responses(pending)
+            response = resume_agent(user_id, session_id, None, responses=responses)
+            return process_agent_response(response, user_id)
+        except Exception as e:
+            console.print(f"[error]处理响应时出错: {str(e)}[/error]")
+            return None
+
     # 获取用户输入
     user_input = Prompt.ask("[highlight]您的选择[/highlight]")
 
@@ -642,6 +802,42 @@ def handle_tool_interrupt(interrupt_data, user_id, session_id):
         console.print(f"[error]处理响应时出错: {str(e)}[/error]")
         return None
 
+# 逐个审查多个待执行的工具调用
+def collect_batch_responses(pending):
+    """
+    逐个审查多个待执行的工具调用，收集每个工具调用的响应
+
+    参数:
+        pending: 待审查的中断列表
+
+    返回:
+        interrupt_id到响应的映射
+    """
+    responses = {}
+    for index, item in enumerate(pending, 1):
+        action_request = item.get("action_request", {})
+        console.print(f"[highlight]({index}/{len(pending)}) 工具: {action_request.get('action', '未知工具')} 参数: {action_request.get('args', {})}[/highlight]")
+        user_input = Prompt.ask("[highlight]您的选择[/highlight] (yes/no/edit/response)")
+        while True:
+            if user_input.lower() == "yes":
+                responses[item["interrupt_id"]] = {"type": "accept"}
+                break
+            elif user_input.lower() == "no":
+                responses[item["interrupt_id"]] = {"type": "reject"}
+                break
+            elif user_input.lower() == "edit":
+                new_query = Prompt.ask("[highlight]请调整新的参数[/highlight]")
+                responses[item["interrupt_id"]] = {"type": "edit", "args": {"args": json.loads(new_query)}}
+                break
+            elif user_input.lower() == "response":
+                new_query = Prompt.ask("[highlight]不调用工具直接反馈信息[/highlight]")
+                responses[item["interrupt_id"]] = {"type": "response", "args": {"args": new_query}}
+                break
+            else:
+                console.print("[error]无效输入，请输入 'yes'、'no' 、'edit' 或 'response'[/error]")
+                user_input = Prompt.ask("[highlight]您的选择[/highlight]")
+    return responses
+
 # 处理智能体响应，包括处理中断和显示结果
 def process_agent_response(response, user_id):
     # 防御性检查，确保response不为空
@@ -678,6 +874,7 @@ def process_agent_response(response, user_id):
             result = response.get("result", {})
             if result and "messages" in result:
                 final_message = result["messages"][-1]
+                from rich.markdown import Markdown
                 console.print(Panel(
                     Markdown(final_message["content"]),
                     title="[success]智能体回答[/success]",
@@ -701,6 +898,15 @@ def process_agent_response(response, user_id):
             ))
             return None
 
+        elif status == "cancelled":
+            # 显示取消原因
+            console.print(Panel(
+                f"{response.get('message') or '智能体运行已取消'}",
+                title="[warning]运行已取消[/warning]",
+                border_style="yellow"
+            ))
+            return None
+
         elif status == "running":
             # 处理正在运行状态
             console.print("[info]智能体正在处理您的请求，请稍候...[/info]")
@@ -789,7 +995,7 @@ async def main():
                         # 使用process_agent_response处理之前的中断
                         result = process_agent_response(session_status["last_response"], user_id)
                         # 重新检查状态 获取指定用户当前会话的状态数据
-                        current_status = get_agent_status(user_id, session_id)
+                        current_status = get_agent_status(user_id, session_id, fields="status")
                         # 如果通过处理中断后完成了本次会话查询，自动创建新的查询
                         if current_status["status"] == "completed":
                             # 显示完成消息
@@ -803,7 +1009,7 @@ async def main():
 
             # 获取用户查询
             query = Prompt.ask(
-                "\n[info]请输入您的问题[/info] (输入 'exit' 退出，输入 'status' 查询状态，输入 'new' 开始新会话，输入 'history' 恢复历史会话，输入 'setting' 偏好设置)",
+                "\n[info]请输入您的问题[/info] (输入 'exit' 退出，输入 'status' 查询状态，输入 'new' 开始新会话，输入 'history' 恢复历史会话，输入 'setting' 偏好设置，输入 'cancel' 取消当前运行)",
                 default="你好")
 
             # 处理特殊命令 退出
@@ -814,7 +1020,7 @@ async def main():
             # 处理特殊命令 获取指定用户当前会话的状态数据
             elif query.lower() == 'status':
                 # 获取指定用户当前会话的状态数据
-                status_response = get_agent_status(user_id, session_id)
+                status_response = get_agent_status(user_id, session_id, fields="status,last_query,last_updated")
                 console.print(Panel(
                     f"用户ID: {status_response['user_id']}\n"
                     f"会话ID: {status_response.get('session_id', '未知')}\n"
@@ -826,6 +1032,17 @@ async def main():
                 ))
                 continue
 
+            # 处理特殊命令 取消当前会话正在进行或等待审查的运行
+            elif query.lower() == 'cancel':
+                try:
+                    cancel_response = cancel_agent(user_id, session_id)
+                    console.print(f"[info]{cancel_response.get('message')}[/info]")
+                except Exception as e:
+                    console.print(f"[warning]{str(e)}[/warning]")
+                has_active_session = False
+                session_status = None
+                continue
+
             # 处理特殊命令 指定用户开启一个新会话
             elif query.lower() == 'new':
                 session_id = str(uuid.uuid4())
@@ -837,11 +1054,25 @@ async def main():
             # 处理特殊命令 指定用户使用历史会话
             elif query.lower() == 'history':
                 try:
-                    # 获取指定用户的所有会话ID
-                    session_ids = get_user_sessionids(user_id)
-                    # 若存在会话ID 则选择某个历史会话恢复
-                    if session_ids['session_ids']:
-                        console.print(f"[info]当前用户{user_id}的历史会话: {session_ids['session_ids']}[/info]")
+                    # 一次请求获取指定用户最近的会话及其状态
+                    sessions = get_user_sessions(user_id)
+                    # 若存在会话 则选择某个历史会话恢复
+                    if sessions['sessions']:
+                        from rich.table import Table
+                        table = Table(title=f"当前用户{user_id}的历史会话（共{sessions['total']}个）")
+                        table.add_column("会话ID", style="cyan")
+                        table.add_column("状态")
+                        table.add_column("上次查询")
+                        table.add_column("上次更新")
+                        for item in sessions['sessions']:
+                            last_updated = item.get('last_updated')
+                            table.add_row(
+                                item['session_id'],
+                                item.get('status') or '',
+                                item.get('last_query') or '无',
+                                time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_updated)) if isinstance(last_updated, (int, float)) else '未知'
+                            )
+                        console.print(table)
                         # 输入用户的会话ID
                         session_id = Prompt.ask("[info]请输入历史会话ID[/info] (这里演示请输入历史会话ID自动恢复会话)")
                         has_active_session = False
@@ -906,6 +1137,11 @@ async def main():
                 console.print("[info]查询发生错误，将开始新的查询[/info]")
                 has_active_session = False
                 session_status = None
+            elif latest_status["status"] == "cancelled":
+                # 处理已取消状态 会话可以继续对话
+                console.print("[info]本次运行已取消，准备接收新的查询[/info]")
+                has_active_session = False
+                session_status = None
             else:
                 # 其他状态 idle、interrupted
                 has_active_session = True
@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import uvicorn
+from mcp.server.fastmcp import FastMCP
+from langchain_mcp_adapters.client import MultiServerMCPClient
+
+# 以项目根目录为工作目录运行: python benchmarks/bench_mcp_pool.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.mcp_pool import MCPSessionPoolManager
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 本地模拟的高德地图MCP Server
+fake_amap = FastMCP("fake-amap")
+
+
+@fake_amap.tool()
+async def maps_weather(city: str) -> str:
+    """根据城市名称或者标准adcode查询指定城市的天气"""
+    return f"{city}：晴，25℃"
+
+
+# 为每个HTTP请求增加固定延迟 模拟到远程MCP Server的网络往返
+class RTTMiddleware:
+    def __init__(self, app, rtt_ms: float):
+        self.app = app
+        self.rtt = rtt_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and self.rtt > 0:
+            await asyncio.sleep(self.rtt)
+        await self.app(scope, receive, send)
+
+
+# 获取一个空闲端口
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# 启动本地MCP Server
+async def start_fake_server(rtt_ms: float) -> tuple[uvicorn.Server, str]:
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        RTTMiddleware(fake_amap.sse_app(), rtt_ms), host="127.0.0.1", port=port, log_level="warning"
+    ))
+    asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}/sse"
+
+
+# 统计单次调用耗时
+def summarize(name: str, samples: list[float]) -> str:
+    samples_ms = sorted(value * 1000 for value in samples)
+    p95 = samples_ms[max(0, int(len(samples_ms) * 0.95) - 1)]
+    return (f"{name:<28} mean={statistics.mean(samples_ms):8.2f}ms  "
+            f"p50={statistics.median(samples_ms):8.2f}ms  p95={p95:8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="对比每次调用新建MCP会话与会话池复用常驻会话的单次调用耗时")
+    parser.add_argument("--calls", type=int, default=50, help="每种方式的调用次数")
+    parser.add_argument("--rtt-ms", type=float, default=20, help="模拟的网络往返延迟（毫秒）")
+    args = parser.parse_args()
+
+    server, url = await start_fake_server(args.rtt_ms)
+    servers = {"fake-amap": {"url": url, "transport": "sse"}}
+    arguments = {"city": "南京"}
+
+    # 方式一：MultiServerMCPClient.get_tools()返回的工具，每次调用都新建SSE会话
+    tools = await MultiServerMCPClient(servers).get_tools()
+    weather = next(index for index in tools if index.name == "maps_weather")
+    per_call = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        await weather.ainvoke(arguments)
+        per_call.append(time.perf_counter() - start)
+
+    # 方式二：会话池复用常驻会话
+    manager = MCPSessionPoolManager(servers)
+    await manager.pools["fake-amap"].warmup()
+    pooled = []
+    for _ in range(args.calls):
+        start = time.perf_counter()
+        await manager.call_tool("fake-amap", "maps_weather", arguments)
+        pooled.append(time.perf_counter() - start)
+    await manager.close()
+
+    print(f"模拟网络往返: {args.rtt_ms}ms, 每种方式调用 {args.calls} 次")
+    print(summarize("每次调用新建会话", per_call))
+    print(summarize("会话池复用常驻会话", pooled))
+    print(f"平均加速比: {statistics.mean(per_call) / statistics.mean(pooled):.1f}x")
+
+    server.should_exit = True
+    await asyncio.sleep(0.2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+# 以项目根目录为工作目录运行: python benchmarks/bench_session_codec.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.session_codec import SessionCodec, HASH_META_FIELDS, orjson, msgpack, zstandard
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 构造一条会话记录 messages为last_response中携带的消息数量
+def fake_session(messages: int) -> tuple[dict, dict]:
+    meta = {
+        "session_id": "0f8c2b7e-4a1d-4c6b-9a57-1e2f3d4c5b6a",
+        "status": "completed",
+        "last_query": "南京今天天气怎么样？顺便帮我规划一条去夫子庙的路线",
+        "last_updated": time.time(),
+        "version": 1,
+    }
+    history = []
+    for index in range(messages):
+        history.append({
+            "content": f"第{index}条消息：南京今天晴，气温25℃，东南风2级，适合出行。从南京南站到夫子庙可乘坐地铁1号线转3号线。",
+            "additional_kwargs": {}, "response_metadata": {"finish_reason": "stop", "model_name": "gpt-4o-mini"},
+            "type": "ai" if index % 2 else "human", "name": None, "id": f"run-{index:08d}", "example": False,
+        })
+    response = {"session_id": meta["session_id"], "status": "completed", "timestamp": time.time(), "message": None,
+                "result": {"messages": history}, "interrupt_data": None}
+    return meta, response
+
+
+# 多次运行取中位数（微秒）
+def measure(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同会话记录编解码方式的大小和耗时")
+    parser.add_argument("--messages", type=int, nargs="+", default=[4, 40, 200], help="last_response中的消息数量")
+    parser.add_argument("--repeat", type=int, default=500, help="每项测试的重复次数")
+    args = parser.parse_args()
+
+    # 原有方式：整条记录JSON序列化，读取状态时也要解析last_response
+    variants = [("legacy json", None)]
+    variants.append(("json", SessionCodec("json", None)))
+    if orjson is not None:
+        variants.append(("orjson", SessionCodec("orjson", None)))
+    if msgpack is not None:
+        variants.append(("msgpack", SessionCodec("msgpack", None)))
+        if zstandard is not None:
+            variants.append(("msgpack+zstd", SessionCodec("msgpack", "zstd")))
+    elif zstandard is not None:
+        variants.append(("json+zstd", SessionCodec("json", "zstd")))
+
+    for count in args.messages:
+        meta, response = fake_session(count)
+        print(f"\nlast_response包含 {count} 条消息")
+        print(f"{'编解码方式':<14}{'大小(字节)':>12}{'写入(us)':>12}{'完整读取(us)':>14}{'只读状态(us)':>14}{'HMGET元数据(us)':>16}")
+        for name, codec in variants:
+            if codec is None:
+                legacy = {**meta, "last_response": response}
+                raw = json.dumps(legacy).encode("utf-8")
+                size = len(raw)
+                encode_us = measure(lambda: json.dumps(legacy), args.repeat)
+                decode_us = measure(lambda: json.loads(raw), args.repeat)
+                status_us = meta_us = decode_us
+            else:
+                # 哈希格式：各字段分别存储，与会话管理器写入Redis的结构一致
+                mapping = codec.encode_hash(meta, response)
+                meta_fields = {field: mapping[field] for field in HASH_META_FIELDS}
+                size = sum(len(field) + len(value) for field, value in mapping.items())
+                encode_us = measure(lambda: codec.encode_hash(meta, response), args.repeat)
+                decode_us = measure(lambda: codec.decode_hash(mapping).to_dict(), args.repeat)
+                # HGETALL读到last_response，但只读状态时不解析
+                status_us = measure(lambda: codec.decode_hash(mapping).to_dict(include_response=False), args.repeat)
+                # HMGET只读取元数据字段
+                meta_us = measure(lambda: codec.decode_hash(meta_fields).to_dict(include_response=False), args.repeat)
+            print(f"{name:<14}{size:>12}{encode_us:>12.1f}{decode_us:>14.1f}{status_us:>14.1f}{meta_us:>16.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import argparse
+from typing import Any, Dict, Optional
+from pydantic import BaseModel, Field
+
+# 以项目根目录为工作目录运行: python benchmarks/bench_sse_encoder.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.sse import SSEEncoder, orjson
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 与后端一致的流式块模型 用于对比原有的逐块序列化方式
+class StreamChunk(BaseModel):
+    type: str
+    session_id: str
+    timestamp: float = Field(default_factory=lambda: time.time())
+    content: Optional[str] = None
+    data: Optional[Dict[str, Any]] = None
+    interrupt_data: Optional[Dict[str, Any]] = None
+    error_message: Optional[str] = None
+
+
+# 模拟大模型的token流 中文token平均2~3个字符
+def fake_tokens(count: int) -> list[str]:
+    words = ["南京", "今天", "天气", "晴", "，", "气温", "25", "℃", "，", "适合", "出行", "。"]
+    return [words[index % len(words)] for index in range(count)]
+
+
+# 原有方式：每个token构造一次StreamChunk并单独输出一帧
+def run_baseline(tokens: list[str], session_id: str) -> tuple[int, int]:
+    frames, size = 0, 0
+    for token in tokens:
+        frame = f"data: {StreamChunk(type='text_chunk', session_id=session_id, content=token).model_dump_json()}\n\n"
+        frames += 1
+        size += len(frame.encode("utf-8"))
+    return frames, size
+
+
+# 合并编码器：按时间窗口和字节上限合并文本块 tokens_per_second模拟token到达速度
+def run_encoder(tokens: list[str], session_id: str, interval: float, max_bytes: int,
+                tokens_per_second: float) -> tuple[int, int]:
+    encoder = SSEEncoder(session_id, interval=interval, max_bytes=max_bytes)
+    frames, size = 0, 0
+    # 用虚拟时钟模拟token到达间隔，不实际等待
+    clock = [time.monotonic()]
+    real_monotonic = time.monotonic
+    time.monotonic = lambda: clock[0]
+    try:
+        for token in tokens:
+            clock[0] += 1 / tokens_per_second
+            frame = encoder.text(token)
+            if frame:
+                frames += 1
+                size += len(frame)
+        frame = encoder.event("completed", data={"status": "completed"})
+        frames += 1
+        size += len(frame)
+    finally:
+        time.monotonic = real_monotonic
+    return frames, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比逐token输出与合并编码器的SSE编码吞吐量")
+    parser.add_argument("--tokens", type=int, default=200000, help="模拟的token数量")
+    parser.add_argument("--interval", type=float, default=0.03, help="合并时间窗口（秒）")
+    parser.add_argument("--max-bytes", type=int, default=512, help="合并字节上限")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="模拟的单个会话token生成速度")
+    args = parser.parse_args()
+
+    tokens = fake_tokens(args.tokens)
+    session_id = "0f8c2b7e-4a1d-4c6b-9a57-1e2f3d4c5b6a"
+
+    start = time.perf_counter()
+    baseline_frames, baseline_bytes = run_baseline(tokens, session_id)
+    baseline_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoder_frames, encoder_bytes = run_encoder(tokens, session_id, args.interval, args.max_bytes, args.tokens_per_second)
+    encoder_elapsed = time.perf_counter() - start
+
+    print(f"JSON编码器: {'orjson' if orjson is not None else 'json'}，token数: {args.tokens}，"
+          f"合并窗口: {args.interval}s/{args.max_bytes}B，token速度: {args.tokens_per_second}/s")
+    print(f"{'逐token输出':<16} {args.tokens / baseline_elapsed:>12,.0f} chunks/s  帧数={baseline_frames:>8}  字节数={baseline_bytes:>10}")
+    print(f"{'合并编码器':<16} {args.tokens / encoder_elapsed:>12,.0f} chunks/s  帧数={encoder_frames:>8}  字节数={encoder_bytes:>10}")
+    print(f"吞吐量提升: {baseline_elapsed / encoder_elapsed:.1f}x，写入次数减少: {baseline_frames / encoder_frames:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+import subprocess
+import multiprocessing
+import urllib.request
+import aiohttp
+from fastapi import FastAPI
+from fastapi.responses import Response
+
+# 以项目根目录为工作目录运行: python benchmarks/bench_workers.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.session_codec import SessionCodec
+from utils.sse import SSEEncoder, dumps
+from bench_session_codec import fake_session
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 模拟后端每个请求在模型服务之外的CPU开销：解码会话记录、重新编码写回、编码SSE帧和响应体
+# 由uvicorn工作进程按 bench_workers:bench_app 导入
+bench_app = FastAPI()
+_codec = SessionCodec("json", None)
+_meta, _response = fake_session(int(os.getenv("BENCH_MESSAGES", "40")))
+_mapping = _codec.encode_hash(_meta, _response)
+
+
+@bench_app.get("/health/ready")
+async def ready():
+    return {"ready": True, "pid": os.getpid()}
+
+
+@bench_app.get("/agent/status/bench")
+async def status():
+    record = _codec.decode_hash(_mapping)
+    session = record.to_dict()
+    _codec.encode_hash(record.meta, session["last_response"])
+    encoder = SSEEncoder(session["session_id"], interval=0)
+    frames = [encoder.event("completed", data=session["last_response"])]
+    return Response(content=dumps({"session": session, "frames": len(frames)}), media_type="application/json")
+
+
+# 获取一个空闲端口
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+# 以指定进程数启动压测服务 等待就绪后返回子进程和地址
+def start_server(workers: int, messages: int) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "bench_workers:bench_app", "--app-dir", bench_dir,
+         "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=os.path.dirname(bench_dir),
+        env={**os.environ, "BENCH_MESSAGES": str(messages)},
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/health/ready", timeout=1):
+                break
+        except OSError:
+            time.sleep(0.2)
+    else:
+        process.terminate()
+        raise RuntimeError(f"{workers} 个进程的压测服务启动超时")
+    # 第一个进程就绪后等待其余工作进程完成导入
+    time.sleep(1 + 0.2 * workers)
+    return process, url
+
+
+# 单个压测进程 用connections个并发连接持续请求duration秒，返回各请求耗时
+async def _load(url: str, connections: int, duration: float) -> list[float]:
+    samples: list[float] = []
+    deadline = time.perf_counter() + duration
+
+    async def worker(session: aiohttp.ClientSession):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            async with session.get(f"{url}/agent/status/bench") as resp:
+                await resp.read()
+            samples.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(connections)))
+    return samples
+
+
+def _load_process(args: tuple[str, int, float]) -> list[float]:
+    return asyncio.run(_load(*args))
+
+
+# 多个进程同时压测 避免压测端自身成为瓶颈
+def run_load(url: str, clients: int, concurrency: int, duration: float) -> list[float]:
+    per_client = max(concurrency // clients, 1)
+    with multiprocessing.Pool(clients) as pool:
+        results = pool.map(_load_process, [(url, per_client, duration)] * clients)
+    return [sample for result in results for sample in result]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比不同后端进程数下的吞吐量，验证多进程部署的扩展性")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="后端进程数")
+    parser.add_argument("--clients", type=int, default=max((os.cpu_count() or 2) // 2, 1), help="压测进程数")
+    parser.add_argument("--concurrency", type=int, default=64, help="全部压测进程合计的并发连接数")
+    parser.add_argument("--duration", type=float, default=10, help="每轮压测时长（秒）")
+    parser.add_argument("--messages", type=int, default=40, help="会话记录中last_response携带的消息数量")
+    args = parser.parse_args()
+
+    print(f"CPU核数: {os.cpu_count()}，压测进程: {args.clients}，并发连接: {args.concurrency}，每轮 {args.duration} 秒")
+    print(f"{'进程数':<8}{'吞吐量(req/s)':>16}{'p50(ms)':>10}{'p95(ms)':>10}{'加速比':>8}{'扩展效率':>10}")
+    baseline = None
+    for workers in args.workers:
+        process, url = start_server(workers, args.messages)
+        try:
+            samples = run_load(url, args.clients, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        throughput = len(samples) / args.duration
+        baseline = baseline or throughput
+        samples_ms = sorted(value * 1000 for value in samples)
+        p95 = samples_ms[max(0, int(len(samples_ms) * 0.95) - 1)]
+        speedup = throughput / baseline
+        print(f"{workers:<8}{throughput:>16.0f}{statistics.median(samples_ms):>10.2f}{p95:>10.2f}"
+              f"{speedup:>8.2f}{speedup / workers * args.workers[0]:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
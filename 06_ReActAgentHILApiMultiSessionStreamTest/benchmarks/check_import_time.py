@@ -0,0 +1,93 @@
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 入口模块的导入耗时预算（毫秒）和启动时不允许加载的模块
+# 前端CLI只在调用接口、显示结果时才加载requests、aiohttp和rich中较慢的模块；
+# 后端的模型客户端、MCP、PostgreSQL依赖在lifespan中导入，工具脚本和多进程部署的主进程导入本模块时不加载
+ENTRY_POINTS = {
+    "02_frontendServer": {
+        "budget_ms": 150,
+        "forbidden": ["requests", "aiohttp", "rich.markdown", "rich.progress", "rich.table"],
+    },
+    "01_backendServer": {
+        "budget_ms": 2500,
+        "forbidden": ["uvicorn", "psycopg_pool", "langgraph.checkpoint.postgres", "langgraph.store.postgres",
+                      "langchain_openai", "langchain_mcp_adapters", "mcp"],
+    },
+}
+
+
+# 在新的解释器中以 -X importtime 导入模块 返回(模块自身的累计导入耗时(微秒), 导入的全部模块)
+# 使用__import__而不是importlib.import_module：后者走纯Python的导入流程，-X importtime不记录被导入的模块本身
+def measure_import(module: str, cwd: str) -> tuple[int, set[str]]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"__import__({module!r})"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    cumulative, found, imported = 0, False, set()
+    # 每行格式: import time: 自身耗时 | 累计耗时 | 模块名（缩进表示嵌套层级）
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, total, name = line[len("import time:"):].split("|", 2)
+        if not total.strip().isdigit():
+            continue
+        imported.add(name.strip())
+        # 只累计顶层记录 包的子模块可能先于包本身以顶层记录出现，一并计入
+        if not name[1:].startswith(" ") and (name.strip() == module or name.strip().startswith(module + ".")):
+            cumulative += int(total)
+            found = True
+    if not found:
+        raise RuntimeError(f"没有在 -X importtime 输出中找到 {module}")
+    return cumulative, imported
+
+
+# 启动时加载了的不允许模块 包括其子模块
+def loaded_forbidden(imported: set[str], forbidden: list[str]) -> list[str]:
+    return sorted(name for name in forbidden if any(item == name or item.startswith(name + ".") for item in imported))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以 -X importtime 检查前后端入口模块的导入耗时和延迟导入，超出预算时返回非0")
+    parser.add_argument("--modules", nargs="+", default=list(ENTRY_POINTS), help="检查的入口模块")
+    parser.add_argument("--repeat", type=int, default=5, help="每个模块的导入次数，取中位数")
+    parser.add_argument("--scale", type=float, default=1.0, help="预算倍数 较慢的CI机器上可以放宽")
+    args = parser.parse_args()
+
+    # 以项目根目录为工作目录导入入口模块
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    failures = []
+    print(f"{'模块':<22}{'导入耗时(ms)':>14}{'预算(ms)':>10}  结果")
+    for module in args.modules:
+        entry = ENTRY_POINTS[module]
+        samples, imported = [], set()
+        for _ in range(args.repeat):
+            cumulative, imported = measure_import(module, root)
+            samples.append(cumulative / 1000)
+        elapsed = statistics.median(samples)
+        budget = entry["budget_ms"] * args.scale
+        forbidden = loaded_forbidden(imported, entry["forbidden"])
+        ok = elapsed <= budget and not forbidden
+        print(f"{module:<22}{elapsed:>14.1f}{budget:>10.0f}  {'通过' if ok else '失败'}")
+        if elapsed > budget:
+            failures.append(f"{module} 导入耗时 {elapsed:.1f}ms 超出预算 {budget:.0f}ms")
+        if forbidden:
+            failures.append(f"{module} 启动时加载了应延迟导入的模块: {forbidden}")
+
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
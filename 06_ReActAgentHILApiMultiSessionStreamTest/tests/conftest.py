@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 以项目根目录导入utils和后端模块
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+# Config在导入时按相对路径创建logfile目录 测试在临时目录中运行，日志不写入项目中的日志文件
+os.chdir(tempfile.mkdtemp(prefix="agent-tests-"))
@@ -0,0 +1,53 @@
+import json
+import asyncio
+import importlib
+import pytest
+import fakeredis
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+backend = importlib.import_module("01_backendServer")
+
+
+# 使用fakeredis的会话管理器挂载到app.state
+@pytest.fixture
+def manager(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(backend, "create_redis_client", lambda decode_responses=True: fakeredis.aioredis.FakeRedis(
+        server=server, decode_responses=decode_responses))
+    manager = backend.RedisSessionManager(300)
+    monkeypatch.setattr(backend.app.state, "session_manager", manager, raising=False)
+    asyncio.run(manager.create_session("u1", "s1", "error", "北京天气", backend.AgentResponse(
+        session_id="s1", status="error", message="模型服务不可用"), 1700000000.0, ttl=600))
+    return manager
+
+
+def get_status(fields=None, if_none_match=None):
+    return asyncio.run(backend.get_agent_status("u1", "s1", fields, if_none_match))
+
+
+def test_message_field_populated_from_last_response(manager):
+    response = get_status("message")
+    assert json.loads(response.body) == {"user_id": "u1", "session_id": "s1", "status": "error", "message": "模型服务不可用"}
+
+
+def test_etag_depends_on_selected_fields(manager):
+    status_only = get_status("status")
+    with_query = get_status("status,last_query")
+    assert status_only.headers["ETag"] != with_query.headers["ETag"]
+    # 字段顺序不影响ETag
+    assert get_status("last_query,status").headers["ETag"] == with_query.headers["ETag"]
+    # 其他字段集合的ETag不能命中
+    assert get_status("status,last_query", status_only.headers["ETag"]).status_code == 200
+    assert get_status("status", status_only.headers["ETag"]).status_code == 304
+
+
+def test_etag_changes_with_version(manager):
+    etag = get_status("status").headers["ETag"]
+    asyncio.run(manager.update_session("u1", "s1", status="completed", last_updated=1700000100.0, ttl=600))
+    response = get_status("status", etag)
+    assert response.status_code == 200
+    assert json.loads(response.body)["status"] == "completed"
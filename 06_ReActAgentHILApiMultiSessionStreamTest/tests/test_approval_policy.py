@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+import fakeredis
+from utils import approval_policy
+from utils.approval_policy import ApprovalPolicyEngine, AUTO_ACCEPT, REVIEW, REJECT
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 分别以进程内计数和Redis计数运行
+@pytest.fixture(params=["local", "redis"])
+def redis_client(request):
+    return fakeredis.aioredis.FakeRedis(decode_responses=True) if request.param == "redis" else None
+
+
+def decide(engine, tool_name, args=None, user_id="u1", call_key=None):
+    return asyncio.run(engine.decide(tool_name, user_id, args or {}, call_key))
+
+
+def test_first_matching_policy_wins():
+    engine = ApprovalPolicyEngine([
+        {"tools": ["book_hotel"], "action": "review"},
+        {"tools": ["*"], "users": ["admin_*"], "action": "auto_accept"},
+        {"tools": ["book_*"], "action": "reject"},
+    ])
+    assert decide(engine, "book_hotel", user_id="admin_1") == REVIEW
+    assert decide(engine, "book_flight", user_id="admin_1") == AUTO_ACCEPT
+    assert decide(engine, "book_flight", user_id="u1") == REJECT
+    # 未匹配任何规则的工具调用需要人工审查
+    assert decide(engine, "multiply", user_id="u1") == REVIEW
+
+
+@pytest.mark.parametrize("operator, expected, value, matched", [
+    ("eq", "北京", "北京", True),
+    ("ne", "北京", "北京", False),
+    ("in", ["北京", "上海"], "上海", True),
+    ("not_in", ["北京", "上海"], "上海", False),
+    ("lt", 3, 2, True),
+    ("lte", 3, 3, True),
+    ("gt", 3, 3, False),
+    ("gte", 3, "3", True),
+    ("regex", r"^\d+$", "123", True),
+    ("regex", r"^\d+$", "12a", False),
+    ("lt", 3, None, False),
+    ("gt", 3, "很多", False),
+])
+def test_when_operators(operator, expected, value, matched):
+    engine = ApprovalPolicyEngine([{"tools": ["tool"], "when": {"arg": {operator: expected}}, "action": "auto_accept"}])
+    assert decide(engine, "tool", {"arg": value}) == (AUTO_ACCEPT if matched else REVIEW)
+
+
+def test_when_conditions_all_required():
+    engine = ApprovalPolicyEngine([{"tools": ["multiply"], "when": {"a": {"lt": 100}, "b": {"lt": 100}}, "action": "auto_accept"}])
+    assert decide(engine, "multiply", {"a": 1, "b": 2}) == AUTO_ACCEPT
+    assert decide(engine, "multiply", {"a": 1, "b": 200}) == REVIEW
+
+
+def test_invalid_policies_rejected():
+    with pytest.raises(ValueError):
+        ApprovalPolicyEngine([{"tools": ["*"], "action": "allow"}])
+    with pytest.raises(ValueError):
+        ApprovalPolicyEngine([{"tools": ["*"], "when": {"a": {"between": [1, 2]}}, "action": "review"}])
+
+
+def test_rate_limit_falls_back_to_review(redis_client):
+    engine = ApprovalPolicyEngine([{"tools": ["maps_*"], "action": "auto_accept", "rate_limit": "2/60"}], redis_client)
+    decisions = [decide(engine, "maps_weather") for _ in range(3)]
+    assert decisions == [AUTO_ACCEPT, AUTO_ACCEPT, REVIEW]
+    assert engine.stats["rate_limited"] == 1
+    # 频率按用户计数
+    assert decide(engine, "maps_weather", user_id="u2") == AUTO_ACCEPT
+
+
+def test_rate_limited_call_stays_pinned_across_resume(redis_client, monkeypatch):
+    engine = ApprovalPolicyEngine([{"tools": ["maps_*"], "action": "auto_accept", "rate_limit": "1/60"}], redis_client)
+    assert decide(engine, "maps_weather", call_key="call_1") == AUTO_ACCEPT
+    assert decide(engine, "maps_weather", call_key="call_2") == REVIEW
+    # 中断恢复时进入新的时间窗口，已转为人工审查的调用仍需审查，新的调用按新窗口计数
+    now = approval_policy.time.time()
+    monkeypatch.setattr(approval_policy.time, "time", lambda: now + 120)
+    assert decide(engine, "maps_weather", call_key="call_2") == REVIEW
+    assert decide(engine, "maps_weather", call_key="call_3") == AUTO_ACCEPT
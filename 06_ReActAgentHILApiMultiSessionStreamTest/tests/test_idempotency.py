@@ -0,0 +1,141 @@
+import json
+import asyncio
+import importlib
+import pytest
+import fakeredis
+from fastapi import HTTPException
+from utils import idempotency
+from utils.idempotency import IdempotencyStore, IdempotencyKeyReused, idempotency_record_key, request_fingerprint
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+backend = importlib.import_module("01_backendServer")
+
+
+@pytest.fixture
+def store():
+    return IdempotencyStore(fakeredis.aioredis.FakeRedis(decode_responses=True))
+
+
+# 记录调用次数的handler
+class CountingHandler:
+    def __init__(self, response=None, error=None, delay=0.0):
+        self.calls = 0
+        self.response = response or {"status": "completed"}
+        self.error = error
+        self.delay = delay
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+def test_replays_completed_response(store):
+    handler = CountingHandler({"status": "completed", "message": "第一次"})
+
+    async def run():
+        first = await store.run("u1", "invoke", "key-1", "fp", handler)
+        second = await store.run("u1", "invoke", "key-1", "fp", handler)
+        return first, second
+
+    assert asyncio.run(run()) == (({"status": "completed", "message": "第一次"}, False),
+                                  ({"status": "completed", "message": "第一次"}, True))
+    assert handler.calls == 1
+    assert store.stats["replayed"] == 1
+
+
+def test_concurrent_duplicates_run_once(store):
+    handler = CountingHandler(delay=0.05)
+
+    async def run():
+        return await asyncio.gather(*(store.run("u1", "invoke", "key-1", "fp", handler) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert handler.calls == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+    assert store.stats["attached"] == 2
+
+
+def test_key_reused_with_different_body(store):
+    async def run():
+        await store.run("u1", "invoke", "key-1", "fp-a", CountingHandler())
+        await store.run("u1", "invoke", "key-1", "fp-b", CountingHandler())
+
+    with pytest.raises(IdempotencyKeyReused):
+        asyncio.run(run())
+    assert store.stats["conflicts"] == 1
+
+
+def test_keys_scoped_by_user_and_endpoint(store):
+    handler = CountingHandler()
+
+    async def run():
+        for user_id, scope in [("u1", "invoke"), ("u2", "invoke"), ("u1", "resume")]:
+            await store.run(user_id, scope, "key-1", "fp", handler)
+
+    asyncio.run(run())
+    assert handler.calls == 3
+
+
+def test_record_released_on_exception(store):
+    failing = CountingHandler(error=RuntimeError("模型服务不可用"))
+    retry = CountingHandler({"status": "completed"})
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await store.run("u1", "invoke", "key-1", "fp", failing)
+        released = await store.redis_client.exists(idempotency_record_key("u1", "invoke", "key-1"))
+        return released, await store.run("u1", "invoke", "key-1", "fp", retry)
+
+    released, result = asyncio.run(run())
+    assert released == 0
+    assert result == ({"status": "completed"}, False)
+    assert store.stats["released"] == 1
+    assert store._inflight == {}
+
+
+def test_completed_record_stored_with_fingerprint(store):
+    async def run():
+        await store.run("u1", "invoke", "key-1", request_fingerprint('{"query": "你好"}'), CountingHandler())
+        return json.loads(await store.redis_client.get(idempotency_record_key("u1", "invoke", "key-1")))
+
+    record = asyncio.run(run())
+    assert record["state"] == "completed"
+    assert record["fingerprint"] == request_fingerprint('{"query": "你好"}')
+
+
+def test_run_idempotent_maps_reused_key_to_422(store, monkeypatch):
+    monkeypatch.setattr(idempotency, "_idempotency_store", store)
+    request_a = backend.CancelRequest(user_id="u1", session_id="s1", reason="a")
+    request_b = backend.CancelRequest(user_id="u1", session_id="s1", reason="b")
+
+    async def handler():
+        return backend.AgentResponse(session_id="s1", status="completed")
+
+    async def run():
+        first = await backend.run_idempotent("u1", "invoke", "key-1", request_a, handler)
+        replayed = await backend.run_idempotent("u1", "invoke", "key-1", request_a, handler)
+        with pytest.raises(HTTPException) as conflict:
+            await backend.run_idempotent("u1", "invoke", "key-1", request_b, handler)
+        return first, replayed, conflict.value
+
+    first, replayed, conflict = asyncio.run(run())
+    assert first.headers["Idempotent-Replayed"] == "false"
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert conflict.status_code == 422
+
+
+def test_run_idempotent_without_key_runs_directly(store, monkeypatch):
+    monkeypatch.setattr(idempotency, "_idempotency_store", store)
+
+    async def handler():
+        return backend.AgentResponse(session_id="s1", status="completed")
+
+    response = asyncio.run(backend.run_idempotent("u1", "invoke", None, backend.CancelRequest(user_id="u1", session_id="s1"), handler))
+    assert isinstance(response, backend.AgentResponse)
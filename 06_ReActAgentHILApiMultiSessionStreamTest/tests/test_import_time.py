@@ -0,0 +1,36 @@
+import os
+import statistics
+import importlib.util
+import pytest
+from conftest import PROJECT_DIR
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 加载benchmarks中的导入耗时检查脚本
+_spec = importlib.util.spec_from_file_location("check_import_time", os.path.join(PROJECT_DIR, "benchmarks", "check_import_time.py"))
+check_import_time = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(check_import_time)
+
+# 预算倍数 较慢的机器上可以通过环境变量放宽
+BUDGET_SCALE = float(os.getenv("IMPORT_TIME_BUDGET_SCALE", "1.0"))
+
+
+@pytest.mark.parametrize("module", list(check_import_time.ENTRY_POINTS))
+def test_entry_point_import_budget(module, tmp_path, monkeypatch):
+    # 在临时目录中导入 日志不写入项目中的日志文件
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(filter(None, [PROJECT_DIR, os.getenv("PYTHONPATH")])))
+    entry = check_import_time.ENTRY_POINTS[module]
+    samples, imported = [], set()
+    for _ in range(3):
+        try:
+            cumulative, imported = check_import_time.measure_import(module, str(tmp_path))
+        except RuntimeError as e:
+            if "ModuleNotFoundError" in str(e):
+                pytest.skip(f"{module} 的依赖未安装: {str(e).strip().splitlines()[-1]}")
+            raise
+        samples.append(cumulative / 1000)
+    assert check_import_time.loaded_forbidden(imported, entry["forbidden"]) == []
+    assert statistics.median(samples) <= entry["budget_ms"] * BUDGET_SCALE
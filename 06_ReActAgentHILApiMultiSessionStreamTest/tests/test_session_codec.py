@@ -0,0 +1,96 @@
+import json
+import pytest
+from utils.session_codec import SessionCodec, HASH_META_FIELDS, HASH_RESPONSE_FIELD, _HEADER, _MAGIC, _CODEC_IDS, _COMPRESSION_NONE
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+META = {"session_id": "s1", "status": "completed", "last_query": "北京天气", "last_updated": 1700000000.5, "version": 3}
+
+
+# 构造指定大小的last_response
+def make_response(messages: int) -> dict:
+    return {
+        "session_id": "s1",
+        "status": "completed",
+        "result": {"messages": [{"type": "ai", "content": f"第{index}条回答，" + "内容" * 40} for index in range(messages)]},
+    }
+
+
+# 旧版本字符串格式的记录 元数据和last_response均为JSON
+def legacy_packed_record(meta: dict, response: dict) -> bytes:
+    meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+    payload = json.dumps(response, ensure_ascii=False).encode("utf-8")
+    return _HEADER.pack(_MAGIC, _CODEC_IDS["json"], _COMPRESSION_NONE, len(meta_bytes)) + meta_bytes + payload
+
+
+def test_legacy_packed_record():
+    response = make_response(3)
+    record = SessionCodec("msgpack", "zstd").decode(legacy_packed_record(META, response))
+    assert record.meta == META
+    assert record._decoded is False
+    assert record.response == response
+
+
+@pytest.mark.parametrize("codec", ["json", "orjson", "msgpack"])
+def test_hash_round_trip(codec):
+    session_codec = SessionCodec(codec, "zstd")
+    response = make_response(3)
+    record = session_codec.decode_hash(session_codec.encode_hash(META, response))
+    assert record.meta == META
+    assert record.response == response
+
+
+def test_zstd_only_above_threshold():
+    session_codec = SessionCodec("json", "zstd", compress_threshold=1024)
+    small, large = make_response(1), make_response(50)
+    assert session_codec.encode_response(small)[0] == 0
+    compression, payload = session_codec.encode_response(large)
+    assert compression == 1
+    assert len(payload) < len(json.dumps(large, ensure_ascii=False).encode("utf-8"))
+    record = session_codec.decode_hash(session_codec.encode_hash(META, large))
+    assert record.compression == 1
+    assert record.response == large
+
+
+def test_response_decoded_lazily():
+    session_codec = SessionCodec("msgpack", "zstd", compress_threshold=0)
+    record = session_codec.decode_hash(session_codec.encode_hash(META, make_response(5)))
+    assert record._decoded is False
+    assert record.to_dict(include_response=False) == META
+    assert record._decoded is False
+    assert record.response["result"]["messages"][0]["content"].startswith("第0条回答")
+    assert record._decoded is True
+
+
+def test_meta_only_mapping_has_no_response():
+    session_codec = SessionCodec("json", None)
+    mapping = session_codec.encode_hash(META, make_response(2))
+    meta_only = {field: mapping[field] for field in HASH_META_FIELDS}
+    record = session_codec.decode_hash(meta_only)
+    assert record.meta == META
+    assert record.response is None
+
+
+def test_none_response():
+    session_codec = SessionCodec("orjson", "zstd")
+    mapping = session_codec.encode_hash(META, None)
+    assert session_codec.decode_hash(mapping).response is None
+    assert mapping[HASH_RESPONSE_FIELD][2:] == b""
+
+
+def test_legacy_json_string_record():
+    session_codec = SessionCodec("msgpack", "zstd")
+    legacy = json.dumps({**META, "last_response": make_response(2)}, ensure_ascii=False)
+    record = session_codec.decode(legacy)
+    assert record.meta == META
+    assert record.response == make_response(2)
+    # 迁移为哈希格式时按当前序列化方式重新编码
+    assert session_codec.decode_hash(session_codec.encode_hash(record.meta, record.response)).response == make_response(2)
+
+
+def test_unknown_codec_rejected():
+    with pytest.raises(ValueError):
+        SessionCodec("pickle", None)
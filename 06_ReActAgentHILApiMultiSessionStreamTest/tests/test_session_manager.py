@@ -0,0 +1,193 @@
+import json
+import time
+import asyncio
+import importlib
+import pytest
+import fakeredis
+from utils.redis_conn import session_key, user_sessions_key
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+backend = importlib.import_module("01_backendServer")
+
+
+# 使用fakeredis的会话管理器 两个客户端共享同一个Redis替身
+@pytest.fixture
+def manager(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(backend, "create_redis_client", lambda decode_responses=True: fakeredis.aioredis.FakeRedis(
+        server=server, decode_responses=decode_responses))
+    return backend.RedisSessionManager(300)
+
+
+# 旧版本的整体JSON字符串记录
+def legacy_record(session_id: str) -> str:
+    return json.dumps({
+        "session_id": session_id,
+        "status": "completed",
+        "last_query": "你好",
+        "last_updated": 1700000000.0,
+        "last_response": {"session_id": session_id, "status": "completed", "message": "旧回答"},
+    }, ensure_ascii=False)
+
+
+def test_get_session_record_reads_legacy_string(manager):
+    async def run():
+        await manager.raw_client.set(session_key("u1", "s1"), legacy_record("s1"))
+        meta_only = await manager.get_session_record("u1", "s1", include_response=False)
+        full = await manager.get_session_record("u1", "s1")
+        return meta_only, full
+
+    meta_only, full = asyncio.run(run())
+    assert meta_only.meta["status"] == "completed"
+    assert full.meta["last_query"] == "你好"
+    assert full.response["message"] == "旧回答"
+
+
+def test_update_migrates_legacy_string_to_hash(manager):
+    async def run():
+        key = session_key("u1", "s1")
+        await manager.raw_client.set(key, legacy_record("s1"))
+        updated = await manager.update_session("u1", "s1", status="running", last_updated=1700000100.0, ttl=600)
+        return updated, await manager.raw_client.type(key), await manager.get_session_record("u1", "s1")
+
+    updated, key_type, record = asyncio.run(run())
+    assert updated is True
+    assert key_type == b"hash"
+    assert record.meta["status"] == "running"
+    # 未提供last_response时保留旧记录中的回答
+    assert record.response["message"] == "旧回答"
+
+
+def test_update_missing_session(manager):
+    assert asyncio.run(manager.update_session("u1", "missing", status="running")) is False
+
+
+def test_touch_session_ttl_only_keeps_version(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "running", "问题", None, 1700000000.0, ttl=60)
+        before = await manager.get_session_record("u1", "s1", include_response=False)
+        touched = await manager.touch_session("u1", "s1", ttl=3600)
+        after = await manager.get_session_record("u1", "s1", include_response=False)
+        return touched, before, after, await manager.raw_client.ttl(session_key("u1", "s1"))
+
+    touched, before, after, ttl = asyncio.run(run())
+    assert touched is True
+    assert after.meta["version"] == before.meta["version"]
+    assert ttl > 60
+
+
+def test_touch_session_status_keeps_response(manager):
+    async def run():
+        response = backend.AgentResponse(session_id="s1", status="interrupted", message="等待审查")
+        await manager.create_session("u1", "s1", "interrupted", "订酒店", response, 1700000000.0, ttl=60)
+        await manager.touch_session("u1", "s1", "running", 1700000100.0, ttl=600)
+        return await manager.get_session_record("u1", "s1")
+
+    record = asyncio.run(run())
+    assert record.meta["status"] == "running"
+    assert record.meta["last_updated"] == 1700000100.0
+    assert record.meta["last_query"] == "订酒店"
+    assert record.meta["version"] == 2
+    assert record.response["message"] == "等待审查"
+
+
+def test_touch_missing_session(manager):
+    assert asyncio.run(manager.touch_session("u1", "missing")) is False
+
+
+def test_concurrent_claims_start_one_run(manager):
+    async def run():
+        results = await asyncio.gather(*(manager.claim_session("u1", "s1", f"问题{index}", time.time(), 600) for index in range(5)))
+        record = await manager.get_session_record("u1", "s1", include_response=False)
+        return results, record, await manager.redis_client.smembers(user_sessions_key("u1"))
+
+    results, record, session_ids = asyncio.run(run())
+    assert sorted(results) == ["busy"] * 4 + ["claimed"]
+    assert record.meta["status"] == "running"
+    assert session_ids == {"s1"}
+
+
+def test_claim_takes_over_stale_run_once(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "running", "旧问题", None, 1700000000.0, ttl=600)
+        return await asyncio.gather(*(manager.claim_session("u1", "s1", "新问题", time.time(), 600) for _ in range(3)))
+
+    assert sorted(asyncio.run(run())) == ["busy", "busy", "taken_over"]
+
+
+def test_claim_refuses_run_with_heartbeat(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "running", "旧问题", None, 1700000000.0, ttl=600)
+        await manager.redis_client.set(backend.run_heartbeat_key("u1", "s1"), "worker", ex=15)
+        return await manager.claim_session("u1", "s1", "新问题", time.time(), 600)
+
+    assert asyncio.run(run()) == "busy"
+
+
+def test_claim_idle_and_legacy_sessions(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "completed", "旧问题", None, 1700000000.0, ttl=600)
+        await manager.raw_client.set(session_key("u1", "s2"), legacy_record("s2"))
+        results = [await manager.claim_session("u1", session_id, "新问题", time.time(), 600) for session_id in ("s1", "s2")]
+        return results, await manager.get_session_record("u1", "s2")
+
+    results, legacy = asyncio.run(run())
+    assert results == ["claimed", "claimed"]
+    assert legacy.meta["status"] == "running"
+    assert legacy.response["message"] == "旧回答"
+
+
+def test_concurrent_resumes_start_one_run(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "interrupted", "订酒店", None, 1700000000.0, ttl=600)
+        results = await asyncio.gather(*(manager.resume_session("u1", "s1", time.time(), 600) for _ in range(5)))
+        return results, await manager.get_session_record("u1", "s1", include_response=False)
+
+    results, record = asyncio.run(run())
+    assert sorted(results) == [False] * 4 + [True]
+    assert record.meta["status"] == "running"
+    assert record.meta["last_query"] == "订酒店"
+
+
+def test_resume_refuses_non_interrupted_and_missing(manager):
+    async def run():
+        await manager.create_session("u1", "s1", "completed", "旧问题", None, 1700000000.0, ttl=600)
+        return await manager.resume_session("u1", "s1", time.time(), 600), await manager.resume_session("u1", "missing", time.time(), 600)
+
+    assert asyncio.run(run()) == (False, False)
+
+
+def test_resume_legacy_session(manager):
+    async def run():
+        legacy = json.loads(legacy_record("s1"))
+        legacy["status"] = "interrupted"
+        await manager.raw_client.set(session_key("u1", "s1"), json.dumps(legacy, ensure_ascii=False))
+        resumed = await manager.resume_session("u1", "s1", time.time(), 600)
+        return resumed, await manager.get_session_record("u1", "s1")
+
+    resumed, record = asyncio.run(run())
+    assert resumed is True
+    assert record.meta["status"] == "running"
+    assert record.response["message"] == "旧回答"
+
+
+def test_resume_endpoint_returns_409_when_claim_lost(manager, monkeypatch):
+    monkeypatch.setattr(backend.app.state, "session_manager", manager, raising=False)
+
+    # 构造恢复命令期间另一个恢复请求已将会话切换为running
+    async def build_resume_command(session_id, response):
+        await manager.resume_session("u1", session_id, time.time(), 600)
+
+    monkeypatch.setattr(backend, "build_resume_command", build_resume_command)
+
+    async def run():
+        await manager.create_session("u1", "s1", "interrupted", "订酒店", None, 1700000000.0, ttl=600)
+        with pytest.raises(backend.HTTPException) as lost:
+            await backend.run_resume_agent(backend.InterruptResponse(user_id="u1", session_id="s1", response_type="accept"))
+        return lost.value
+
+    assert asyncio.run(run()).status_code == 409
@@ -0,0 +1,67 @@
+from utils.session_codec import SessionRecord
+from utils.session_near_cache import SessionNearCache
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+def make_cache() -> SessionNearCache:
+    cache = SessionNearCache()
+    # 不建立失效通知连接 直接启用缓存
+    cache.ready = True
+    return cache
+
+
+def make_record(status: str) -> SessionRecord:
+    return SessionRecord({"session_id": "s1", "status": status}, 1, 0, b"")
+
+
+def test_put_after_read_is_cached():
+    cache = make_cache()
+    generation = cache.begin("session:{u1}:s1")
+    cache.put("session:{u1}:s1", make_record("running"), False, generation)
+    cache.end("session:{u1}:s1")
+    assert cache.get("session:{u1}:s1", False).meta["status"] == "running"
+    assert cache._pending == {}
+
+
+def test_invalidation_of_same_key_drops_put():
+    cache = make_cache()
+    generation = cache.begin("session:{u1}:s1")
+    cache.invalidate("session:{u1}:s1")
+    cache.put("session:{u1}:s1", make_record("running"), False, generation)
+    cache.end("session:{u1}:s1")
+    assert cache.get("session:{u1}:s1", False) is None
+
+
+def test_invalidation_of_other_key_keeps_put():
+    cache = make_cache()
+    generation = cache.begin("session:{u1}:s1")
+    cache.invalidate("session:{u1}:s2")
+    cache.put("session:{u1}:s1", make_record("running"), False, generation)
+    cache.end("session:{u1}:s1")
+    assert cache.get("session:{u1}:s1", False) is not None
+
+
+def test_flush_drops_pending_puts():
+    cache = make_cache()
+    generation = cache.begin("session:{u1}:s1")
+    cache._flush()
+    cache.put("session:{u1}:s1", make_record("running"), False, generation)
+    cache.end("session:{u1}:s1")
+    assert cache.get("session:{u1}:s1", False) is None
+
+
+def test_concurrent_reads_share_key_generation():
+    cache = make_cache()
+    first = cache.begin("session:{u1}:s1")
+    second = cache.begin("session:{u1}:s1")
+    cache.end("session:{u1}:s1")
+    # 另一个读取仍在进行 该键继续被跟踪
+    cache.invalidate("session:{u1}:s1")
+    cache.put("session:{u1}:s1", make_record("running"), False, second)
+    cache.end("session:{u1}:s1")
+    assert first == second
+    assert cache.get("session:{u1}:s1", False) is None
+    assert cache._pending == {}
@@ -0,0 +1,127 @@
+import json
+import time
+import asyncio
+import pytest
+import fakeredis
+from utils.config import Config
+from utils.spatial_cache import (SpatialResultCache, geohash_encode, geohash_bounds, geohash_neighbors,
+                                 haversine_distance, parse_lnglat)
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+POLICY = {"coord_arg": "location", "precision": 7, "radius": 100, "ttl": 600}
+
+
+@pytest.fixture
+def cache():
+    return SpatialResultCache(fakeredis.aioredis.FakeRedis(decode_responses=True), {"maps_regeocode": POLICY})
+
+
+def test_geohash_encode_known_values():
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(42.6, -5.6, 5) == "ezs42"
+
+
+def test_geohash_bounds_contain_point():
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(geohash_encode(32.01112, 118.79815, 7))
+    assert lat_min <= 32.01112 <= lat_max
+    assert lng_min <= 118.79815 <= lng_max
+
+
+def test_geohash_neighbors_surround_cell():
+    cell = geohash_encode(32.01112, 118.79815, 7)
+    neighbors = geohash_neighbors(cell)
+    assert len(neighbors) == 9 and len(set(neighbors)) == 9
+    assert cell in neighbors
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(cell)
+    # 紧邻格子四条边外侧的点都落在相邻格子中
+    for lat, lng in [(lat_max + 1e-6, 118.79815), (lat_min - 1e-6, 118.79815),
+                     (32.01112, lng_max + 1e-6), (32.01112, lng_min - 1e-6)]:
+        assert geohash_encode(lat, lng, 7) in neighbors
+
+
+def test_geohash_neighbors_wrap_antimeridian():
+    neighbors = geohash_neighbors(geohash_encode(0.0, 179.9999, 5))
+    assert any(geohash_bounds(cell)[2] < 0 for cell in neighbors)
+
+
+def test_geohash_neighbors_at_pole():
+    neighbors = geohash_neighbors(geohash_encode(89.9999, 10.0, 4))
+    assert len(neighbors) == 6
+
+
+def test_haversine_distance():
+    assert haversine_distance(32.0, 118.0, 32.0, 118.0) == 0
+    # 纬度相差0.001度约111米
+    assert haversine_distance(32.0, 118.0, 32.001, 118.0) == pytest.approx(111.2, abs=0.5)
+
+
+def test_parse_lnglat():
+    assert parse_lnglat("118.79815,32.01112") == (118.79815, 32.01112)
+    assert parse_lnglat("118.79815，32.01112") == (118.79815, 32.01112)
+    assert parse_lnglat("32.01112") is None
+    assert parse_lnglat("200,32") is None
+    assert parse_lnglat(None) is None
+
+
+def test_hit_within_radius_across_cell_edge(cache):
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(geohash_encode(32.01112, 118.79815, 7))
+    inside, outside = lng_max - 0.0001, lng_max + 0.0001
+
+    async def run():
+        await cache.set("maps_regeocode", inside, 32.01112, "{}", {"address": "南京"})
+        return await cache.get("maps_regeocode", outside, 32.01112, "{}")
+
+    assert geohash_encode(32.01112, inside, 7) != geohash_encode(32.01112, outside, 7)
+    assert asyncio.run(run()) == (True, {"address": "南京"})
+
+
+def test_miss_outside_radius_or_other_args(cache):
+    async def run():
+        await cache.set("maps_regeocode", 118.79815, 32.01112, "{}", {"address": "南京"})
+        far = await cache.get("maps_regeocode", 118.79815, 32.01112 + 0.002, "{}")
+        other_args = await cache.get("maps_regeocode", 118.79815, 32.01112, '{"radius": 1000}')
+        return far, other_args
+
+    assert asyncio.run(run()) == ((False, None), (False, None))
+
+
+def test_returns_nearest_entry(cache):
+    async def run():
+        await cache.set("maps_regeocode", 118.79815, 32.01112, "{}", "远")
+        await cache.set("maps_regeocode", 118.79815, 32.01142, "{}", "近")
+        return await cache.get("maps_regeocode", 118.79815, 32.01150, "{}")
+
+    assert asyncio.run(run()) == (True, "近")
+
+
+def test_get_deletes_expired_fields(cache):
+    async def run():
+        await cache.set("maps_regeocode", 118.79815, 32.01112, "{}", "新")
+        key = cache._cell_key("maps_regeocode", "{}", geohash_encode(32.01112, 118.79815, 7))
+        await cache.redis_client.hset(key, "118.79816,32.01112", json.dumps({"value": "旧", "expires_at": time.time() - 1}))
+        result = await cache.get("maps_regeocode", 118.79816, 32.01112, "{}")
+        return result, await cache.redis_client.hkeys(key)
+
+    result, fields = asyncio.run(run())
+    assert result == (True, "新")
+    assert fields == ["118.79815,32.01112"]
+    assert cache.stats["pruned"] == 1
+
+
+def test_set_caps_fields_per_cell(cache, monkeypatch):
+    monkeypatch.setattr(Config, "TOOL_SPATIAL_CACHE_MAX_ENTRIES", 3)
+
+    async def run():
+        for index in range(6):
+            await cache.set("maps_regeocode", 118.79815 + index * 1e-6, 32.01112, "{}", index)
+        key = cache._cell_key("maps_regeocode", "{}", geohash_encode(32.01112, 118.79815, 7))
+        return await cache.redis_client.hlen(key), await cache.get("maps_regeocode", 118.79815, 32.01112, "{}")
+
+    size, result = asyncio.run(run())
+    assert size == 3
+    # 先过期的旧记录被淘汰 保留最近写入的记录
+    assert result[0] is True and result[1] >= 3
@@ -0,0 +1,56 @@
+import json
+import asyncio
+from utils.sse import SSEEncoder
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 解析SSE帧中的JSON
+def parse(frame: bytes) -> list:
+    return [json.loads(line[len(b"data: "):]) for line in frame.split(b"\n\n") if line]
+
+
+def test_text_coalesced_until_event():
+    encoder = SSEEncoder("s1", interval=60, max_bytes=1024)
+    assert encoder.text("你") is None
+    assert encoder.text("好") is None
+    frames = parse(encoder.event("completed", data={"status": "completed"}))
+    assert [frame["type"] for frame in frames] == ["text_chunk", "completed"]
+    assert frames[0]["content"] == "你好"
+
+
+def test_max_bytes_flushes_immediately():
+    encoder = SSEEncoder("s1", interval=60, max_bytes=4)
+    assert encoder.text("ab") is None
+    assert parse(encoder.text("cd"))[0]["content"] == "abcd"
+
+
+def test_timer_flushes_pending_text_without_next_chunk():
+    async def run():
+        frames = []
+        encoder = SSEEncoder("s1", interval=0.01, max_bytes=1024, sink=frames.append)
+        encoder.text("第一个文本块")
+        # 模型输出停顿 没有后续文本块时由定时器输出
+        await asyncio.sleep(0.05)
+        return frames, encoder
+
+    frames, encoder = asyncio.run(run())
+    assert len(frames) == 1
+    assert parse(frames[0])[0]["content"] == "第一个文本块"
+    assert encoder.flush() is None
+
+
+def test_event_cancels_timer():
+    async def run():
+        frames = []
+        encoder = SSEEncoder("s1", interval=0.01, max_bytes=1024, sink=frames.append)
+        encoder.text("文本")
+        event = encoder.event("error", error_message="出错")
+        await asyncio.sleep(0.05)
+        return frames, event
+
+    frames, event = asyncio.run(run())
+    assert frames == []
+    assert [frame["type"] for frame in parse(event)] == ["text_chunk", "error"]
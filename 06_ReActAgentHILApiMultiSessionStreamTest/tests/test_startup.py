@@ -0,0 +1,24 @@
+import pytest
+from utils.config import Config
+from utils.startup import worker_pool_sizes, MIN_WORKER_POOL_SIZE
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+def test_pool_sizes_split_budget(monkeypatch):
+    monkeypatch.setattr(Config, "DB_CONNECTION_BUDGET", 40)
+    monkeypatch.setattr(Config, "MIN_SIZE", 5)
+    monkeypatch.setattr(Config, "MAX_SIZE", 10)
+    assert worker_pool_sizes(1) == (5, 10)
+    assert worker_pool_sizes(8) == (5, 5)
+    assert worker_pool_sizes(10) == (4, 4)
+
+
+@pytest.mark.parametrize("workers", [11, 20])
+def test_budget_too_small_fails_fast(monkeypatch, workers):
+    monkeypatch.setattr(Config, "DB_CONNECTION_BUDGET", 40)
+    assert workers * MIN_WORKER_POOL_SIZE > Config.DB_CONNECTION_BUDGET
+    with pytest.raises(ValueError):
+        worker_pool_sizes(workers)
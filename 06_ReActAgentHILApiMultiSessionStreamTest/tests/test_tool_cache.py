@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+import fakeredis
+from utils.tool_cache import ToolResultCache, normalize_args
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+POLICIES = {"maps_weather": {"ttl": 600}}
+
+
+@pytest.fixture
+def cache():
+    return ToolResultCache(fakeredis.aioredis.FakeRedis(decode_responses=True), POLICIES)
+
+
+def test_normalize_args_equivalent_inputs():
+    assert normalize_args({"location": "118.79815， 32.01112", "extra": None}) == normalize_args({"location": "118.79815,32.01112"})
+
+
+def test_redis_hit_fills_local_cache(cache):
+    async def run():
+        await cache.set("maps_weather", {"city": "北京"}, "晴")
+        # 模拟其他进程写入 清空本进程的一级缓存
+        cache._local.clear()
+        first = await cache.get("maps_weather", {"city": "北京"})
+        second = await cache.get("maps_weather", {"city": "北京"})
+        return first, second
+
+    assert asyncio.run(run()) == ((True, "晴"), (True, "晴"))
+    assert cache.stats["redis_hits"] == 1
+    assert cache.stats["local_hits"] == 1
+
+
+def test_corrupt_redis_record_is_a_miss(cache):
+    async def run():
+        key = cache.cache_key("maps_weather", {"city": "北京"})
+        await cache.redis_client.set(key, "{not json")
+        corrupt = await cache.get("maps_weather", {"city": "北京"})
+        await cache.redis_client.set(key, '{"other": 1}')
+        missing_value = await cache.get("maps_weather", {"city": "北京"})
+        return corrupt, missing_value
+
+    assert asyncio.run(run()) == ((False, None), (False, None))
+    assert cache.stats["errors"] == 2
+    assert cache.stats["redis_hits"] == 0
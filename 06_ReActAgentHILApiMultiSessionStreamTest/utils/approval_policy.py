@@ -0,0 +1,208 @@
+import re
+import time
+import fnmatch
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional, Tuple
+import redis.asyncio as redis
+from .config import Config
+from .redis_conn import is_cluster
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 审批结果
+AUTO_ACCEPT = "auto_accept"
+REVIEW = "review"
+REJECT = "reject"
+
+# 参数条件支持的运算符
+_OPERATORS = {
+    "eq": lambda value, expected: value == expected,
+    "ne": lambda value, expected: value != expected,
+    "in": lambda value, expected: value in expected,
+    "not_in": lambda value, expected: value not in expected,
+    "lt": lambda value, expected: value is not None and float(value) < expected,
+    "lte": lambda value, expected: value is not None and float(value) <= expected,
+    "gt": lambda value, expected: value is not None and float(value) > expected,
+    "gte": lambda value, expected: value is not None and float(value) >= expected,
+    "regex": lambda value, expected: value is not None and re.search(expected, str(value)) is not None,
+}
+
+
+# 解析"次数/秒数"格式的频率上限
+def _parse_rate_limit(rate_limit: Optional[str]) -> Optional[Tuple[int, int]]:
+    if not rate_limit:
+        return None
+    count, seconds = rate_limit.split("/")
+    return int(count), int(seconds)
+
+
+# 工具调用审批策略引擎
+class ApprovalPolicyEngine:
+    # 初始化策略引擎 redis_client用于多进程共享频率计数，为None时使用进程内计数
+    def __init__(self, policies: List[Dict[str, Any]], redis_client: Optional[redis.Redis] = None):
+        self.policies = policies
+        self.redis_client = redis_client
+        self._local_counters: Dict[str, int] = {}
+        self._pinned_reviews: Dict[str, float] = {}
+        # 指标数据
+        self.stats = {AUTO_ACCEPT: 0, REVIEW: 0, REJECT: 0, "rate_limited": 0}
+        for policy in policies:
+            if policy.get("action") not in (AUTO_ACCEPT, REVIEW, REJECT):
+                raise ValueError(f"不支持的审批动作: {policy.get('action')}")
+            for operators in policy.get("when", {}).values():
+                for operator in operators:
+                    if operator not in _OPERATORS:
+                        raise ValueError(f"不支持的参数条件运算符: {operator}")
+
+    # 判断规则是否匹配当前工具调用
+    @staticmethod
+    def _matches(policy: Dict[str, Any], tool_name: str, user_id: Optional[str], args: Dict[str, Any]) -> bool:
+        if not any(fnmatch.fnmatchcase(tool_name, pattern) for pattern in policy.get("tools", ["*"])):
+            return False
+        if not any(fnmatch.fnmatchcase(user_id or "", pattern) for pattern in policy.get("users", ["*"])):
+            return False
+        try:
+            for arg_name, operators in policy.get("when", {}).items():
+                for operator, expected in operators.items():
+                    if not _OPERATORS[operator](args.get(arg_name), expected):
+                        return False
+        except (TypeError, ValueError):
+            # 参数类型与条件不符时视为不匹配
+            return False
+        return True
+
+    # 增加频率计数 返回当前时间窗口内的次数
+    async def _incr_rate(self, tool_name: str, user_id: Optional[str], window: int) -> int:
+        bucket = int(time.time() // window)
+        key = f"approval_rate:{user_id}:{tool_name}:{bucket}"
+        if self.redis_client is not None:
+            try:
+                # 集群客户端不支持事务流水线，计数与过期时间分两条命令写入
+                pipe = self.redis_client.pipeline(transaction=not is_cluster(self.redis_client))
+                pipe.incr(key)
+                pipe.expire(key, window)
+                count, _ = await pipe.execute()
+                return count
+            except Exception as e:
+                logger.warning(f"读取审批频率计数失败，使用进程内计数: {e}")
+        # 清理过期时间窗口的进程内计数
+        for stale in [k for k in self._local_counters if not k.endswith(f":{bucket}")]:
+            self._local_counters.pop(stale, None)
+        self._local_counters[key] = self._local_counters.get(key, 0) + 1
+        return self._local_counters[key]
+
+    # 记录需要人工审查的工具调用
+    async def _pin_review(self, call_key: str) -> None:
+        key = f"approval_review:{call_key}"
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.set(key, 1, ex=Config.TTL)
+                return
+            except Exception as e:
+                logger.warning(f"记录人工审查的工具调用失败，使用进程内记录: {e}")
+        now = time.time()
+        for stale in [k for k, expires_at in self._pinned_reviews.items() if expires_at < now]:
+            self._pinned_reviews.pop(stale, None)
+        self._pinned_reviews[key] = now + Config.TTL
+
+    # 判断工具调用是否已被记录为需要人工审查
+    async def _is_pinned_review(self, call_key: str) -> bool:
+        key = f"approval_review:{call_key}"
+        if self.redis_client is not None:
+            try:
+                if await self.redis_client.exists(key):
+                    return True
+            except Exception as e:
+                logger.warning(f"读取人工审查的工具调用记录失败: {e}")
+        return self._pinned_reviews.get(key, 0) > time.time()
+
+    # 决定工具调用的审批方式
+    async def decide(self, tool_name: str, user_id: Optional[str], args: Dict[str, Any], call_key: Optional[str] = None) -> str:
+        """
+        按顺序匹配审批规则，决定工具调用是否需要人工审查
+
+        Args:
+            tool_name: 工具名称
+            user_id: 用户ID
+            args: 工具调用参数
+            call_key: 工具调用的唯一键，中断恢复后工具函数重新执行时保持不变
+
+        Returns:
+            str: auto_accept、review或reject
+        """
+        # 因超出频率上限转为人工审查的调用，中断恢复时不能因进入新的时间窗口而被自动放行
+        if call_key is not None and await self._is_pinned_review(call_key):
+            return REVIEW
+        decision = REVIEW
+        for policy in self.policies:
+            if not self._matches(policy, tool_name, user_id, args):
+                continue
+            decision = policy["action"]
+            rate = _parse_rate_limit(policy.get("rate_limit"))
+            # 超出自动允许的频率上限时回退为人工审查
+            if decision == AUTO_ACCEPT and rate is not None:
+                limit, window = rate
+                if await self._incr_rate(tool_name, user_id, window) > limit:
+                    self.stats["rate_limited"] += 1
+                    decision = REVIEW
+                    if call_key is not None:
+                        await self._pin_review(call_key)
+            break
+        self.stats[decision] += 1
+        logger.info(f"工具 {tool_name} 用户 {user_id} 的审批结果: {decision}")
+        return decision
+
+    # 策略引擎指标
+    def metrics(self) -> Dict[str, Any]:
+        return {"policies": self.policies, "decisions": dict(self.stats)}
+
+
+# 进程内共享的审批策略引擎
+_policy_engine: Optional[ApprovalPolicyEngine] = None
+
+
+# 初始化审批策略引擎 在服务启动时传入Redis客户端
+def init_approval_policy(redis_client: Optional[redis.Redis] = None) -> ApprovalPolicyEngine:
+    global _policy_engine
+    _policy_engine = ApprovalPolicyEngine(Config.APPROVAL_POLICIES, redis_client)
+    logger.info(f"工具审批策略初始化成功，共 {len(Config.APPROVAL_POLICIES)} 条规则")
+    return _policy_engine
+
+
+# 获取审批策略引擎指标
+def get_approval_metrics() -> Dict[str, Any]:
+    return _policy_engine.metrics() if _policy_engine is not None else {}
+
+
+# 决定工具调用的审批方式 未初始化策略引擎时全部需要人工审查
+async def decide_tool_approval(tool_name: str, user_id: Optional[str], args: Dict[str, Any], call_key: Optional[str] = None) -> str:
+    if _policy_engine is None:
+        return REVIEW
+    return await _policy_engine.decide(tool_name, user_id, args, call_key)
@@ -19,13 +19,161 @@ class Config:
     MIN_SIZE = 5
     MAX_SIZE = 10
 
+    # 后端进程数 由 python 01_backendServer.py --workers N 写入环境变量，各工作进程启动时读取
+    WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+    # 全部后端进程合计的PostgreSQL连接数上限 每个进程的连接池按进程数均分，且不超过MAX_SIZE
+    DB_CONNECTION_BUDGET = int(os.getenv("DB_CONNECTION_BUDGET", "40"))
+    # 全部后端进程合计的Redis连接数上限 按进程数和每个进程的客户端数均分，且不超过REDIS_MAX_CONNECTIONS
+    REDIS_CONNECTION_BUDGET = int(os.getenv("REDIS_CONNECTION_BUDGET", "512"))
+
     # Redis数据库配置参数
     REDIS_HOST = "localhost"
     REDIS_PORT = 6379
     REDIS_DB = 0
+    # Redis部署方式 standalone:单节点，sentinel:哨兵主从，cluster:集群
+    REDIS_MODE = os.getenv("REDIS_MODE", "standalone")
+    REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+    # 哨兵地址、主节点名称和哨兵密码 sentinel模式使用
+    REDIS_SENTINELS = [("localhost", 26379), ("localhost", 26380), ("localhost", 26381)]
+    REDIS_SENTINEL_MASTER = "mymaster"
+    REDIS_SENTINEL_PASSWORD = os.getenv("REDIS_SENTINEL_PASSWORD")
+    # 集群启动节点 cluster模式使用，其余节点自动发现
+    REDIS_CLUSTER_NODES = [("localhost", 7000), ("localhost", 7001), ("localhost", 7002)]
+    # 连接池大小（cluster模式为每个节点的上限）、超时时间（秒）和空闲连接的健康检查间隔（秒）
+    REDIS_MAX_CONNECTIONS = 64
+    REDIS_SOCKET_TIMEOUT = 5
+    REDIS_SOCKET_CONNECT_TIMEOUT = 5
+    REDIS_HEALTH_CHECK_INTERVAL = 30
+    # 连接断开或超时时的重试次数 覆盖主从切换期间的短暂不可用
+    REDIS_RETRY_ATTEMPTS = 3
     SESSION_TIMEOUT = 300
     TTL = 3600
 
+    # 共享HTTP连接池配置参数 供Chat模型、Embedding模型和MCP客户端共用
+    HTTP_MAX_CONNECTIONS = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+    # 空闲keep-alive连接的保留时间（秒）
+    HTTP_KEEPALIVE_EXPIRY = 120
+    # 是否启用HTTP/2（需安装h2，未安装时自动回退到HTTP/1.1）
+    HTTP2 = True
+    HTTP_CONNECT_TIMEOUT = 10
+    HTTP_TIMEOUT = 60
+    # 周期性预热连接的间隔（秒），需小于HTTP_KEEPALIVE_EXPIRY，设置为0则只在启动时预热
+    HTTP_WARMUP_INTERVAL = 60
+
+    # MCP工具描述缓存配置参数
+    MCP_TOOLS_CACHE_FILE = "cache/mcp_tools.json"
+    # 后台刷新工具描述缓存的间隔（秒）
+    MCP_TOOLS_REFRESH_INTERVAL = 3600
+    # 无缓存时首次同步发现工具的超时时间（秒）
+    MCP_TOOLS_DISCOVERY_TIMEOUT = 10
+    # 无缓存且首次发现失败时，后台重试发现的间隔（秒）
+    MCP_TOOLS_DISCOVERY_RETRY_INTERVAL = 30
+
+    # MCP会话池配置参数
+    # 每个MCP Server保持的常驻会话数，同时也是该Server同时进行的工具调用上限，超出的调用排队等待空闲会话
+    MCP_POOL_SIZE = 4
+    # 启动后是否在后台预先建立常驻会话
+    MCP_POOL_WARMUP = True
+    # 空闲会话健康检查间隔和ping超时（秒）
+    MCP_POOL_HEALTH_CHECK_INTERVAL = 30
+    MCP_POOL_PING_TIMEOUT = 5
+    # 建立会话失败时的重连次数和指数退避参数（秒）
+    MCP_POOL_CONNECT_ATTEMPTS = 4
+    MCP_POOL_BACKOFF_BASE = 0.5
+    MCP_POOL_BACKOFF_MAX = 10
+
+    # 工具结果缓存配置参数 缓存存储在Redis中，多个用户和多个服务进程共享
+    TOOL_CACHE_ENABLED = True
+    # 各工具的缓存策略，ttl为缓存时间（秒），ignore_args为不影响结果的参数，未列出的工具不缓存
+    TOOL_CACHE_POLICIES = {
+        "maps_weather": {"ttl": 600},
+        "maps_geo": {"ttl": 86400},
+        "maps_regeocode": {"ttl": 86400},
+        "maps_ip_location": {"ttl": 3600},
+        "maps_direction_driving": {"ttl": 300},
+        "maps_direction_walking": {"ttl": 600},
+        "maps_bicycling": {"ttl": 600},
+        "maps_direction_transit_integrated": {"ttl": 300},
+        "maps_distance": {"ttl": 600},
+        "maps_text_search": {"ttl": 1800},
+        "maps_around_search": {"ttl": 1800},
+        "maps_search_detail": {"ttl": 3600},
+    }
+    # 进程内一级缓存的容量和最长缓存时间（秒）
+    TOOL_CACHE_LOCAL_MAX_ITEMS = 1024
+    TOOL_CACHE_LOCAL_TTL = 60
+    # 坐标类工具的空间缓存策略，coord_arg为"经度,纬度"格式的坐标参数，precision为geohash精度，
+    # radius为命中的容差半径（米，需小于对应精度的geohash格子边长），优先于TOOL_CACHE_POLICIES生效
+    TOOL_SPATIAL_CACHE_POLICIES = {
+        "maps_regeocode": {"coord_arg": "location", "precision": 7, "radius": 100, "ttl": 86400},
+        "maps_around_search": {"coord_arg": "location", "precision": 6, "radius": 200, "ttl": 1800},
+    }
+    # 每个geohash格子保留的空间缓存记录上限 写入后超出时先清理过期记录，再按过期时间从早到晚淘汰
+    TOOL_SPATIAL_CACHE_MAX_ENTRIES = 256
+
+    # 工具调用审批策略 按顺序匹配，第一条匹配的规则生效，未匹配任何规则的工具调用需要人工审查
+    # tools、users支持*通配符；action为auto_accept(自动允许)、review(人工审查)、reject(自动拒绝)；
+    # when为参数条件，支持eq、ne、in、not_in、lt、lte、gt、gte、regex；
+    # rate_limit为"次数/秒数"格式的每用户每工具自动允许上限，超出后回退为人工审查
+    APPROVAL_POLICIES = [
+        {"tools": ["book_hotel", "generate_image"], "action": "review"},
+        {"tools": ["multiply"], "action": "auto_accept"},
+        {"tools": ["maps_*"], "action": "auto_accept", "rate_limit": "30/60"},
+    ]
+
+    # 等待人工审查期间预先执行的无副作用工具（支持*通配符），审查通过时直接使用预执行结果，修改参数或拒绝时丢弃
+    SPECULATIVE_TOOLS = ["maps_weather", "maps_geo", "maps_regeocode", "maps_ip_location", "maps_direction_*",
+                         "maps_bicycling", "maps_distance", "maps_text_search", "maps_around_search",
+                         "maps_search_detail", "multiply"]
+    # 预执行结果的保留时间（秒），超时未被审查的结果会被清理
+    SPECULATIVE_RESULT_TTL = 600
+
+    # 发送给大模型的历史消息上限，超出后按块从头部裁剪，裁剪起点只在跨过块边界时移动，保持提示词前缀稳定以命中模型服务端的提示词缓存
+    PROMPT_MAX_MESSAGES = 20
+    PROMPT_TRIM_BLOCK = 10
+
+    # 流式输出合并文本块的时间窗口（秒）和字节上限，任一达到即输出，时间窗口为0时不合并
+    SSE_COALESCE_INTERVAL = 0.03
+    SSE_COALESCE_MAX_BYTES = 512
+    # 流式调用期间检测客户端断开连接的间隔（秒），断开后智能体在下一个安全点停止，会话标记为cancelled
+    STREAM_DISCONNECT_CHECK_INTERVAL = 1
+    # 取消请求频道的订阅断开后的重连间隔（秒）
+    RUN_CANCEL_RETRY_INTERVAL = 3
+    # 请求头Idempotency-Key相同的/agent/invoke、/agent/resume请求只运行一次智能体
+    IDEMPOTENCY_ENABLED = True
+    # 完成后保存响应的时间（秒），期间重复请求直接返回保存的响应
+    IDEMPOTENCY_TTL = 86400
+    # 进行中记录的过期时间（秒），运行所在进程退出后记录在该时间后失效
+    IDEMPOTENCY_IN_PROGRESS_TTL = 1800
+    # 重复请求等待已有运行完成的最长时间（秒），超时返回409
+    IDEMPOTENCY_WAIT_TIMEOUT = 300
+    # 已有运行在其他进程时轮询记录的间隔（秒）
+    IDEMPOTENCY_POLL_INTERVAL = 0.5
+    # 进行中的运行刷新心跳键的间隔（秒）
+    RUN_HEARTBEAT_INTERVAL = 5
+    # 心跳键的过期时间（秒），running状态的会话超过该时间没有心跳时视为stale（运行所在进程已退出）
+    RUN_HEARTBEAT_TTL = 15
+
+    # 智能体返回结果的内容 turn:只返回并保存本轮新增的消息和最终回答，full:返回完整的会话状态
+    RESULT_PROJECTION = "turn"
+
+    # Redis会话记录的序列化方式 json、orjson或msgpack，依赖未安装时回退为json
+    SESSION_CODEC = "msgpack"
+    # last_response的压缩方式 zstd或None，超过阈值（字节）时才压缩
+    SESSION_COMPRESSION = "zstd"
+    SESSION_COMPRESS_THRESHOLD = 1024
+    SESSION_ZSTD_LEVEL = 3
+
+    # 会话记录的进程内近端缓存 通过Redis客户端缓存失效通知（CLIENT TRACKING BCAST）在多个后端进程间保持一致
+    SESSION_NEAR_CACHE_ENABLED = True
+    SESSION_NEAR_CACHE_MAX_ITEMS = 4096
+    # 缓存记录的最长保留时间（秒），作为失效通知之外的兜底
+    SESSION_NEAR_CACHE_TTL = 30
+    # 失效通知连接的保活检查间隔和断开后的重连间隔（秒）
+    SESSION_NEAR_CACHE_HEALTH_INTERVAL = 5
+    SESSION_NEAR_CACHE_RETRY_INTERVAL = 3
+
     # openai:调用gpt模型,qwen:调用阿里通义千问大模型,oneapi:调用oneapi方案支持的模型,ollama:调用本地开源大模型
     LLM_TYPE = "openai"
 
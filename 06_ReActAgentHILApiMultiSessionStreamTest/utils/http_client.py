@@ -0,0 +1,248 @@
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Dict, Any, List, Optional
+import httpx
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 进程内共享的HTTP客户端单实例
+_async_client: Optional[httpx.AsyncClient] = None
+_sync_client: Optional[httpx.Client] = None
+
+# 请求计数器 用于连接池指标统计
+_request_stats: Dict[str, Any] = {
+    "requests": 0,
+    "responses": 0,
+    "http_versions": {},
+    "mcp_clients_created": 0,
+    "last_warmup": None,
+}
+
+
+# httpx的HTTP/2支持依赖h2包 导入时检查一次，未安装时只警告一次并回退到HTTP/1.1
+_h2_installed = importlib.util.find_spec("h2") is not None
+if Config.HTTP2 and not _h2_installed:
+    logger.warning("未安装h2，HTTP/2已禁用，回退到HTTP/1.1")
+
+
+# 判断是否可以启用HTTP/2 创建客户端和获取指标时调用
+def _http2_enabled() -> bool:
+    return Config.HTTP2 and _h2_installed
+
+
+# 构造统一的连接池限制参数
+def _build_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=Config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=Config.HTTP_KEEPALIVE_EXPIRY
+    )
+
+
+# 构造统一的超时参数
+def _build_timeout() -> httpx.Timeout:
+    return httpx.Timeout(Config.HTTP_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT)
+
+
+# 记录请求和响应数量的事件钩子
+def _record_request(request: httpx.Request) -> None:
+    _request_stats["requests"] += 1
+
+
+def _record_response(response: httpx.Response) -> None:
+    _request_stats["responses"] += 1
+    versions = _request_stats["http_versions"]
+    versions[response.http_version] = versions.get(response.http_version, 0) + 1
+
+
+async def _arecord_request(request: httpx.Request) -> None:
+    _record_request(request)
+
+
+async def _arecord_response(response: httpx.Response) -> None:
+    _record_response(response)
+
+
+# 获取共享的异步HTTP客户端 供ChatOpenAI和OpenAIEmbeddings的异步调用使用
+def get_http_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            http2=_http2_enabled(),
+            limits=_build_limits(),
+            timeout=_build_timeout(),
+            event_hooks={"request": [_arecord_request], "response": [_arecord_response]}
+        )
+        logger.info("共享异步HTTP客户端初始化成功")
+    return _async_client
+
+
+# 获取共享的同步HTTP客户端 供ChatOpenAI和OpenAIEmbeddings的同步调用使用
+def get_http_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(
+            http2=_http2_enabled(),
+            limits=_build_limits(),
+            timeout=_build_timeout(),
+            event_hooks={"request": [_record_request], "response": [_record_response]}
+        )
+        logger.info("共享同步HTTP客户端初始化成功")
+    return _sync_client
+
+
+# MCP客户端使用的httpx客户端工厂
+def mcp_httpx_client_factory(
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[httpx.Timeout] = None,
+        auth: Optional[httpx.Auth] = None,
+) -> httpx.AsyncClient:
+    """
+    MCP客户端的httpx客户端工厂，签名与mcp的create_mcp_http_client保持一致
+
+    MCP的SSE连接会在会话结束时关闭传入的客户端，无法直接复用共享客户端实例，
+    这里为其创建使用相同连接池限制、keep-alive和HTTP/2配置的客户端
+
+    Args:
+        headers: 请求头
+        timeout: 超时配置，未提供时使用SSE长连接的默认超时
+        auth: 认证配置
+
+    Returns:
+        httpx.AsyncClient: 配置好的异步HTTP客户端
+    """
+    _request_stats["mcp_clients_created"] += 1
+    return httpx.AsyncClient(
+        headers=headers,
+        # SSE连接需要较长的读超时
+        timeout=timeout or httpx.Timeout(Config.HTTP_TIMEOUT, read=300.0),
+        auth=auth,
+        follow_redirects=True,
+        http2=_http2_enabled(),
+        limits=_build_limits(),
+        event_hooks={"request": [_arecord_request], "response": [_arecord_response]}
+    )
+
+
+# 预热连接 提前完成DNS解析、TCP和TLS握手
+async def warmup_http_connections(urls: List[str]) -> Dict[str, Optional[float]]:
+    """
+    预热共享HTTP客户端到指定服务地址的连接
+
+    Args:
+        urls: 需要预热的服务地址列表
+
+    Returns:
+        Dict[str, Optional[float]]: 每个地址的预热耗时（秒），预热失败时为None
+    """
+    client = get_http_async_client()
+
+    async def _warmup(url: str) -> Optional[float]:
+        start = time.perf_counter()
+        try:
+            # 只关心连接建立，任何HTTP响应（包括401/404）都说明连接已可复用
+            await client.head(url)
+            return time.perf_counter() - start
+        except Exception as e:
+            logger.warning(f"预热连接 {url} 失败: {e}")
+            return None
+
+    timings = await asyncio.gather(*[_warmup(url) for url in urls])
+    result = dict(zip(urls, timings))
+    _request_stats["last_warmup"] = time.time()
+    logger.info(f"HTTP连接预热完成: {result}")
+    return result
+
+
+# 周期性预热连接 避免空闲后keep-alive连接过期导致重新握手
+async def keep_http_connections_warm(urls: List[str], interval: Optional[int] = None) -> None:
+    interval = Config.HTTP_WARMUP_INTERVAL if interval is None else interval
+    if not interval or interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        await warmup_http_connections(urls)
+
+
+# 获取连接池指标
+def get_http_pool_metrics() -> Dict[str, Any]:
+    """
+    获取共享HTTP客户端连接池的指标数据
+
+    Returns:
+        Dict[str, Any]: 连接数、空闲连接数、请求计数等指标
+    """
+    metrics: Dict[str, Any] = {
+        "http2_enabled": _http2_enabled(),
+        "limits": {
+            "max_connections": Config.HTTP_MAX_CONNECTIONS,
+            "max_keepalive_connections": Config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": Config.HTTP_KEEPALIVE_EXPIRY,
+        },
+        "requests": _request_stats["requests"],
+        "responses": _request_stats["responses"],
+        "http_versions": dict(_request_stats["http_versions"]),
+        "mcp_clients_created": _request_stats["mcp_clients_created"],
+        "last_warmup": _request_stats["last_warmup"],
+    }
+    for name, client in (("async_pool", _async_client), ("sync_pool", _sync_client)):
+        metrics[name] = _pool_snapshot(client)
+    return metrics
+
+
+# 读取httpcore连接池中的连接状态
+def _pool_snapshot(client: Optional[httpx.AsyncClient | httpx.Client]) -> Optional[Dict[str, int]]:
+    if client is None or client.is_closed:
+        return None
+    # httpx未公开连接池对象，这里按属性访问，取不到时只返回空统计
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "queued_requests": len(getattr(pool, "_requests", []) or []),
+    }
+
+
+# 关闭共享HTTP客户端
+async def close_http_clients() -> None:
+    global _async_client, _sync_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+    logger.info("共享HTTP客户端已关闭")
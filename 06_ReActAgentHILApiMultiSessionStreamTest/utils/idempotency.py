@@ -0,0 +1,191 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+import redis.asyncio as redis
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+class IdempotencyKeyReused(Exception):
+    """同一个Idempotency-Key被用于内容不同的请求"""
+    pass
+
+
+class IdempotencyInProgress(Exception):
+    """相同Idempotency-Key的运行在等待时间内没有完成"""
+    pass
+
+
+# 幂等记录键 用户ID作为hash tag，与该用户的会话键落在同一个槽位
+def idempotency_record_key(user_id: str, scope: str, key: str) -> str:
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return f"idempotency:{{{user_id}}}:{scope}:{digest}"
+
+
+# 请求指纹 同一个Idempotency-Key只能用于内容相同的请求
+def request_fingerprint(body: str) -> str:
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+# 基于Redis的幂等请求记录
+class IdempotencyStore:
+    """
+    基于Redis的幂等请求记录
+
+    第一个请求用SET NX写入in_progress记录后运行智能体，完成后改写为completed记录并保存响应；
+    重复请求读取到in_progress记录时等待该运行完成（同一进程内直接等待，其他进程的运行按间隔轮询），
+    读取到completed记录时直接返回保存的响应。运行抛出异常时删除记录，客户端可以用相同的键重试
+    """
+    def __init__(self, redis_client: redis.Redis):
+        self.redis_client = redis_client
+        # 本进程中进行中的运行 重复请求直接等待，不轮询Redis
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # 指标数据
+        self.stats = {"started": 0, "replayed": 0, "attached": 0, "conflicts": 0, "released": 0, "errors": 0}
+
+    # 按幂等键运行 返回(响应, 是否为重复请求)
+    async def run(self, user_id: str, scope: str, key: str, fingerprint: str,
+                  handler: Callable[[], Awaitable[Dict[str, Any]]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        按幂等键运行handler，重复请求等待已有运行或返回保存的响应
+
+        Args:
+            user_id: 用户ID
+            scope: 接口标识，如invoke、resume
+            key: 客户端提供的Idempotency-Key
+            fingerprint: 请求指纹
+            handler: 实际运行智能体的函数，返回可JSON序列化的响应
+
+        Returns:
+            Tuple[Dict[str, Any], bool]: 响应数据，以及是否来自已有的运行
+        """
+        record_key = idempotency_record_key(user_id, scope, key)
+        deadline = time.monotonic() + Config.IDEMPOTENCY_WAIT_TIMEOUT
+        attached = False
+        while True:
+            try:
+                pending = json.dumps({"state": "in_progress", "fingerprint": fingerprint, "started_at": time.time()})
+                acquired = await self.redis_client.set(record_key, pending, nx=True, ex=Config.IDEMPOTENCY_IN_PROGRESS_TTL)
+                raw = None if acquired else await self.redis_client.get(record_key)
+            except redis.RedisError as e:
+                # Redis不可用时不做幂等处理 与未携带Idempotency-Key的请求相同
+                self.stats["errors"] += 1
+                logger.warning(f"读取幂等记录失败，直接运行: {e}")
+                return await handler(), False
+            if acquired:
+                return await self._execute(record_key, fingerprint, handler), False
+            # 记录刚被删除或过期 重新争抢
+            if raw is None:
+                continue
+            record = json.loads(raw)
+            if record.get("fingerprint") != fingerprint:
+                self.stats["conflicts"] += 1
+                raise IdempotencyKeyReused(f"Idempotency-Key {key} 已用于内容不同的请求")
+            if record.get("state") == "completed":
+                self.stats["replayed"] += 1
+                logger.info(f"幂等键 {record_key} 已有结果，直接返回保存的响应")
+                return record["response"], True
+            if not attached:
+                attached = True
+                self.stats["attached"] += 1
+                logger.info(f"幂等键 {record_key} 的运行仍在进行，等待其完成")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise IdempotencyInProgress(f"Idempotency-Key {key} 的运行仍在进行中")
+            # 同一进程内的运行直接等待其完成 其他进程的运行按间隔轮询
+            future = self._inflight.get(record_key)
+            if future is not None:
+                try:
+                    await asyncio.wait_for(asyncio.shield(future), remaining)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(min(Config.IDEMPOTENCY_POLL_INTERVAL, remaining))
+
+    # 运行并保存响应 运行抛出异常时删除记录
+    async def _execute(self, record_key: str, fingerprint: str,
+                       handler: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[record_key] = future
+        self.stats["started"] += 1
+        try:
+            response = await handler()
+            record = {"state": "completed", "fingerprint": fingerprint, "response": response, "completed_at": time.time()}
+            try:
+                await self.redis_client.set(record_key, json.dumps(record, ensure_ascii=False), ex=Config.IDEMPOTENCY_TTL)
+            except redis.RedisError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"保存幂等记录 {record_key} 失败: {e}")
+            return response
+        except BaseException:
+            # 运行没有产生响应 删除记录，等待中的重复请求和客户端重试可以重新运行
+            self.stats["released"] += 1
+            try:
+                await self.redis_client.delete(record_key)
+            except redis.RedisError as e:
+                self.stats["errors"] += 1
+                logger.warning(f"删除幂等记录 {record_key} 失败: {e}")
+            raise
+        finally:
+            # 唤醒本进程中等待的重复请求 由其重新读取Redis中的记录
+            self._inflight.pop(record_key, None)
+            if not future.done():
+                future.set_result(None)
+
+    # 幂等指标
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "inflight": len(self._inflight)}
+
+
+# 进程内共享的幂等请求记录
+_idempotency_store: Optional[IdempotencyStore] = None
+
+
+# 初始化幂等请求记录 在服务启动时传入Redis客户端，未启用时返回None
+def init_idempotency_store(redis_client: redis.Redis) -> Optional[IdempotencyStore]:
+    global _idempotency_store
+    if Config.IDEMPOTENCY_ENABLED:
+        _idempotency_store = IdempotencyStore(redis_client)
+    return _idempotency_store
+
+
+# 获取幂等请求记录 未启用时返回None
+def get_idempotency_store() -> Optional[IdempotencyStore]:
+    return _idempotency_store
+
+
+# 获取幂等指标
+def get_idempotency_metrics() -> Dict[str, Any]:
+    if _idempotency_store is None:
+        return {"enabled": False}
+    return _idempotency_store.metrics()
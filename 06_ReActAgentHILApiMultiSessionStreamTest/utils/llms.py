@@ -3,6 +3,8 @@ import logging
 from concurrent_log_handler import ConcurrentRotatingFileHandler
 from langchain_openai import ChatOpenAI,OpenAIEmbeddings
 from .config import Config
+from .http_client import get_http_client, get_http_async_client
+from .prompt_cache import get_prompt_cache_stats
 
 
 
@@ -102,15 +104,21 @@ def initialize_llm(llm_type: str = DEFAULT_LLM_TYPE) -> tuple[ChatOpenAI, OpenAI
             model=config["chat_model"],
             temperature=DEFAULT_TEMPERATURE,
             streaming=True,  # 启用流式输出
+            stream_usage=True,  # 流式输出时也返回token用量，用于统计提示词缓存命中
             timeout=30,  # 添加超时配置（秒）
-            max_retries=2  # 添加重试次数
+            max_retries=2,  # 添加重试次数
+            http_client=get_http_client(),  # 使用共享的连接池
+            http_async_client=get_http_async_client(),
+            callbacks=[get_prompt_cache_stats()]  # 统计提示词缓存命中情况
         )
 
         llm_embedding = OpenAIEmbeddings(
             base_url=config["base_url"],
             api_key=config["api_key"],
             model=config["embedding_model"],
-            deployment=config["embedding_model"]
+            deployment=config["embedding_model"],
+            http_client=get_http_client(),
+            http_async_client=get_http_async_client()
         )
 
         logger.info(f"成功初始化 {llm_type} LLM")
@@ -143,6 +151,20 @@ def get_llm(llm_type: str = DEFAULT_LLM_TYPE) -> ChatOpenAI:
         raise  # 如果默认配置也失败，则抛出异常
 
 
+# 获取需要预热连接的模型服务地址
+def get_llm_base_urls(llm_type: str = DEFAULT_LLM_TYPE) -> list[str]:
+    """
+    获取指定LLM类型对应的模型服务地址，用于启动时预热HTTP连接
+
+    Args:
+        llm_type (str): LLM类型
+
+    Returns:
+        list[str]: 模型服务地址列表
+    """
+    config = MODEL_CONFIGS.get(llm_type) or MODEL_CONFIGS[DEFAULT_LLM_TYPE]
+    return [config["base_url"]]
+
 
 # 示例使用
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from langchain_core.tools import BaseTool, StructuredTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from .config import Config
+from .mcp_pool import get_mcp_pool_manager
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 缓存文件格式版本 格式变化时递增，旧版本缓存将被忽略
+CACHE_FORMAT_VERSION = 1
+
+# 后台刷新任务 保存引用避免被垃圾回收
+_refresh_tasks: set = set()
+
+
+# MCP工具描述的磁盘缓存
+class MCPToolSchemaCache:
+    # 初始化缓存 指定缓存文件路径和MCP Server连接配置
+    def __init__(self, cache_file: str, servers: Dict[str, Dict[str, Any]]):
+        self.cache_file = cache_file
+        self.servers = servers
+
+    # 计算MCP Server连接配置的指纹 配置变化时缓存自动失效
+    def fingerprint(self) -> str:
+        # 只取可序列化的配置项，忽略httpx_client_factory等可调用对象
+        serializable = {
+            name: {k: v for k, v in conn.items() if isinstance(v, (str, int, float, bool))}
+            for name, conn in self.servers.items()
+        }
+        raw = json.dumps(serializable, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # 从磁盘读取缓存的工具描述
+    def load(self) -> Optional[List[Dict[str, Any]]]:
+        if not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取MCP工具缓存失败: {e}")
+            return None
+        # 校验缓存版本和连接配置指纹
+        if data.get("version") != CACHE_FORMAT_VERSION:
+            logger.info(f"MCP工具缓存版本不匹配，忽略缓存: {data.get('version')}")
+            return None
+        if data.get("fingerprint") != self.fingerprint():
+            logger.info("MCP Server配置已变化，忽略缓存")
+            return None
+        logger.info(f"从缓存加载MCP工具描述 {len(data.get('tools', []))} 个，缓存时间: {data.get('updated_at')}")
+        return data.get("tools", [])
+
+    # 将工具描述写入磁盘 先写临时文件再替换，避免多进程读到半个文件
+    def save(self, schemas: List[Dict[str, Any]]) -> None:
+        cache_dir = os.path.dirname(self.cache_file)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        data = {
+            "version": CACHE_FORMAT_VERSION,
+            "fingerprint": self.fingerprint(),
+            "updated_at": time.time(),
+            "tools": schemas
+        }
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.cache_file)
+        logger.info(f"MCP工具描述缓存已更新，共 {len(schemas)} 个工具")
+
+    # 连接MCP Server获取最新的工具描述
+    async def fetch(self) -> List[Dict[str, Any]]:
+        client = MultiServerMCPClient(self.servers)
+        schemas = []
+        for server_name in self.servers:
+            tools = await client.get_tools(server_name=server_name)
+            for index in tools:
+                args_schema = index.args_schema
+                if not isinstance(args_schema, dict):
+                    args_schema = args_schema.model_json_schema()
+                schemas.append({
+                    "server": server_name,
+                    "name": index.name,
+                    "description": index.description,
+                    "args_schema": args_schema
+                })
+        # 按工具名排序，保证缓存内容稳定
+        schemas.sort(key=lambda item: item["name"])
+        return schemas
+
+    # 刷新缓存
+    async def refresh(self) -> List[Dict[str, Any]]:
+        schemas = await self.fetch()
+        self.save(schemas)
+        return schemas
+
+
+# 按需连接MCP Server执行工具调用
+class LazyMCPToolInvoker:
+    # 初始化 此时不建立任何连接
+    def __init__(self, servers: Dict[str, Dict[str, Any]]):
+        self.servers = servers
+
+    # 通过MCP会话池调用指定的工具 会话池在首次使用时创建
+    async def ainvoke(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        return await get_mcp_pool_manager(self.servers).call_tool(server_name, tool_name, arguments)
+
+    # 提前创建会话池并在后台建立常驻会话
+    def warmup(self) -> None:
+        get_mcp_pool_manager(self.servers)
+
+
+# 根据缓存的工具描述构造工具 调用时才连接MCP Server
+def build_lazy_mcp_tool(schema: Dict[str, Any], invoker: LazyMCPToolInvoker) -> BaseTool:
+    server_name = schema["server"]
+    tool_name = schema["name"]
+
+    async def call_mcp_tool(**arguments: Any) -> Any:
+        return await invoker.ainvoke(server_name, tool_name, arguments)
+
+    return StructuredTool(
+        name=tool_name,
+        description=schema.get("description") or "",
+        args_schema=schema["args_schema"],
+        coroutine=call_mcp_tool,
+    )
+
+
+# 周期性后台刷新工具描述缓存
+async def _refresh_periodically(cache: MCPToolSchemaCache, current: List[Dict[str, Any]], interval: int) -> None:
+    while True:
+        try:
+            schemas = await cache.refresh()
+            if schemas != current:
+                logger.warning("MCP Server工具描述已变化，新的工具描述将在服务重启后生效")
+                current = schemas
+        except Exception as e:
+            logger.warning(f"后台刷新MCP工具缓存失败: {e}")
+        if not interval or interval <= 0:
+            return
+        await asyncio.sleep(interval)
+
+
+# 获取MCP工具 优先使用磁盘缓存，并在后台刷新缓存
+async def get_cached_mcp_tools(
+        servers: Dict[str, Dict[str, Any]],
+        on_discovered: Optional[Callable[[List[BaseTool]], Awaitable[None]]] = None
+) -> List[BaseTool]:
+    """
+    获取MCP工具列表，启动时不阻塞在MCP Server的网络往返上
+
+    有缓存时直接根据缓存的工具描述构造工具，并在后台刷新缓存；
+    无缓存时在超时时间内同步发现一次，失败则先不加载MCP工具，后台按重试间隔继续发现，
+    发现成功后通过on_discovered交给调用方重建工具列表。
+    工具调用通过MCP会话池复用常驻会话，会话池在后台建立连接，不阻塞启动。
+
+    Args:
+        servers: MultiServerMCPClient的连接配置
+        on_discovered: 首次发现失败后，后台发现成功时以新的MCP工具列表调用的回调
+
+    Returns:
+        List[BaseTool]: MCP工具列表
+    """
+    cache = MCPToolSchemaCache(Config.MCP_TOOLS_CACHE_FILE, servers)
+    invoker = LazyMCPToolInvoker(servers)
+    schemas = cache.load()
+    if schemas is None:
+        try:
+            schemas = await asyncio.wait_for(cache.refresh(), timeout=Config.MCP_TOOLS_DISCOVERY_TIMEOUT)
+        except Exception as e:
+            logger.error(f"MCP工具发现失败，暂不加载MCP工具，后台每 {Config.MCP_TOOLS_DISCOVERY_RETRY_INTERVAL} 秒重试: {e!r}")
+            _start_refresh_task(_discover_until_success(cache, invoker, on_discovered))
+            return []
+        # 首次启动发现成功时只需按间隔刷新
+        _start_refresh_task(_refresh_after_delay(cache, schemas, False))
+    else:
+        # 有缓存时立即在后台刷新
+        _start_refresh_task(_refresh_after_delay(cache, schemas, True))
+
+    # 有可用的MCP工具时在后台建立常驻会话，不阻塞启动
+    if schemas and Config.MCP_POOL_WARMUP:
+        invoker.warmup()
+    return [build_lazy_mcp_tool(schema, invoker) for schema in schemas]
+
+
+# 启动后台刷新任务 保存引用避免被垃圾回收
+def _start_refresh_task(coro: Awaitable[None]) -> None:
+    task = asyncio.create_task(coro)
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+# 首次发现失败后持续重试 成功后通知调用方重建工具，再转为周期性刷新
+async def _discover_until_success(
+        cache: MCPToolSchemaCache,
+        invoker: LazyMCPToolInvoker,
+        on_discovered: Optional[Callable[[List[BaseTool]], Awaitable[None]]]
+) -> None:
+    while True:
+        await asyncio.sleep(Config.MCP_TOOLS_DISCOVERY_RETRY_INTERVAL)
+        try:
+            schemas = await asyncio.wait_for(cache.refresh(), timeout=Config.MCP_TOOLS_DISCOVERY_TIMEOUT)
+            break
+        except Exception as e:
+            logger.warning(f"后台重试MCP工具发现失败: {e!r}")
+
+    logger.info(f"后台发现MCP工具 {len(schemas)} 个")
+    if schemas and Config.MCP_POOL_WARMUP:
+        invoker.warmup()
+    if on_discovered is not None:
+        try:
+            await on_discovered([build_lazy_mcp_tool(schema, invoker) for schema in schemas])
+        except Exception as e:
+            logger.error(f"加载后台发现的MCP工具失败: {e!r}")
+    await _refresh_after_delay(cache, schemas, False)
+
+
+# 启动后台刷新 immediate为False时先等待一个刷新间隔
+async def _refresh_after_delay(cache: MCPToolSchemaCache, current: List[Dict[str, Any]], immediate: bool) -> None:
+    if not immediate:
+        if Config.MCP_TOOLS_REFRESH_INTERVAL <= 0:
+            return
+        await asyncio.sleep(Config.MCP_TOOLS_REFRESH_INTERVAL)
+    await _refresh_periodically(cache, current, Config.MCP_TOOLS_REFRESH_INTERVAL)
+
+
+# 停止后台刷新任务
+def stop_mcp_tools_refresh() -> None:
+    for task in list(_refresh_tasks):
+        task.cancel()
@@ -0,0 +1,333 @@
+import time
+import asyncio
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional
+from langchain_core.tools import ToolException
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from mcp import ClientSession
+from mcp.shared.exceptions import McpError
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 一个常驻的MCP会话
+class PooledMCPSession:
+    """
+    常驻MCP会话，由独立的后台任务持有
+
+    SSE传输内部使用anyio的cancel scope，必须在同一个任务中进入和退出，
+    因此会话的整个生命周期放在一个后台任务中，调用方只使用已初始化的ClientSession
+    """
+    def __init__(self, client: MultiServerMCPClient, server_name: str):
+        self.client = client
+        self.server_name = server_name
+        self.session: Optional[ClientSession] = None
+        self.created_at = time.time()
+        self._ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._closing = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # 会话是否可用
+    @property
+    def closed(self) -> bool:
+        return self.session is None or self._task is None or self._task.done()
+
+    # 在后台任务中建立会话，等待初始化完成
+    async def start(self) -> "PooledMCPSession":
+        self._task = asyncio.create_task(self._run())
+        await self._ready
+        return self
+
+    async def _run(self) -> None:
+        try:
+            async with self.client.session(self.server_name) as session:
+                self.session = session
+                self._ready.set_result(session)
+                await self._closing.wait()
+        except BaseException as e:
+            if not self._ready.done():
+                self._ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.warning(f"MCP会话 {self.server_name} 异常断开: {e!r}")
+        finally:
+            self.session = None
+
+    # 发送ping检查会话是否健康
+    async def ping(self, timeout: float) -> bool:
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"MCP会话 {self.server_name} 健康检查失败: {e!r}")
+            return False
+
+    # 关闭会话
+    async def close(self) -> None:
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout=5)
+            except BaseException:
+                self._task.cancel()
+
+
+# 单个MCP Server的会话池
+class MCPSessionPool:
+    """
+    单个MCP Server的会话池
+
+    会话槽位数即常驻会话数，也是同时进行的调用上限：调用方先占用槽位再取空闲会话，
+    没有空闲会话时才新建，因此会话总数不超过size；槽位占满时调用方排队等待其他调用归还会话
+    """
+    # 初始化会话池 此时不建立任何连接
+    def __init__(self, client: MultiServerMCPClient, server_name: str, size: int = Config.MCP_POOL_SIZE):
+        self.client = client
+        self.server_name = server_name
+        self.size = size
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(size)
+        # 正在执行和排队等待的调用数
+        self._in_flight = 0
+        self._waiting = 0
+        # 指标数据
+        self.stats = {"calls": 0, "reused": 0, "sessions_opened": 0, "reconnects": 0, "failures": 0}
+
+    # 建立新会话 失败时按指数退避重试
+    async def _connect_with_backoff(self) -> PooledMCPSession:
+        delay = Config.MCP_POOL_BACKOFF_BASE
+        for attempt in range(1, Config.MCP_POOL_CONNECT_ATTEMPTS + 1):
+            try:
+                pooled = await PooledMCPSession(self.client, self.server_name).start()
+                self.stats["sessions_opened"] += 1
+                return pooled
+            except Exception as e:
+                if attempt >= Config.MCP_POOL_CONNECT_ATTEMPTS:
+                    logger.error(f"连接MCP Server {self.server_name} 失败，已重试 {attempt} 次: {e!r}")
+                    raise
+                self.stats["reconnects"] += 1
+                logger.warning(f"连接MCP Server {self.server_name} 失败，{delay:.1f}秒后第{attempt}次重试: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, Config.MCP_POOL_BACKOFF_MAX)
+
+    # 取出一个空闲的健康会话，没有时新建 调用方需已占用槽位
+    async def _checkout(self) -> tuple[PooledMCPSession, bool]:
+        while not self._idle.empty():
+            pooled = self._idle.get_nowait()
+            if not pooled.closed:
+                return pooled, True
+        return await self._connect_with_backoff(), False
+
+    # 归还会话 已损坏的会话直接关闭，下次取用时在空出的槽位上新建
+    async def _checkin(self, pooled: PooledMCPSession, broken: bool) -> None:
+        if broken or pooled.closed or self._idle.qsize() >= self.size:
+            await pooled.close()
+        else:
+            self._idle.put_nowait(pooled)
+
+    # 通过常驻会话调用工具 槽位占满时排队等待
+    async def call_tool(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        self.stats["calls"] += 1
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+        try:
+            result = await self._call_with_retry(tool_name, arguments)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+        return _convert_call_tool_result(result)
+
+    # 在已占用的槽位上调用工具 复用的会话失败时换新会话重试一次
+    async def _call_with_retry(self, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        pooled, reused = await self._checkout()
+        try:
+            result = await pooled.session.call_tool(tool_name, arguments)
+        except McpError:
+            await self._checkin(pooled, False)
+            raise
+        except Exception as e:
+            await self._checkin(pooled, True)
+            # 复用的空闲会话可能已被服务端断开，换一个新会话重试一次
+            if not reused:
+                self.stats["failures"] += 1
+                raise
+            logger.warning(f"MCP会话 {self.server_name} 调用失败，使用新会话重试: {e!r}")
+            pooled = await self._connect_with_backoff()
+            try:
+                result = await pooled.session.call_tool(tool_name, arguments)
+            except BaseException:
+                self.stats["failures"] += 1
+                await self._checkin(pooled, True)
+                raise
+        except BaseException:
+            # 调用被取消时会话状态未知，直接关闭
+            await self._checkin(pooled, True)
+            raise
+        if reused:
+            self.stats["reused"] += 1
+        await self._checkin(pooled, False)
+        return result
+
+    # 预先建立常驻会话 每个会话占用一个槽位建立，不超过会话总数上限
+    async def warmup(self) -> None:
+        while self._idle.qsize() < self.size:
+            async with self._slots:
+                if self._idle.qsize() + self._in_flight >= self.size:
+                    break
+                self._idle.put_nowait(await self._connect_with_backoff())
+        logger.info(f"MCP Server {self.server_name} 常驻会话已就绪: {self._idle.qsize()}")
+
+    # 逐个检查空闲会话 同一时刻只取出一个会话，其余空闲会话仍可被调用方使用
+    async def health_check(self) -> None:
+        for _ in range(self._idle.qsize()):
+            async with self._slots:
+                if self._idle.empty():
+                    return
+                pooled = self._idle.get_nowait()
+                if await pooled.ping(Config.MCP_POOL_PING_TIMEOUT):
+                    self._idle.put_nowait(pooled)
+                    continue
+                await pooled.close()
+                try:
+                    self._idle.put_nowait(await self._connect_with_backoff())
+                except Exception:
+                    # 重连失败时不阻塞健康检查，下一次调用时再建立会话
+                    pass
+
+    # 会话池指标
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "idle": self._idle.qsize(),
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "size": self.size,
+        }
+
+    # 关闭全部空闲会话
+    async def close(self) -> None:
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+
+
+# 将MCP工具调用结果转换为工具返回值
+def _convert_call_tool_result(result: Any) -> Any:
+    texts: List[str] = [content.text for content in result.content if getattr(content, "type", None) == "text"]
+    if result.isError:
+        raise ToolException("\n".join(texts) or "MCP工具调用失败")
+    if len(texts) == 1:
+        return texts[0]
+    return texts
+
+
+# 多个MCP Server的会话池管理器
+class MCPSessionPoolManager:
+    # 初始化 每个MCP Server对应一个会话池
+    def __init__(self, servers: Dict[str, Dict[str, Any]]):
+        self.client = MultiServerMCPClient(servers)
+        self.pools = {name: MCPSessionPool(self.client, name) for name in servers}
+        self._health_task: Optional[asyncio.Task] = None
+        self._warmup_tasks: set = set()
+
+    # 启动后台预热和健康检查 不阻塞调用方
+    def start_background(self) -> None:
+        if Config.MCP_POOL_WARMUP:
+            for pool in self.pools.values():
+                task = asyncio.create_task(self._safe_warmup(pool))
+                self._warmup_tasks.add(task)
+                task.add_done_callback(self._warmup_tasks.discard)
+        if self._health_task is None and Config.MCP_POOL_HEALTH_CHECK_INTERVAL > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    @staticmethod
+    async def _safe_warmup(pool: MCPSessionPool) -> None:
+        try:
+            await pool.warmup()
+        except Exception as e:
+            logger.warning(f"预热MCP Server {pool.server_name} 会话失败，将在首次调用时重试: {e!r}")
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(Config.MCP_POOL_HEALTH_CHECK_INTERVAL)
+            for pool in self.pools.values():
+                await pool.health_check()
+
+    # 调用指定MCP Server的工具
+    async def call_tool(self, server_name: str, tool_name: str, arguments: Dict[str, Any]) -> Any:
+        if server_name not in self.pools:
+            raise ToolException(f"未配置的MCP Server: {server_name}")
+        return await self.pools[server_name].call_tool(tool_name, arguments)
+
+    # 全部会话池的指标
+    def metrics(self) -> Dict[str, Any]:
+        return {name: pool.metrics() for name, pool in self.pools.items()}
+
+    # 关闭全部会话池
+    async def close(self) -> None:
+        for task in list(self._warmup_tasks):
+            task.cancel()
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for pool in self.pools.values():
+            await pool.close()
+
+
+# 进程内共享的会话池管理器
+_pool_manager: Optional[MCPSessionPoolManager] = None
+
+
+# 获取会话池管理器 首次获取时创建并启动后台预热和健康检查
+def get_mcp_pool_manager(servers: Dict[str, Dict[str, Any]]) -> MCPSessionPoolManager:
+    global _pool_manager
+    if _pool_manager is None:
+        _pool_manager = MCPSessionPoolManager(servers)
+        _pool_manager.start_background()
+        logger.info(f"MCP会话池初始化成功: {list(servers.keys())}")
+    return _pool_manager
+
+
+# 获取会话池指标 会话池尚未创建时返回空字典
+def get_mcp_pool_metrics() -> Dict[str, Any]:
+    return _pool_manager.metrics() if _pool_manager is not None else {}
+
+
+# 关闭会话池管理器
+async def close_mcp_pool_manager() -> None:
+    global _pool_manager
+    if _pool_manager is not None:
+        await _pool_manager.close()
+        _pool_manager = None
+        logger.info("MCP会话池已关闭")
@@ -0,0 +1,95 @@
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 从模型响应中读取输入token数和命中提示词缓存的token数
+def _extract_usage(message: Any) -> Optional[Dict[str, int]]:
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        details = usage.get("input_token_details") or {}
+        return {"input_tokens": usage.get("input_tokens", 0), "cached_tokens": details.get("cache_read", 0) or 0}
+    # 兼容只在response_metadata中返回用量的模型服务
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage")
+    if token_usage:
+        details = token_usage.get("prompt_tokens_details") or {}
+        return {"input_tokens": token_usage.get("prompt_tokens", 0), "cached_tokens": details.get("cached_tokens", 0) or 0}
+    return None
+
+
+# 统计模型服务端提示词缓存的命中情况
+class PromptCacheStats(BaseCallbackHandler):
+    def __init__(self):
+        # 指标数据
+        self.stats = {"calls": 0, "calls_with_usage": 0, "calls_with_cache_hit": 0, "input_tokens": 0, "cached_tokens": 0}
+        self.last_call: Optional[Dict[str, Any]] = None
+
+    # 每次模型调用结束时累计token用量
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.stats["calls"] += 1
+        for generations in response.generations:
+            for generation in generations:
+                usage = _extract_usage(getattr(generation, "message", None))
+                if usage is None:
+                    continue
+                self.stats["calls_with_usage"] += 1
+                self.stats["input_tokens"] += usage["input_tokens"]
+                self.stats["cached_tokens"] += usage["cached_tokens"]
+                if usage["cached_tokens"] > 0:
+                    self.stats["calls_with_cache_hit"] += 1
+                ratio = round(usage["cached_tokens"] / usage["input_tokens"], 4) if usage["input_tokens"] else None
+                self.last_call = {**usage, "cached_ratio": ratio}
+                logger.info(f"模型调用输入token: {usage['input_tokens']}，命中提示词缓存: {usage['cached_tokens']}，缓存比例: {ratio}")
+
+    # 提示词缓存指标
+    def metrics(self) -> Dict[str, Any]:
+        input_tokens = self.stats["input_tokens"]
+        return {
+            **self.stats,
+            "cached_ratio": round(self.stats["cached_tokens"] / input_tokens, 4) if input_tokens else None,
+            "last_call": self.last_call,
+        }
+
+
+# 进程内共享的提示词缓存统计
+_prompt_cache_stats = PromptCacheStats()
+
+
+# 获取提示词缓存统计的回调处理器
+def get_prompt_cache_stats() -> PromptCacheStats:
+    return _prompt_cache_stats
+
+
+# 获取提示词缓存指标
+def get_prompt_cache_metrics() -> Dict[str, Any]:
+    return _prompt_cache_stats.metrics()
@@ -0,0 +1,179 @@
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Any, Dict, Optional
+import redis.asyncio as redis
+from redis.asyncio.cluster import RedisCluster, ClusterNode
+from redis.asyncio.sentinel import Sentinel
+from redis.asyncio.connection import Connection
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.utils import HIREDIS_AVAILABLE
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 支持的Redis部署方式
+REDIS_MODES = ("standalone", "sentinel", "cluster")
+
+# 每个后端进程的Redis客户端数 会话读写的解码、不解码客户端和取消请求的发布订阅客户端
+_CLIENTS_PER_WORKER = 3
+
+# 进程内共享的Sentinel客户端 多个Redis客户端共用同一组哨兵连接
+_sentinel: Optional[Sentinel] = None
+
+
+# 每个Redis客户端的连接数上限 全部后端进程合计不超过REDIS_CONNECTION_BUDGET
+def worker_max_connections() -> int:
+    share = Config.REDIS_CONNECTION_BUDGET // (Config.WORKERS * _CLIENTS_PER_WORKER)
+    return max(min(Config.REDIS_MAX_CONNECTIONS, share), 4)
+
+
+# 会话数据键 用户ID作为hash tag，同一用户的会话键与会话集合落在同一个槽位
+def session_key(user_id: str, session_id: str) -> str:
+    return f"session:{{{user_id}}}:{session_id}"
+
+
+# 用户会话集合键
+def user_sessions_key(user_id: str) -> str:
+    return f"user_sessions:{{{user_id}}}"
+
+
+# 运行心跳键 与会话键使用相同的hash tag，不以session:开头，不触发会话近端缓存的失效通知
+def run_heartbeat_key(user_id: str, session_id: str) -> str:
+    return f"run_heartbeat:{{{user_id}}}:{session_id}"
+
+
+# 从用户会话集合键中解析用户ID 兼容未使用hash tag的旧键
+def parse_user_sessions_key(key: str) -> str:
+    user_id = key.split(":", 1)[1]
+    if user_id.startswith("{") and user_id.endswith("}"):
+        return user_id[1:-1]
+    return user_id
+
+
+# 是否为集群客户端 集群模式下不支持跨槽位事务
+def is_cluster(client: Any) -> bool:
+    return isinstance(client, RedisCluster)
+
+
+# 连接参数 各部署方式共用
+def _connection_kwargs(decode_responses: bool) -> Dict[str, Any]:
+    return {
+        "password": Config.REDIS_PASSWORD,
+        "decode_responses": decode_responses,
+        "max_connections": worker_max_connections(),
+        "socket_timeout": Config.REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": Config.REDIS_SOCKET_CONNECT_TIMEOUT,
+        "health_check_interval": Config.REDIS_HEALTH_CHECK_INTERVAL,
+    }
+
+
+# 获取Sentinel客户端
+def _get_sentinel() -> Sentinel:
+    global _sentinel
+    if _sentinel is None:
+        _sentinel = Sentinel(
+            Config.REDIS_SENTINELS,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            sentinel_kwargs={"password": Config.REDIS_SENTINEL_PASSWORD, "socket_timeout": Config.REDIS_SOCKET_TIMEOUT},
+        )
+    return _sentinel
+
+
+# 按配置的部署方式创建Redis客户端
+def create_redis_client(decode_responses: bool = True) -> redis.Redis | RedisCluster:
+    """
+    按Config.REDIS_MODE创建Redis客户端
+
+    Args:
+        decode_responses: 是否将响应解码为字符串，读写二进制会话记录时为False
+
+    Returns:
+        standalone、sentinel模式返回Redis客户端，cluster模式返回RedisCluster客户端
+    """
+    mode = Config.REDIS_MODE
+    if mode not in REDIS_MODES:
+        raise ValueError(f"不支持的Redis部署方式: {mode}，可选: {REDIS_MODES}")
+    kwargs = _connection_kwargs(decode_responses)
+    if mode == "cluster":
+        # 集群客户端自行处理MOVED/ASK重定向和节点故障重试，集群模式只有db 0
+        return RedisCluster(
+            startup_nodes=[ClusterNode(host, port) for host, port in Config.REDIS_CLUSTER_NODES],
+            **kwargs
+        )
+    # 连接断开或超时时按指数退避重试，主从切换期间请求不会直接失败
+    kwargs.update(
+        db=Config.REDIS_DB,
+        retry=Retry(ExponentialBackoff(cap=1, base=0.05), Config.REDIS_RETRY_ATTEMPTS),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+    if mode == "sentinel":
+        # 主节点地址由哨兵发现，主从切换后新建的连接自动指向新的主节点
+        return _get_sentinel().master_for(Config.REDIS_SENTINEL_MASTER, **kwargs)
+    return redis.Redis(host=Config.REDIS_HOST, port=Config.REDIS_PORT, **kwargs)
+
+
+# 创建用于发布订阅的Redis客户端 集群模式下普通频道的消息会广播到所有节点，连接任一启动节点即可
+def create_pubsub_client() -> redis.Redis:
+    if Config.REDIS_MODE == "cluster":
+        host, port = Config.REDIS_CLUSTER_NODES[0]
+        return redis.Redis(host=host, port=port, **_connection_kwargs(decode_responses=True))
+    return create_redis_client(decode_responses=True)
+
+
+# 创建直连主节点的单个连接 供会话近端缓存的失效通知使用，集群模式返回None
+async def create_primary_connection() -> Optional[Connection]:
+    if Config.REDIS_MODE == "cluster":
+        return None
+    if Config.REDIS_MODE == "sentinel":
+        host, port = await _get_sentinel().discover_master(Config.REDIS_SENTINEL_MASTER)
+    else:
+        host, port = Config.REDIS_HOST, Config.REDIS_PORT
+    return Connection(host=host, port=port, db=Config.REDIS_DB, password=Config.REDIS_PASSWORD,
+                      socket_connect_timeout=Config.REDIS_SOCKET_CONNECT_TIMEOUT)
+
+
+# Redis连接信息 用于启动日志和运维接口
+def get_redis_connection_info() -> Dict[str, Any]:
+    info: Dict[str, Any] = {
+        "mode": Config.REDIS_MODE,
+        # 安装hiredis后redis-py自动使用C实现的协议解析器
+        "parser": "hiredis" if HIREDIS_AVAILABLE else "python",
+        "max_connections": worker_max_connections(),
+        "workers": Config.WORKERS,
+    }
+    if Config.REDIS_MODE == "cluster":
+        info["nodes"] = [f"{host}:{port}" for host, port in Config.REDIS_CLUSTER_NODES]
+    elif Config.REDIS_MODE == "sentinel":
+        info["sentinels"] = [f"{host}:{port}" for host, port in Config.REDIS_SENTINELS]
+        info["master"] = Config.REDIS_SENTINEL_MASTER
+    else:
+        info["address"] = f"{Config.REDIS_HOST}:{Config.REDIS_PORT}"
+    return info
@@ -0,0 +1,269 @@
+import os
+import json
+import time
+import socket
+import asyncio
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional, Tuple, Callable, Awaitable
+from starlette.requests import Request
+import redis.asyncio as redis
+from .config import Config
+from .redis_conn import run_heartbeat_key
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 可以安全停止的图节点 这些节点只调用大模型，中途停止不会留下执行了一半的工具调用
+CANCEL_SAFE_NODES = ("agent", "pre_model_hook")
+
+
+# 跨进程广播取消请求的频道
+CANCEL_CHANNEL = "agent_cancel"
+
+
+# 进行中的智能体运行
+class AgentRun:
+    def __init__(self, user_id: Optional[str], session_id: str):
+        self.user_id = user_id
+        self.session_id = session_id
+        self.started_at = time.time()
+        # 运行智能体的任务 由调用方在创建任务后设置
+        self.task: Optional[asyncio.Task] = None
+        # 取消事件 流式运行在安全点检查
+        self.cancel_event = asyncio.Event()
+        self.cancel_reason: Optional[str] = None
+
+    # 是否已请求取消
+    @property
+    def cancel_requested(self) -> bool:
+        return self.cancel_reason is not None
+
+    # 请求取消 force为True时立即取消任务，否则等待运行到下一个安全点
+    def cancel(self, reason: str, force: bool = False) -> None:
+        if self.cancel_reason is None:
+            self.cancel_reason = reason
+        self.cancel_event.set()
+        if force and self.task is not None and not self.task.done():
+            self.task.cancel()
+
+
+# 本进程中进行中的智能体运行 取消请求通过Redis发布订阅送达所有后端进程，心跳键标记运行仍然存活
+class RunRegistry:
+    def __init__(self):
+        self._runs: Dict[Tuple[Optional[str], str], AgentRun] = {}
+        # 发布和订阅取消请求的Redis客户端 在服务启动时设置
+        self._client: Optional[redis.Redis] = None
+        self._listener: Optional[asyncio.Task] = None
+        # 写入心跳键的Redis客户端 与会话共用，不由本对象关闭
+        self._redis: Optional[redis.Redis] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        # 随心跳为进行中的会话续期 运行时间超过会话过期时间时会话记录不会过期
+        self._touch_session: Optional[Callable[[str, str], Awaitable[Any]]] = None
+        # 心跳键的值 便于排查运行所在的进程
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        # 指标数据
+        self.stats = {"cancel_requests": 0, "cancel_messages": 0, "cancelled_local": 0, "heartbeats": 0, "heartbeat_errors": 0}
+
+    # 登记一次运行 同一会话的新运行覆盖旧的登记
+    def register(self, user_id: Optional[str], session_id: str) -> AgentRun:
+        run = AgentRun(user_id, session_id)
+        self._runs[(user_id, session_id)] = run
+        return run
+
+    # 运行结束后注销
+    def unregister(self, run: AgentRun) -> None:
+        if self._runs.get((run.user_id, run.session_id)) is run:
+            self._runs.pop((run.user_id, run.session_id), None)
+
+    # 取消本进程中的运行 返回是否找到该运行
+    def cancel_local(self, user_id: str, session_id: str, reason: str) -> bool:
+        run = self._runs.get((user_id, session_id))
+        if run is None:
+            return False
+        logger.info(f"取消会话 {user_id}:{session_id} 正在进行的智能体运行，原因: {reason}")
+        run.cancel(reason, force=True)
+        self.stats["cancelled_local"] += 1
+        return True
+
+    # 发布取消请求 返回收到请求的后端进程数
+    async def request_cancel(self, user_id: str, session_id: str, reason: str) -> int:
+        self.stats["cancel_requests"] += 1
+        if self._client is None:
+            return int(self.cancel_local(user_id, session_id, reason))
+        payload = json.dumps({"user_id": user_id, "session_id": session_id, "reason": reason}, ensure_ascii=False)
+        try:
+            return await self._client.publish(CANCEL_CHANNEL, payload)
+        except Exception as e:
+            # Redis不可用时至少取消本进程中的运行
+            logger.warning(f"发布取消请求失败，只取消本进程中的运行: {e}")
+            return int(self.cancel_local(user_id, session_id, reason))
+
+    # 订阅取消请求 连接断开后按间隔重新订阅
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(CANCEL_CHANNEL)
+                logger.info(f"已订阅取消请求频道: {CANCEL_CHANNEL}")
+                async for message in pubsub.listen():
+                    self.stats["cancel_messages"] += 1
+                    try:
+                        payload = json.loads(message["data"])
+                        self.cancel_local(payload["user_id"], payload["session_id"], payload.get("reason", "用户取消"))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"忽略无效的取消请求 {message.get('data')!r}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"取消请求频道的订阅断开: {e}")
+            finally:
+                await pubsub.aclose()
+            await asyncio.sleep(Config.RUN_CANCEL_RETRY_INTERVAL)
+
+    # 定期为本进程中进行中的运行刷新心跳键 进程退出后心跳键在RUN_HEARTBEAT_TTL秒内过期
+    async def _heartbeat(self) -> None:
+        while True:
+            runs = [run for run in self._runs.values() if run.user_id is not None]
+            if runs:
+                try:
+                    async with self._redis.pipeline(transaction=False) as pipe:
+                        for run in runs:
+                            pipe.set(run_heartbeat_key(run.user_id, run.session_id), self.worker_id, ex=Config.RUN_HEARTBEAT_TTL)
+                        await pipe.execute()
+                    if self._touch_session is not None:
+                        await asyncio.gather(*(self._touch_session(run.user_id, run.session_id) for run in runs))
+                    self.stats["heartbeats"] += len(runs)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["heartbeat_errors"] += 1
+                    logger.warning(f"刷新运行心跳失败: {e}")
+            await asyncio.sleep(Config.RUN_HEARTBEAT_INTERVAL)
+
+    # 启动取消请求的订阅和运行心跳 touch_session为每次心跳时为会话续期的函数
+    def start(self, pubsub_client: redis.Redis, redis_client: redis.Redis,
+              touch_session: Optional[Callable[[str, str], Awaitable[Any]]] = None) -> None:
+        if self._listener is None:
+            self._client = pubsub_client
+            self._listener = asyncio.create_task(self._listen())
+        if self._heartbeat_task is None:
+            self._redis = redis_client
+            self._touch_session = touch_session
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    # 停止订阅和心跳并关闭发布订阅的Redis客户端
+    async def close(self) -> None:
+        for task in (self._listener, self._heartbeat_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener = self._heartbeat_task = None
+        self._redis = self._touch_session = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # 运行指标
+    def metrics(self) -> Dict[str, Any]:
+        now = time.time()
+        return {
+            **self.stats,
+            "worker_id": self.worker_id,
+            "running": [
+                {"user_id": run.user_id, "session_id": run.session_id, "elapsed": round(now - run.started_at, 1),
+                 "cancel_requested": run.cancel_requested}
+                for run in self._runs.values()
+            ],
+        }
+
+
+# 检测客户端是否断开连接 断开后通知运行在下一个安全点停止
+async def watch_disconnect(request: Request, run: AgentRun) -> None:
+    while not run.cancel_event.is_set():
+        if await request.is_disconnected():
+            logger.info("客户端已断开连接，通知智能体在下一个安全点停止")
+            run.cancel("客户端断开连接，智能体运行已取消")
+            return
+        await asyncio.sleep(Config.STREAM_DISCONNECT_CHECK_INTERVAL)
+
+
+# 智能体运行的取消统计
+class RunCancellationStats:
+    def __init__(self):
+        # 指标数据 tokens为模型服务返回的实际用量
+        self.stats = {"completed_runs": 0, "completed_tokens": 0, "cancelled_runs": 0, "cancelled_tokens": 0,
+                      "estimated_tokens_saved": 0}
+
+    # 平均每次完整运行消耗的token数
+    def average_run_tokens(self) -> Optional[float]:
+        if not self.stats["completed_runs"]:
+            return None
+        return self.stats["completed_tokens"] / self.stats["completed_runs"]
+
+    # 记录运行完成或中断等待审查
+    def record_completed(self, tokens: int) -> None:
+        self.stats["completed_runs"] += 1
+        self.stats["completed_tokens"] += tokens
+
+    # 记录运行被取消 按完整运行的平均用量估算节省的token数
+    def record_cancelled(self, tokens: int) -> int:
+        average = self.average_run_tokens()
+        saved = max(int(average - tokens), 0) if average is not None else 0
+        self.stats["cancelled_runs"] += 1
+        self.stats["cancelled_tokens"] += tokens
+        self.stats["estimated_tokens_saved"] += saved
+        return saved
+
+    # 取消指标
+    def metrics(self) -> Dict[str, Any]:
+        average = self.average_run_tokens()
+        return {**self.stats, "average_run_tokens": round(average, 1) if average is not None else None}
+
+
+# 进程内共享的取消统计和运行登记
+_run_cancellation_stats = RunCancellationStats()
+_run_registry = RunRegistry()
+
+
+# 获取进行中运行的登记
+def get_run_registry() -> RunRegistry:
+    return _run_registry
+
+
+# 获取智能体运行的取消统计
+def get_run_cancellation_stats() -> RunCancellationStats:
+    return _run_cancellation_stats
+
+
+# 获取智能体运行的取消指标
+def get_run_cancellation_metrics() -> Dict[str, Any]:
+    return {**_run_cancellation_stats.metrics(), **_run_registry.metrics()}
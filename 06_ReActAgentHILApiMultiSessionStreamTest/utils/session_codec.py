@@ -0,0 +1,221 @@
+import json
+import struct
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional
+from pydantic import BaseModel
+from .config import Config
+
+# 以下均为可选依赖，未安装时回退到标准库json、不压缩
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 会话记录格式（字符串键，旧版本）只用于读取，新记录一律写成哈希格式
+# | 魔数 \x00SC (3字节) | 序列化方式 (1字节) | 压缩方式 (1字节) | 元数据长度 (4字节) | 元数据 | last_response |
+# 元数据为status、last_query等小字段，始终不压缩；last_response单独序列化，超过阈值时压缩，读取状态时不解析
+_MAGIC = b"\x00SC"
+_HEADER = struct.Struct(">3sBBI")
+
+# 会话记录格式（哈希键）
+# 元数据每个字段单独存放为JSON，version为整数以便HINCRBY；
+# last_response字段为 | 序列化方式 (1字节) | 压缩方式 (1字节) | 序列化结果 |，只更新状态时不需要读写该字段
+HASH_META_FIELDS = ("session_id", "status", "last_query", "last_updated", "version")
+HASH_RESPONSE_FIELD = "last_response"
+_RESPONSE_HEADER = struct.Struct(">BB")
+
+# 序列化方式编号
+_CODEC_IDS = {"json": 1, "orjson": 2, "msgpack": 3}
+# 压缩方式编号
+_COMPRESSION_NONE = 0
+_COMPRESSION_ZSTD = 1
+
+
+# 无法直接序列化的对象 如Pydantic模型、LangChain消息
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    if hasattr(obj, "__dict__"):
+        return obj.__dict__
+    return str(obj)
+
+
+# 按序列化方式编号序列化
+def _dumps(codec_id: int, obj: Any) -> bytes:
+    if codec_id == 3:
+        return msgpack.packb(obj, default=_default, use_bin_type=True)
+    if codec_id == 2:
+        return orjson.dumps(obj, default=_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+# 按序列化方式编号反序列化
+def _loads(codec_id: int, data: bytes) -> Any:
+    if codec_id == 3:
+        return msgpack.unpackb(data, raw=False)
+    if codec_id == 2:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# 解码后的会话记录 last_response在首次访问时才解析
+class SessionRecord:
+    def __init__(self, meta: Dict[str, Any], codec_id: int, compression: int, payload: bytes,
+                 response: Any = None, decoded: bool = False):
+        self.meta = meta
+        self.codec_id = codec_id
+        self.compression = compression
+        self.payload = payload
+        self._response = response
+        self._decoded = decoded
+
+    # 解析last_response
+    @property
+    def response(self) -> Optional[Dict[str, Any]]:
+        if not self._decoded:
+            data = self.payload
+            if data and self.compression == _COMPRESSION_ZSTD:
+                data = zstandard.ZstdDecompressor().decompress(data)
+            self._response = _loads(self.codec_id, data) if data else None
+            self._decoded = True
+        return self._response
+
+    # 转换为原有的会话字典结构
+    def to_dict(self, include_response: bool = True) -> Dict[str, Any]:
+        session = dict(self.meta)
+        if include_response:
+            session["last_response"] = self.response
+        return session
+
+
+# 可配置的会话记录编解码器
+class SessionCodec:
+    # 初始化 codec为json、orjson或msgpack，compression为zstd或None
+    def __init__(self, codec: str = Config.SESSION_CODEC, compression: Optional[str] = Config.SESSION_COMPRESSION,
+                 compress_threshold: int = Config.SESSION_COMPRESS_THRESHOLD):
+        if codec not in _CODEC_IDS:
+            raise ValueError(f"不支持的会话序列化方式: {codec}")
+        # 依赖未安装时回退到标准库json
+        if (codec == "msgpack" and msgpack is None) or (codec == "orjson" and orjson is None):
+            logger.warning(f"未安装 {codec}，会话记录回退为json序列化")
+            codec = "json"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("未安装 zstandard，会话记录不压缩")
+            compression = None
+        self.codec = codec
+        self.codec_id = _CODEC_IDS[codec]
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+
+    # 序列化last_response 返回(压缩方式, 字节串)
+    def encode_response(self, response: Any) -> tuple[int, bytes]:
+        if response is None:
+            return _COMPRESSION_NONE, b""
+        if isinstance(response, BaseModel):
+            response = response.model_dump(mode="json")
+        data = _dumps(self.codec_id, response)
+        if self.compression == "zstd" and len(data) >= self.compress_threshold:
+            return _COMPRESSION_ZSTD, zstandard.ZstdCompressor(level=Config.SESSION_ZSTD_LEVEL).compress(data)
+        return _COMPRESSION_NONE, data
+
+    # 编码哈希格式的元数据字段 version由HINCRBY维护，不在这里编码
+    @staticmethod
+    def encode_fields(meta: Dict[str, Any]) -> Dict[str, bytes]:
+        return {
+            field: json.dumps(value, ensure_ascii=False).encode("utf-8")
+            for field, value in meta.items() if field != "version"
+        }
+
+    # 编码哈希格式的last_response字段
+    def encode_response_field(self, response: Any) -> bytes:
+        compression, payload = self.encode_response(response)
+        return _RESPONSE_HEADER.pack(self.codec_id, compression) + payload
+
+    # 编码完整的哈希格式会话记录
+    def encode_hash(self, meta: Dict[str, Any], response: Any = None) -> Dict[str, bytes]:
+        mapping = self.encode_fields(meta)
+        mapping["version"] = str(meta.get("version", 1)).encode()
+        mapping[HASH_RESPONSE_FIELD] = self.encode_response_field(response)
+        return mapping
+
+    # 解码哈希格式的会话记录 mapping中没有last_response字段时视为未读取
+    @staticmethod
+    def decode_hash(mapping: Dict[Any, Optional[bytes]]) -> SessionRecord:
+        meta: Dict[str, Any] = {}
+        payload, codec_id, compression = b"", _CODEC_IDS["json"], _COMPRESSION_NONE
+        for field, value in mapping.items():
+            field = field.decode() if isinstance(field, bytes) else field
+            if value is None:
+                continue
+            if field == HASH_RESPONSE_FIELD:
+                codec_id, compression = _RESPONSE_HEADER.unpack_from(value)
+                payload = value[_RESPONSE_HEADER.size:]
+            elif field == "version":
+                meta["version"] = int(value)
+            else:
+                meta[field] = json.loads(value)
+        return SessionRecord(meta, codec_id, compression, payload)
+
+    # 解码会话记录 兼容旧版本的整体JSON格式
+    def decode(self, raw: bytes) -> SessionRecord:
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        if not raw.startswith(_MAGIC):
+            # 旧版本的JSON记录，下次更新时会写成新格式
+            session = json.loads(raw)
+            response = session.pop("last_response", None)
+            return SessionRecord(session, _CODEC_IDS["json"], _COMPRESSION_NONE, b"", response, decoded=True)
+        _, codec_id, compression, meta_length = _HEADER.unpack_from(raw)
+        start = _HEADER.size
+        meta = _loads(codec_id, raw[start:start + meta_length])
+        return SessionRecord(meta, codec_id, compression, raw[start + meta_length:])
+
+
+# 进程内共享的会话编解码器
+_session_codec: Optional[SessionCodec] = None
+
+
+# 获取会话编解码器
+def get_session_codec() -> SessionCodec:
+    global _session_codec
+    if _session_codec is None:
+        _session_codec = SessionCodec()
+        logger.info(f"会话记录序列化方式: {_session_codec.codec}，压缩方式: {_session_codec.compression}")
+    return _session_codec
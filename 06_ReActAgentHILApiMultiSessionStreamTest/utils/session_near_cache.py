@@ -0,0 +1,264 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional, Tuple
+from redis.asyncio.connection import Connection
+from .config import Config
+from .session_codec import SessionRecord
+from .redis_conn import create_primary_connection
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# Redis发送失效通知的频道
+_INVALIDATE_CHANNEL = b"__redis__:invalidate"
+
+
+# 会话记录的进程内近端缓存
+class SessionNearCache:
+    """
+    会话记录的进程内近端缓存
+
+    使用Redis客户端缓存的广播模式：监听连接订阅__redis__:invalidate频道，跟踪连接开启
+    CLIENT TRACKING ON REDIRECT <监听连接ID> BCAST PREFIX session:，任何进程修改、删除或过期
+    session:前缀的键时，Redis都会向监听连接推送失效通知，本进程随即删除对应的缓存记录。
+    失效通知连接断开期间缓存停用，所有读取直接访问Redis，重连成功后重新启用；
+    哨兵模式下连接哨兵发现的主节点，保活检查发现该节点不再是主节点时重连
+    """
+    def __init__(self, prefix: str = "session:"):
+        self.prefix = prefix
+        # 缓存记录 键为Redis键，值为(过期时间, 会话记录, 是否包含last_response)
+        self._entries: "OrderedDict[str, Tuple[float, SessionRecord, bool]]" = OrderedDict()
+        # 清空代数 每次清空缓存加1，读取Redis期间缓存被清空时不写入
+        self._flush_generation = 0
+        # 正在读取Redis的键 值为[该键的失效代数, 读取数]，读取期间该键失效时不写入缓存，避免写回过期的记录
+        self._pending: Dict[str, List[int]] = {}
+        # 失效通知连接就绪后才启用缓存
+        self.ready = False
+        self._listener: Optional[Connection] = None
+        self._tracker: Optional[Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        # 指标数据
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0, "flushes": 0, "reconnects": 0}
+
+    # 启动失效通知监听
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # 停止失效通知监听并清空缓存
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._disconnect()
+
+    # 建立失效通知连接 先订阅再开启跟踪，保证开启后的失效通知不会丢失
+    async def _connect(self) -> None:
+        self._listener = await create_primary_connection()
+        self._tracker = await create_primary_connection()
+        await self._listener.send_command("CLIENT", "ID")
+        listener_id = await self._listener.read_response()
+        await self._listener.send_command("SUBSCRIBE", _INVALIDATE_CHANNEL)
+        await self._listener.read_response()
+        await self._tracker.send_command("CLIENT", "TRACKING", "ON", "REDIRECT", listener_id, "BCAST", "PREFIX", self.prefix)
+        await self._tracker.read_response()
+        # 开启跟踪之前缓存的记录可能已经过期
+        self._flush()
+        self.ready = True
+        logger.info(f"会话近端缓存已启用，失效通知连接ID: {listener_id}，跟踪前缀: {self.prefix}")
+
+    # 关闭失效通知连接并停用缓存
+    async def _disconnect(self) -> None:
+        self.ready = False
+        self._flush()
+        for connection in (self._listener, self._tracker):
+            if connection is not None:
+                await connection.disconnect()
+        self._listener = self._tracker = None
+
+    # 失效通知连接的主循环 断开后按间隔重连
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self._connect()
+                keepalive = asyncio.create_task(self._keepalive())
+                try:
+                    await self._listen()
+                finally:
+                    keepalive.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"会话近端缓存的失效通知连接断开，缓存停用: {e}")
+            await self._disconnect()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(Config.SESSION_NEAR_CACHE_RETRY_INTERVAL)
+
+    # 读取失效通知 消息内容为失效的键列表，为空时表示FLUSHDB/FLUSHALL
+    async def _listen(self) -> None:
+        while True:
+            message = await self._listener.read_response()
+            if not isinstance(message, list) or len(message) < 3 or message[0] != b"message" or message[1] != _INVALIDATE_CHANNEL:
+                continue
+            keys = message[2]
+            if keys is None:
+                self.stats["flushes"] += 1
+                self._flush()
+                continue
+            for key in keys:
+                self.invalidate(key.decode() if isinstance(key, bytes) else key)
+                self.stats["invalidations"] += 1
+
+    # 定期检查跟踪连接 跟踪连接断开或主从切换后不会再收到失效通知，需要断开监听连接触发重连
+    async def _keepalive(self) -> None:
+        while True:
+            await asyncio.sleep(Config.SESSION_NEAR_CACHE_HEALTH_INTERVAL)
+            try:
+                await self._tracker.send_command("ROLE")
+                role = await self._tracker.read_response()
+                if role[0] != b"master":
+                    raise ConnectionError(f"节点角色已变为 {role[0]!r}")
+            except Exception as e:
+                logger.warning(f"会话近端缓存的跟踪连接不可用: {e}")
+                self.ready = False
+                self._flush()
+                await self._listener.disconnect()
+                return
+
+    # 清空缓存
+    def _flush(self) -> None:
+        self._flush_generation += 1
+        self._entries.clear()
+
+    # 删除指定键的缓存记录 本进程写入会话后也要调用，不等待失效通知
+    def invalidate(self, key: str) -> None:
+        pending = self._pending.get(key)
+        if pending is not None:
+            pending[0] += 1
+        self._entries.pop(key, None)
+
+    # 开始从Redis读取指定键 返回写入缓存时校验用的代数，读取结束后必须调用end
+    def begin(self, key: str) -> Tuple[int, int]:
+        pending = self._pending.setdefault(key, [0, 0])
+        pending[1] += 1
+        return self._flush_generation, pending[0]
+
+    # 结束读取 没有其他读取时不再跟踪该键
+    def end(self, key: str) -> None:
+        pending = self._pending.get(key)
+        if pending is None:
+            return
+        pending[1] -= 1
+        if pending[1] <= 0:
+            del self._pending[key]
+
+    # 读取缓存 include_response为True时只返回包含last_response的记录，未命中返回None
+    def get(self, key: str, include_response: bool) -> Optional[SessionRecord]:
+        if not self.ready:
+            return None
+        item = self._entries.get(key)
+        if item is None or (include_response and not item[2]):
+            self.stats["misses"] += 1
+            return None
+        expires_at, record, _ = item
+        if expires_at < time.monotonic():
+            self._entries.pop(key, None)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return record
+
+    # 判断键是否在缓存中 在缓存中说明会话存在
+    def contains(self, key: str) -> bool:
+        if not self.ready:
+            return False
+        item = self._entries.get(key)
+        return item is not None and item[0] >= time.monotonic()
+
+    # 写入缓存 generation为begin返回的代数，读取期间该键失效或缓存被清空时不写入
+    def put(self, key: str, record: SessionRecord, include_response: bool, generation: Tuple[int, int]) -> None:
+        pending = self._pending.get(key)
+        if not self.ready or pending is None or generation != (self._flush_generation, pending[0]):
+            return
+        self._entries[key] = (time.monotonic() + Config.SESSION_NEAR_CACHE_TTL, record, include_response)
+        self._entries.move_to_end(key)
+        self.stats["stores"] += 1
+        while len(self._entries) > Config.SESSION_NEAR_CACHE_MAX_ITEMS:
+            self._entries.popitem(last=False)
+
+    # 缓存指标
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "enabled": self.ready,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "items": len(self._entries),
+        }
+
+
+# 进程内共享的会话近端缓存
+_session_near_cache: Optional[SessionNearCache] = None
+
+
+# 初始化会话近端缓存 在服务启动时调用，未启用时返回None
+def init_session_near_cache() -> Optional[SessionNearCache]:
+    global _session_near_cache
+    if not Config.SESSION_NEAR_CACHE_ENABLED:
+        return None
+    # 集群模式下失效通知只覆盖单个节点上的键，不启用近端缓存
+    if Config.REDIS_MODE == "cluster":
+        logger.info("Redis集群模式不启用会话近端缓存")
+        return None
+    if _session_near_cache is None:
+        _session_near_cache = SessionNearCache()
+        _session_near_cache.start()
+    return _session_near_cache
+
+
+# 获取会话近端缓存指标
+def get_session_near_cache_metrics() -> Dict[str, Any]:
+    if _session_near_cache is None:
+        return {"enabled": False}
+    return _session_near_cache.metrics()
+
+
+# 关闭会话近端缓存
+async def close_session_near_cache() -> None:
+    global _session_near_cache
+    if _session_near_cache is not None:
+        await _session_near_cache.close()
+        _session_near_cache = None
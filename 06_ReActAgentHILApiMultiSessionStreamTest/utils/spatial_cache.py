@@ -0,0 +1,258 @@
+import math
+import json
+import time
+import hashlib
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional, Tuple
+import redis.asyncio as redis
+from .config import Config
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# geohash使用的base32字符表
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: index for index, char in enumerate(_BASE32)}
+# 地球平均半径（米）
+_EARTH_RADIUS = 6371008.8
+
+
+# 将经纬度编码为geohash
+def geohash_encode(lat: float, lng: float, precision: int) -> str:
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        # 偶数位编码经度，奇数位编码纬度
+        value, value_range = (lng, lng_range) if even else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+# 解码geohash为格子的经纬度范围 (纬度下界, 纬度上界, 经度下界, 经度上界)
+def geohash_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        index = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            value_range = lng_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (index >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+# 获取geohash格子及其周围8个相邻格子
+def geohash_neighbors(geohash: str) -> List[str]:
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(geohash)
+    lat_center, lng_center = (lat_min + lat_max) / 2, (lng_min + lng_max) / 2
+    dlat, dlng = lat_max - lat_min, lng_max - lng_min
+    cells = []
+    for dy in (-1, 0, 1):
+        lat = lat_center + dy * dlat
+        # 超出南北极的格子不存在
+        if lat < -90 or lat > 90:
+            continue
+        for dx in (-1, 0, 1):
+            # 经度跨越180度时回绕
+            lng = (lng_center + dx * dlng + 180) % 360 - 180
+            cell = geohash_encode(lat, lng, len(geohash))
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+# 计算geohash格子的最短边长（米） 用于校验容差半径
+def geohash_cell_min_size(lat: float, precision: int) -> float:
+    lat_min, lat_max, lng_min, lng_max = geohash_bounds(geohash_encode(lat, 0.0, precision))
+    height = math.radians(lat_max - lat_min) * _EARTH_RADIUS
+    width = math.radians(lng_max - lng_min) * _EARTH_RADIUS * math.cos(math.radians(lat))
+    return min(height, width)
+
+
+# 计算两个坐标之间的球面距离（米）
+def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi, dlambda = phi2 - phi1, math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * _EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+# 解析高德"经度,纬度"格式的坐标 无法解析时返回None
+def parse_lnglat(value: Any) -> Optional[Tuple[float, float]]:
+    if not isinstance(value, str):
+        return None
+    parts = value.replace("，", ",").split(",")
+    if len(parts) != 2:
+        return None
+    try:
+        lng, lat = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        return None
+    return lng, lat
+
+
+# 坐标类工具的空间结果缓存
+class SpatialResultCache:
+    """
+    按geohash格子索引的工具结果缓存
+
+    每个格子对应一个Redis哈希，字段为缓存时的精确坐标，查询时读取所在格子及相邻8个格子，
+    返回容差半径内距离最近的缓存结果。容差半径不超过格子边长时，半径内的点一定落在这9个格子中
+    """
+    # 初始化缓存 policies为各工具的空间缓存策略
+    def __init__(self, redis_client: redis.Redis, policies: Dict[str, Dict[str, Any]]):
+        self.redis_client = redis_client
+        self.policies = policies
+        # 指标数据 pruned为清理的过期或超出上限的记录数
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "pruned": 0, "errors": 0}
+        for tool_name, policy in policies.items():
+            # 以中国中部纬度估算格子边长
+            cell_size = geohash_cell_min_size(32.0, policy["precision"])
+            if policy["radius"] > cell_size:
+                logger.warning(f"工具 {tool_name} 的容差半径 {policy['radius']}米 大于geohash精度 {policy['precision']} 的格子边长 {cell_size:.0f}米，部分半径内的缓存将无法命中")
+
+    # 判断工具是否使用空间缓存
+    def policy_for(self, tool_name: str) -> Optional[Dict[str, Any]]:
+        return self.policies.get(tool_name)
+
+    # 生成格子对应的缓存键 args_key为除坐标外其他参数的规范化结果
+    @staticmethod
+    def _cell_key(tool_name: str, args_key: str, cell: str) -> str:
+        digest = hashlib.sha1(args_key.encode("utf-8")).hexdigest()[:16]
+        return f"tool_geo_cache:{tool_name}:{digest}:{cell}"
+
+    # 查询容差半径内最近的缓存结果 返回(是否命中, 缓存结果)
+    async def get(self, tool_name: str, lng: float, lat: float, args_key: str) -> Tuple[bool, Any]:
+        policy = self.policies[tool_name]
+        keys = [self._cell_key(tool_name, args_key, cell)
+                for cell in geohash_neighbors(geohash_encode(lat, lng, policy["precision"]))]
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            buckets = await pipe.execute()
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"读取空间缓存失败: {e}")
+            return False, None
+
+        now = time.time()
+        best, best_distance = None, None
+        # 各格子中已过期的记录 查询后删除
+        expired: Dict[str, List[str]] = {}
+        for key, bucket in zip(keys, buckets):
+            for coord, raw in bucket.items():
+                entry = json.loads(raw)
+                if entry["expires_at"] < now:
+                    expired.setdefault(key, []).append(coord)
+                    continue
+                point = parse_lnglat(coord)
+                if point is None:
+                    continue
+                distance = haversine_distance(lat, lng, point[1], point[0])
+                if distance <= policy["radius"] and (best_distance is None or distance < best_distance):
+                    best, best_distance = entry, distance
+        if expired:
+            await self._delete_fields(expired)
+        if best is None:
+            self.stats["misses"] += 1
+            return False, None
+        self.stats["hits"] += 1
+        logger.info(f"工具 {tool_name} 命中空间缓存，距离缓存坐标 {best_distance:.1f}米")
+        return True, best["value"]
+
+    # 写入缓存 整个格子的过期时间随最近一次写入顺延，单条记录按expires_at判断是否过期
+    async def set(self, tool_name: str, lng: float, lat: float, args_key: str, value: Any) -> None:
+        policy = self.policies[tool_name]
+        key = self._cell_key(tool_name, args_key, geohash_encode(lat, lng, policy["precision"]))
+        entry = json.dumps({"value": value, "expires_at": time.time() + policy["ttl"]}, ensure_ascii=False)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.hset(key, f"{lng},{lat}", entry)
+            pipe.expire(key, policy["ttl"])
+            pipe.hlen(key)
+            *_, size = await pipe.execute()
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入空间缓存失败: {e}")
+            return
+        # 写入频繁的格子整体不会过期 超出记录上限时清理
+        if size > Config.TOOL_SPATIAL_CACHE_MAX_ENTRIES:
+            await self._prune(key, Config.TOOL_SPATIAL_CACHE_MAX_ENTRIES)
+
+    # 清理格子中的记录 先删除已过期的记录，仍超出上限时按过期时间从早到晚删除
+    async def _prune(self, key: str, max_entries: int) -> None:
+        try:
+            bucket = await self.redis_client.hgetall(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"读取空间缓存格子 {key} 失败: {e}")
+            return
+        now = time.time()
+        entries = sorted((json.loads(raw)["expires_at"], coord) for coord, raw in bucket.items())
+        expired = [coord for expires_at, coord in entries if expires_at < now]
+        alive = [coord for expires_at, coord in entries if expires_at >= now]
+        overflow = alive[:max(len(alive) - max_entries, 0)]
+        if expired or overflow:
+            await self._delete_fields({key: expired + overflow})
+
+    # 删除各格子中的指定记录 格子键 -> 坐标字段列表
+    async def _delete_fields(self, fields: Dict[str, List[str]]) -> None:
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, coords in fields.items():
+                pipe.hdel(key, *coords)
+            await pipe.execute()
+            self.stats["pruned"] += sum(len(coords) for coords in fields.values())
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"清理空间缓存失败: {e}")
+
+    # 缓存指标
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {**self.stats, "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None}
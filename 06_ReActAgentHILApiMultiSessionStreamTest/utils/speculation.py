@@ -0,0 +1,133 @@
+import time
+import asyncio
+import fnmatch
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Awaitable, Callable, Tuple
+from langchain_core.runnables import RunnableConfig
+from .config import Config
+from .tool_cache import normalize_args
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 判断工具是否允许在人工审查前预先执行
+def is_speculative_tool(tool_name: str) -> bool:
+    return any(fnmatch.fnmatchcase(tool_name, pattern) for pattern in Config.SPECULATIVE_TOOLS)
+
+
+# 生成预执行任务的键
+def speculation_key(config: RunnableConfig, tool_name: str, args: Dict[str, Any]) -> str:
+    """
+    生成预执行任务的键
+
+    工具函数内拿不到tool_call_id，这里使用线程ID和checkpoint_ns定位工具调用，
+    v2版本的智能体中每个工具调用是独立任务，checkpoint_ns包含由checkpoint确定的任务ID，中断恢复后保持不变
+
+    Args:
+        config: 工具调用时的运行配置
+        tool_name: 工具名称
+        args: 工具调用参数
+
+    Returns:
+        str: 预执行任务的键
+    """
+    configurable = config.get("configurable", {})
+    return f"{configurable.get('thread_id')}:{configurable.get('checkpoint_ns', '')}:{tool_name}:{normalize_args(args)}"
+
+
+# 人工审查期间的工具预执行
+class SpeculativeToolRunner:
+    # 初始化 ttl为预执行结果的保留时间
+    def __init__(self, ttl: int = Config.SPECULATIVE_RESULT_TTL):
+        self.ttl = ttl
+        self._tasks: Dict[str, Tuple[float, asyncio.Task]] = {}
+        # 指标数据
+        self.stats = {"started": 0, "used": 0, "discarded": 0, "expired": 0, "misses": 0}
+
+    # 清理超时未被审查的预执行任务
+    def _evict_expired(self) -> None:
+        now = time.monotonic()
+        for key in [key for key, (expires_at, _) in self._tasks.items() if expires_at < now]:
+            _, task = self._tasks.pop(key)
+            task.cancel()
+            self.stats["expired"] += 1
+
+    # 开始预执行 同一工具调用中断恢复后再次进入时不会重复执行
+    def start(self, key: str, factory: Callable[[], Awaitable[Any]]) -> None:
+        self._evict_expired()
+        if key in self._tasks:
+            return
+        task = asyncio.create_task(factory())
+        # 预执行失败时异常在审查通过后再抛出，这里避免未读取异常的警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._tasks[key] = (time.monotonic() + self.ttl, task)
+        self.stats["started"] += 1
+        logger.info(f"开始预执行工具调用: {key}")
+
+    # 取出预执行结果 没有预执行任务时返回(False, None)
+    async def take(self, key: str) -> Tuple[bool, Any]:
+        item = self._tasks.pop(key, None)
+        if item is None:
+            self.stats["misses"] += 1
+            return False, None
+        self.stats["used"] += 1
+        logger.info(f"使用预执行的工具调用结果: {key}")
+        return True, await item[1]
+
+    # 丢弃预执行结果
+    def discard(self, key: str) -> None:
+        item = self._tasks.pop(key, None)
+        if item is not None:
+            item[1].cancel()
+            self.stats["discarded"] += 1
+            logger.info(f"丢弃预执行的工具调用结果: {key}")
+
+    # 预执行指标
+    def metrics(self) -> Dict[str, Any]:
+        return {**self.stats, "pending": len(self._tasks)}
+
+    # 取消全部预执行任务
+    def close(self) -> None:
+        for _, task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+
+# 进程内共享的预执行管理器
+_speculative_runner = SpeculativeToolRunner()
+
+
+# 获取预执行管理器
+def get_speculative_runner() -> SpeculativeToolRunner:
+    return _speculative_runner
+
+
+# 获取预执行指标
+def get_speculation_metrics() -> Dict[str, Any]:
+    return _speculative_runner.metrics()
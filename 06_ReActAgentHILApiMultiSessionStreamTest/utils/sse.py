@@ -0,0 +1,148 @@
+import json
+import time
+import asyncio
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, List, Optional, Callable
+from pydantic import BaseModel
+from .config import Config
+
+# orjson为可选依赖，未安装时使用标准库json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 无法直接序列化的对象 如嵌套的Pydantic模型、LangChain消息
+def _json_default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    return str(obj)
+
+
+# 序列化为JSON字节串 优先使用orjson
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_json_default)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+# 合并文本块的SSE编码器
+class SSEEncoder:
+    """
+    流式输出的SSE编码器
+
+    文本块先放入缓冲区，超过合并时间窗口或字节上限后合并为一个text_chunk帧输出，减少JSON序列化和写入次数；
+    tool_call、interrupt、completed、error等事件帧输出前会先输出缓冲区中的文本，保证前端收到的顺序不变。
+    提供sink时，缓冲区收到第一个文本块后启动定时器，窗口到期即通过sink输出，文本最多延迟一个时间窗口；
+    未提供sink时时间窗口在收到下一个文本块时检查。事件和流结束时缓冲区一定会被清空
+    """
+    def __init__(self, session_id: str, interval: float = Config.SSE_COALESCE_INTERVAL,
+                 max_bytes: int = Config.SSE_COALESCE_MAX_BYTES, sink: Optional[Callable[[bytes], None]] = None):
+        self.session_id = session_id
+        self.interval = interval
+        self.max_bytes = max_bytes
+        # 定时输出的帧写入sink 需在事件循环中使用
+        self.sink = sink
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 预先生成文本帧模板，会话ID只序列化一次
+        self._text_prefix = b'data: {"type":"text_chunk","session_id":' + dumps(session_id) + b',"timestamp":'
+        self._buffer: List[str] = []
+        self._buffer_bytes = 0
+        self._buffer_started = 0.0
+        # 指标数据
+        self.chunks_in = 0
+        self.frames_out = 0
+
+    # 生成文本帧
+    def _text_frame(self, content: str) -> bytes:
+        self.frames_out += 1
+        return self._text_prefix + repr(time.time()).encode() + b',"content":' + dumps(content) + b'}\n\n'
+
+    # 写入一个文本块 达到合并窗口时返回合并后的帧，否则返回None
+    def text(self, content: str) -> Optional[bytes]:
+        self.chunks_in += 1
+        now = time.monotonic()
+        if not self._buffer:
+            self._buffer_started = now
+            # 窗口到期时由定时器输出 后续文本块不再到来也不会一直停留在缓冲区
+            if self.sink is not None and self.interval > 0:
+                self._timer = asyncio.get_running_loop().call_later(self.interval, self._flush_due)
+        self._buffer.append(content)
+        self._buffer_bytes += len(content.encode("utf-8"))
+        # 窗口为0时不合并，每个文本块单独输出
+        if self._buffer_bytes >= self.max_bytes or now - self._buffer_started >= self.interval:
+            return self.flush()
+        return None
+
+    # 时间窗口到期 将缓冲区中的文本写入sink
+    def _flush_due(self) -> None:
+        self._timer = None
+        frame = self.flush()
+        if frame:
+            self.sink(frame)
+
+    # 取消尚未到期的定时输出
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    # 输出缓冲区中的文本
+    def flush(self) -> Optional[bytes]:
+        self.close()
+        if not self._buffer:
+            return None
+        content = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffer_bytes = 0
+        return self._text_frame(content)
+
+    # 生成事件帧 先输出缓冲区中的文本，两帧合并为一次写入
+    def event(self, chunk_type: str, content: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+              interrupt_data: Optional[Dict[str, Any]] = None, error_message: Optional[str] = None) -> bytes:
+        pending = self.flush() or b""
+        self.frames_out += 1
+        # 字段与StreamChunk保持一致，兼容现有前端
+        frame = b"data: " + dumps({
+            "type": chunk_type,
+            "session_id": self.session_id,
+            "timestamp": time.time(),
+            "content": content,
+            "data": data,
+            "interrupt_data": interrupt_data,
+            "error_message": error_message,
+        }) + b"\n\n"
+        return pending + frame
+
+    # 合并指标
+    def metrics(self) -> Dict[str, Any]:
+        return {"chunks_in": self.chunks_in, "frames_out": self.frames_out}
@@ -0,0 +1,183 @@
+import os
+import time
+import logging
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional, Awaitable, Tuple, TypeVar, TYPE_CHECKING
+from .config import Config
+
+# 就绪检查只需要StartupTracker PostgreSQL相关的依赖在执行迁移检查时才导入
+if TYPE_CHECKING:
+    from psycopg_pool import AsyncConnectionPool
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+T = TypeVar("T")
+
+
+# 服务启动过程记录 各组件的初始化耗时和服务是否可以接收请求
+class StartupTracker:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.ready = False
+        # 服务就绪耗时（秒）
+        self.total_seconds: Optional[float] = None
+        # 各组件的初始化结果 组件名 -> {"status": ok|error, "seconds": 耗时, "detail": 说明}
+        self.components: Dict[str, Dict[str, Any]] = {}
+
+    # 记录一个组件的初始化 耗时从调用开始计算，异常原样抛出
+    async def track(self, name: str, awaitable: Awaitable[T]) -> T:
+        started = time.monotonic()
+        try:
+            result = await awaitable
+        except Exception as e:
+            self.components[name] = {"status": "error", "seconds": round(time.monotonic() - started, 3), "detail": str(e)}
+            raise
+        self.components[name] = {"status": "ok", "seconds": round(time.monotonic() - started, 3)}
+        logger.info(f"{name} 初始化完成，耗时 {self.components[name]['seconds']} 秒")
+        return result
+
+    # 记录同步完成的组件初始化
+    def record(self, name: str, started: float, detail: Optional[str] = None) -> None:
+        self.components[name] = {"status": "ok", "seconds": round(time.monotonic() - started, 3)}
+        if detail:
+            self.components[name]["detail"] = detail
+
+    # 补充组件的说明 如迁移是否执行
+    def annotate(self, name: str, detail: str) -> None:
+        if name in self.components:
+            self.components[name]["detail"] = detail
+
+    # 全部组件初始化完成 开始接收请求
+    def mark_ready(self) -> None:
+        self.total_seconds = round(time.monotonic() - self.started_at, 3)
+        self.ready = True
+        logger.info(f"服务就绪，启动耗时 {self.total_seconds} 秒，各组件耗时: "
+                    f"{ {name: item['seconds'] for name, item in self.components.items()} }")
+
+    # 服务开始关闭 就绪检查失败，负载均衡不再转发新请求
+    def mark_stopping(self) -> None:
+        self.ready = False
+
+    # 启动报告
+    def report(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            # 多进程部署时区分返回报告的工作进程
+            "pid": os.getpid(),
+            "total_seconds": self.total_seconds,
+            # 各组件并发初始化，总耗时接近最慢的组件而不是各组件之和
+            "sum_seconds": round(sum(item["seconds"] for item in self.components.values()), 3),
+            "components": self.components,
+        }
+
+
+# 判断表结构是否已是最新版本 读取迁移表中最大的版本号，迁移表不存在时视为需要迁移
+async def schema_is_current(pool: "AsyncConnectionPool", migrations_table: str, migrations_count: int) -> bool:
+    from psycopg.errors import UndefinedTable
+    async with pool.connection() as conn:
+        try:
+            cursor = await conn.execute(f"SELECT v FROM {migrations_table} ORDER BY v DESC LIMIT 1")
+            row = await cursor.fetchone()
+        except UndefinedTable:
+            return False
+    if row is None:
+        return False
+    version = row["v"] if isinstance(row, dict) else row[0]
+    return version >= migrations_count - 1
+
+
+# 表结构不是最新版本时才执行setup 返回"applied"或"skipped"
+async def setup_if_outdated(pool: "AsyncConnectionPool", saver: Any, migrations_table: str) -> str:
+    """
+    表结构已是最新版本时跳过setup中的DDL迁移
+
+    多个后端进程同时启动时，只有取得该迁移表的PostgreSQL咨询锁的进程执行迁移，
+    其他进程等待锁释放后重新检查版本，此时表结构已是最新，直接跳过
+
+    Args:
+        pool: 数据库连接池
+        saver: 提供setup()和MIGRATIONS的AsyncPostgresSaver或AsyncPostgresStore
+        migrations_table: 记录迁移版本的表名
+
+    Returns:
+        str: 执行了迁移返回"applied"，跳过返回"skipped"
+    """
+    migrations = getattr(saver, "MIGRATIONS", None)
+    # 常见情况表结构已是最新 不加锁直接跳过
+    if migrations and await schema_is_current(pool, migrations_table, len(migrations)):
+        return "skipped"
+    # 会话级咨询锁绑定在连接上 迁移完成后在同一连接上释放，再归还连接池
+    async with pool.connection() as conn:
+        await conn.execute("SELECT pg_advisory_lock(hashtext(%s))", (migrations_table,))
+        try:
+            if migrations and await schema_is_current(pool, migrations_table, len(migrations)):
+                return "skipped"
+            await saver.setup()
+            return "applied"
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(hashtext(%s))", (migrations_table,))
+
+
+# 每个进程连接池的最小上限 并发初始化时两张迁移表各占用一个加锁连接和一个迁移连接
+MIN_WORKER_POOL_SIZE = 4
+
+
+# 每个后端进程的连接池大小 返回(min_size, max_size)，全部进程合计不超过DB_CONNECTION_BUDGET
+def worker_pool_sizes(workers: Optional[int] = None) -> Tuple[int, int]:
+    """
+    按后端进程数均分数据库连接数预算
+
+    Args:
+        workers: 后端进程数，为None时使用Config.WORKERS
+
+    Returns:
+        Tuple[int, int]: 每个进程连接池的(min_size, max_size)
+
+    Raises:
+        ValueError: 均分后每个进程不足MIN_WORKER_POOL_SIZE个连接，无法在预算内完成初始化
+    """
+    workers = workers or Config.WORKERS
+    share = Config.DB_CONNECTION_BUDGET // workers
+    if share < MIN_WORKER_POOL_SIZE:
+        message = (f"数据库连接数预算不足: DB_CONNECTION_BUDGET={Config.DB_CONNECTION_BUDGET}，"
+                   f"{workers}个后端进程每个至少需要{MIN_WORKER_POOL_SIZE}个连接，"
+                   f"请将DB_CONNECTION_BUDGET调大到{workers * MIN_WORKER_POOL_SIZE}以上或减少进程数")
+        logger.error(message)
+        raise ValueError(message)
+    max_size = min(Config.MAX_SIZE, share)
+    return min(Config.MIN_SIZE, max_size), max_size
+
+
+# 进程内共享的启动过程记录
+_startup_tracker = StartupTracker()
+
+
+# 获取启动过程记录
+def get_startup_tracker() -> StartupTracker:
+    return _startup_tracker
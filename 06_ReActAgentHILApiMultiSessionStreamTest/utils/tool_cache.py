@@ -0,0 +1,233 @@
+import re
+import json
+import time
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent_log_handler import ConcurrentRotatingFileHandler
+from typing import Dict, Any, Optional, Tuple
+import redis.asyncio as redis
+from langchain_core.tools import BaseTool
+from .config import Config
+from .spatial_cache import SpatialResultCache, parse_lnglat
+
+
+
+# Author:@南哥AGI研习社 (B站 or YouTube 搜索“南哥AGI研习社”)
+
+
+# 设置日志基本配置，级别为DEBUG或INFO
+logger = logging.getLogger(__name__)
+# 设置日志器级别为DEBUG
+logger.setLevel(logging.DEBUG)
+# logger.setLevel(logging.INFO)
+logger.handlers = []  # 清空默认处理器
+# 使用ConcurrentRotatingFileHandler
+handler = ConcurrentRotatingFileHandler(
+    # 日志文件
+    Config.LOG_FILE,
+    # 日志文件最大允许大小为5MB，达到上限后触发轮转
+    maxBytes = Config.MAX_BYTES,
+    # 在轮转时，最多保留3个历史日志文件
+    backupCount = Config.BACKUP_COUNT
+)
+# 设置处理器级别为DEBUG
+handler.setLevel(logging.DEBUG)
+handler.setFormatter(logging.Formatter(
+    "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+))
+logger.addHandler(handler)
+
+
+# 匹配逗号和分号两侧的空白，包括全角符号
+_SEPARATOR_PATTERN = re.compile(r"\s*([,，;；])\s*")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+# 规范化单个参数值 使语义相同的参数得到相同的缓存键
+def _normalize_value(value: Any) -> Any:
+    if isinstance(value, str):
+        value = _WHITESPACE_PATTERN.sub(" ", value.strip())
+        # 统一全角分隔符，去掉分隔符两侧空白，如"118.79815， 32.01112" -> "118.79815,32.01112"
+        return _SEPARATOR_PATTERN.sub(lambda m: {"，": ",", "；": ";"}.get(m.group(1), m.group(1)), value)
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_value(v) for v in value]
+    return value
+
+
+# 生成规范化的参数键
+def normalize_args(args: Dict[str, Any], ignore_args: Tuple[str, ...] = ()) -> str:
+    normalized = {k: _normalize_value(v) for k, v in args.items() if v is not None and k not in ignore_args}
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+# 工具调用结果缓存 进程内LRU一级缓存 + Redis共享二级缓存
+class ToolResultCache:
+    # 初始化缓存 policies为各工具的缓存策略
+    def __init__(self, redis_client: redis.Redis, policies: Dict[str, Dict[str, Any]]):
+        self.redis_client = redis_client
+        self.policies = policies
+        self._local: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        # 指标数据
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+    # 判断工具结果是否可缓存
+    def is_cacheable(self, tool_name: str) -> bool:
+        policy = self.policies.get(tool_name)
+        return bool(policy) and policy.get("ttl", 0) > 0
+
+    # 生成缓存键
+    def cache_key(self, tool_name: str, args: Dict[str, Any]) -> str:
+        policy = self.policies.get(tool_name, {})
+        raw = normalize_args(args, tuple(policy.get("ignore_args", ())))
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"tool_cache:{tool_name}:{digest}"
+
+    # 读取进程内一级缓存
+    def _get_local(self, key: str) -> Tuple[bool, Any]:
+        item = self._local.get(key)
+        if item is None:
+            return False, None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            self._local.pop(key, None)
+            return False, None
+        self._local.move_to_end(key)
+        return True, value
+
+    # 写入进程内一级缓存 超出容量时淘汰最久未使用的记录
+    def _set_local(self, key: str, value: Any, ttl: int) -> None:
+        self._local[key] = (time.monotonic() + min(ttl, Config.TOOL_CACHE_LOCAL_TTL), value)
+        self._local.move_to_end(key)
+        while len(self._local) > Config.TOOL_CACHE_LOCAL_MAX_ITEMS:
+            self._local.popitem(last=False)
+
+    # 查询缓存 返回(是否命中, 缓存结果)
+    async def get(self, tool_name: str, args: Dict[str, Any]) -> Tuple[bool, Any]:
+        key = self.cache_key(tool_name, args)
+        hit, value = self._get_local(key)
+        if hit:
+            self.stats["local_hits"] += 1
+            return True, value
+        try:
+            raw = await self.redis_client.get(key)
+        except Exception as e:
+            # 缓存不可用时不影响工具调用
+            self.stats["errors"] += 1
+            logger.warning(f"读取工具结果缓存失败: {e}")
+            return False, None
+        if raw is None:
+            self.stats["misses"] += 1
+            return False, None
+        try:
+            value = json.loads(raw)["value"]
+        except Exception as e:
+            # 缓存记录损坏时按未命中处理，工具调用后重新写入
+            self.stats["errors"] += 1
+            logger.warning(f"解析工具结果缓存失败: {e!r}")
+            return False, None
+        self.stats["redis_hits"] += 1
+        self._set_local(key, value, self.policies[tool_name]["ttl"])
+        return True, value
+
+    # 写入缓存
+    async def set(self, tool_name: str, args: Dict[str, Any], value: Any) -> None:
+        key = self.cache_key(tool_name, args)
+        ttl = self.policies[tool_name]["ttl"]
+        self._set_local(key, value, ttl)
+        try:
+            await self.redis_client.set(key, json.dumps({"value": value}, ensure_ascii=False), ex=ttl)
+            self.stats["stores"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"写入工具结果缓存失败: {e}")
+
+    # 缓存指标
+    def metrics(self) -> Dict[str, Any]:
+        lookups = self.stats["local_hits"] + self.stats["redis_hits"] + self.stats["misses"]
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "local_items": len(self._local),
+        }
+
+
+# 进程内共享的工具结果缓存和空间缓存
+_tool_result_cache: Optional[ToolResultCache] = None
+_spatial_result_cache: Optional[SpatialResultCache] = None
+
+
+# 初始化工具结果缓存 在服务启动时传入Redis客户端
+def init_tool_result_cache(redis_client: redis.Redis) -> Optional[ToolResultCache]:
+    global _tool_result_cache, _spatial_result_cache
+    if Config.TOOL_CACHE_ENABLED:
+        _tool_result_cache = ToolResultCache(redis_client, Config.TOOL_CACHE_POLICIES)
+        _spatial_result_cache = SpatialResultCache(redis_client, Config.TOOL_SPATIAL_CACHE_POLICIES)
+        logger.info(f"工具结果缓存初始化成功，可缓存工具: {list(Config.TOOL_CACHE_POLICIES.keys())}，"
+                    f"空间缓存工具: {list(Config.TOOL_SPATIAL_CACHE_POLICIES.keys())}")
+    return _tool_result_cache
+
+
+# 获取工具结果缓存指标
+def get_tool_cache_metrics() -> Dict[str, Any]:
+    if _tool_result_cache is None:
+        return {}
+    metrics = _tool_result_cache.metrics()
+    if _spatial_result_cache is not None:
+        metrics["spatial"] = _spatial_result_cache.metrics()
+    return metrics
+
+
+# 调用坐标类工具 容差半径内已有缓存结果时直接返回
+async def _spatial_cached_ainvoke(tool: BaseTool, tool_input: Dict[str, Any], policy: Dict[str, Any]) -> Tuple[bool, Any]:
+    point = parse_lnglat(_normalize_value(tool_input.get(policy["coord_arg"])))
+    if point is None:
+        return False, None
+    lng, lat = point
+    # 坐标以外的参数必须完全一致才能复用结果
+    args_key = normalize_args(tool_input, (policy["coord_arg"],))
+    hit, value = await _spatial_result_cache.get(tool.name, lng, lat, args_key)
+    if hit:
+        return True, value
+    value = await tool.ainvoke(input=tool_input)
+    if isinstance(value, (str, int, float, list, dict)):
+        await _spatial_result_cache.set(tool.name, lng, lat, args_key, value)
+    return True, value
+
+
+# 调用工具 可缓存的工具优先返回缓存结果
+async def cached_tool_ainvoke(tool: BaseTool, tool_input: Dict[str, Any]) -> Any:
+    """
+    调用工具，对配置了缓存策略的幂等工具使用结果缓存
+
+    Args:
+        tool: 原始工具
+        tool_input: 工具调用参数
+
+    Returns:
+        工具调用结果
+    """
+    # 坐标类工具优先使用空间缓存，坐标无法解析时回退到按参数精确匹配的缓存
+    spatial_policy = _spatial_result_cache.policy_for(tool.name) if _spatial_result_cache is not None else None
+    if spatial_policy:
+        handled, value = await _spatial_cached_ainvoke(tool, tool_input, spatial_policy)
+        if handled:
+            return value
+
+    cache = _tool_result_cache
+    if cache is None or not cache.is_cacheable(tool.name):
+        return await tool.ainvoke(input=tool_input)
+    hit, value = await cache.get(tool.name, tool_input)
+    if hit:
+        logger.info(f"工具 {tool.name} 命中结果缓存，参数: {tool_input}")
+        return value
+    value = await tool.ainvoke(input=tool_input)
+    # 只缓存可JSON序列化的正常结果
+    if isinstance(value, (str, int, float, list, dict)):
+        await cache.set(tool.name, tool_input, value)
+    return value
@@ -7,7 +7,11 @@ from langgraph.prebuilt.interrupt import HumanInterruptConfig, HumanInterrupt
 from langgraph.types import interrupt, Command
 from langchain_core.tools import tool
 from .config import Config
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from .http_client import mcp_httpx_client_factory
+from .mcp_cache import get_cached_mcp_tools
+from .tool_cache import cached_tool_ainvoke
+from .approval_policy import decide_tool_approval, AUTO_ACCEPT, REJECT
+from .speculation import get_speculative_runner, is_speculative_tool, speculation_key
 
 
 
@@ -37,6 +41,18 @@ handler.setFormatter(logging.Formatter(
 logger.addHandler(handler)
 
 
+# MCP Server连接配置
+MCP_SERVERS = {
+    # 高德地图MCP Server
+    "amap-amap-sse": {
+        "url": "https://mcp.amap.com/sse?key=848232bewe1987634de9ew23e19wewed61265e50bb0757",
+        "transport": "sse",
+        # 使用与模型客户端一致的连接池配置
+        "httpx_client_factory": mcp_httpx_client_factory,
+    }
+}
+
+
 # 为工具添加人工审查（human-in-the-loop）功能
 async def add_human_in_the_loop(
         tool: Callable | BaseTool,
@@ -75,17 +91,38 @@ async def add_human_in_the_loop(
             "config": interrupt_config,
             "description": f"准备调用 {tool.name} 工具：\n- 参数为: {tool_input}\n\n是否允许继续？\n输入 'yes' 接受工具调用\n输入 'no' 拒绝工具调用\n输入 'edit' 修改工具参数后调用工具\n输入 'response' 不调用工具直接反馈信息",
         }
-        # 调用 interrupt 函数，获取人工审查的响应（取第一个响应）
-        response = interrupt(request)
+        # 按审批策略决定是否需要人工审查，低风险调用自动放行，禁止的调用直接拒绝
+        user_id = config.get("configurable", {}).get("user_id")
+        call_key = speculation_key(config, tool.name, tool_input)
+        decision = await decide_tool_approval(tool.name, user_id, tool_input, call_key)
+        speculative = False
+        if decision == AUTO_ACCEPT:
+            response = {"type": "accept", "args": None}
+        elif decision == REJECT:
+            response = {"type": "reject", "args": None}
+        else:
+            # 无副作用的工具在等待人工审查期间预先执行，用人工审查的时间掩盖工具调用耗时
+            speculative = is_speculative_tool(tool.name)
+            if speculative:
+                get_speculative_runner().start(call_key, lambda: cached_tool_ainvoke(tool, dict(tool_input)))
+            # 调用 interrupt 函数，获取人工审查的响应（取第一个响应）
+            response = interrupt(request)
         logger.info(f"response: {response}")
 
+        # 审查结果不是原样接受时丢弃预执行结果
+        if speculative and response["type"] != "accept":
+            get_speculative_runner().discard(call_key)
+
         # 检查响应类型是否为“接受”（accept）
         if response["type"] == "accept":
             logger.info("工具调用已批准，执行中...")
             logger.info(f"调用工具: {tool.name}, 参数: {tool_input}")
             try:
-                # 如果接受，直接调用原始工具并传入输入参数
-                tool_response = await tool.ainvoke(input=tool_input)
+                # 优先使用等待审查期间预执行的结果
+                handled, tool_response = await get_speculative_runner().take(call_key) if speculative else (False, None)
+                if not handled:
+                    # 如果接受，直接调用原始工具并传入输入参数 幂等工具优先使用结果缓存
+                    tool_response = await cached_tool_ainvoke(tool, tool_input)
                 logger.info(tool_response)
             except Exception as e:
                 logger.error(f"工具调用失败: {e}")
@@ -96,7 +133,7 @@ async def add_human_in_the_loop(
             tool_input = response["args"]["args"]
             try:
                 # 使用更新后的参数调用原始工具
-                tool_response = await tool.ainvoke(input=tool_input)
+                tool_response = await cached_tool_ainvoke(tool, tool_input)
                 logger.info(tool_response)
             except Exception as e:
                 logger.error(f"工具调用失败: {e}")
@@ -121,8 +158,8 @@ async def add_human_in_the_loop(
     return call_tool_with_interrupt
 
 
-# 获取工具列表 提供给第三方调用
-async def get_tools():
+# 获取工具列表 提供给第三方调用 首次启动未能加载MCP工具时，后台加载成功后以新的工具列表调用on_tools_changed
+async def get_tools(on_tools_changed=None):
     # 自定义工具 模拟酒店预定工具
     @tool("book_hotel", description="酒店预定工具")
     async def book_hotel(hotel_name: str):
@@ -174,24 +211,23 @@ async def get_tools():
         result = a * b
         return f"{a}乘以{b}等于{result}。"
 
+    # 为工具添加人工审查并追加自定义工具
+    async def build_tools(mcp_tools):
+        tools = [await add_human_in_the_loop(index) for index in mcp_tools]
+        tools.append(await add_human_in_the_loop(book_hotel))
+        tools.append(await add_human_in_the_loop(multiply))
+        tools.append(await add_human_in_the_loop(generate_image))
+        return tools
+
+    # 首次发现失败的MCP工具在后台发现成功后，以完整的工具列表通知调用方
+    async def on_discovered(mcp_tools):
+        if on_tools_changed is not None:
+            await on_tools_changed(await build_tools(mcp_tools))
+
     # MCP Server工具 高德地图
-    client = MultiServerMCPClient({
-        # 高德地图MCP Server
-        "amap-amap-sse": {
-            "url": "https://mcp.amap.com/sse?key=848232bewe1987634de9ew23e19wewed61265e50bb0757",
-            "transport": "sse",
-        }
-    })
-    # 从MCP Server中获取可提供使用的全部工具
-    amap_tools = await client.get_tools()
+    # 优先从磁盘缓存加载工具描述，工具首次被调用时才连接MCP Server
+    amap_tools = await get_cached_mcp_tools(MCP_SERVERS, on_discovered)
     print("所有工具:",amap_tools)
-    # 为工具添加人工审查
-    tools = [await add_human_in_the_loop(index) for index in amap_tools]
-
-    # 追加自定义工具并添加人工审查
-    tools.append(await add_human_in_the_loop(book_hotel))
-    tools.append(await add_human_in_the_loop(multiply))
-    tools.append(await add_human_in_the_loop(generate_image))
 
     # 返回工具列表
-    return tools
\ No newline at end of file
+    return await build_tools(amap_tools)